@@ -0,0 +1,312 @@
+"""
+Portfolio analytics for the stock importer application.
+
+Works on holdings as aligned NumPy arrays (one entry per ticker) and on
+daily closes from the HistoryStore as a days x tickers matrix, so every
+figure is a handful of array operations no matter how many holdings
+there are. PortfolioAnalytics caches its results and only recomputes when
+the holdings or the recorded history change.
+
+Returns are simple daily returns of daily closes. Days a ticker has no
+close are filled with its previous close, and days before its first
+close are left as NaN.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Mapping, Optional, Sequence, Tuple
+import hashlib
+import logging
+import threading
+import numpy as np
+from columnar import ColumnarPortfolio, TIME_DTYPE
+from history import HistoryStore
+from models import Portfolio
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS = 252  # Used to annualize volatility
+DEFAULT_WINDOW = 21  # Trading days in a rolling return (about a month)
+DEFAULT_CONFIDENCE = 0.95
+CACHE_SIZE = 8  # Results kept by PortfolioAnalytics
+
+def holdings_arrays(portfolio: Portfolio) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Get a portfolio's holdings as aligned arrays.
+
+    Returns:
+        (tickers, quantities as float64, prices as float64)
+    """
+    if isinstance(portfolio, ColumnarPortfolio):
+        tickers, quantities, prices, _ = portfolio.columns()
+        return list(tickers), quantities.astype(np.float64), prices.copy()
+    holdings = portfolio.get_holdings()
+    count = len(holdings)
+    quantities = np.fromiter((s.quantity for s in holdings.values()), dtype=np.float64, count=count)
+    prices = np.fromiter((s.price for s in holdings.values()), dtype=np.float64, count=count)
+    return list(holdings), quantities, prices
+
+def align_closes(
+    closes: Mapping[str, Tuple[np.ndarray, np.ndarray]],
+    tickers: Sequence[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Put per-ticker daily closes on one shared calendar.
+
+    Args:
+        closes: Ticker -> (days, closes), as returned by HistoryStore.daily_closes
+        tickers: Column order of the result
+
+    Returns:
+        (days, matrix) where matrix[i, j] is tickers[j]'s close on days[i],
+        carried forward over missing days and NaN before its first close
+    """
+    series = [closes.get(ticker, (np.empty(0, TIME_DTYPE), np.empty(0))) for ticker in tickers]
+    all_days = [np.asarray(d, dtype=TIME_DTYPE) for d, _ in series]
+    days = np.unique(np.concatenate(all_days)) if all_days else np.empty(0, TIME_DTYPE)
+    matrix = np.full((len(days), len(tickers)), np.nan)
+    if not len(days):
+        return days, matrix
+
+    # Row of each day's close, then carry the last filled row forward. Rows
+    # before a ticker's first close point at row 0, which is still NaN.
+    filled = np.zeros((len(days), len(tickers)), dtype=bool)
+    for column, (ticker_days, values) in enumerate(series):
+        if len(ticker_days):
+            rows = np.searchsorted(days, np.asarray(ticker_days, dtype=TIME_DTYPE))
+            matrix[rows, column] = values
+            filled[rows, column] = True
+    source = np.where(filled, np.arange(len(days))[:, None], 0)
+    np.maximum.accumulate(source, axis=0, out=source)
+    return days, matrix[source, np.arange(len(tickers))]
+
+def daily_returns(matrix: np.ndarray) -> np.ndarray:
+    """Simple returns between consecutive rows (one row shorter)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return matrix[1:] / matrix[:-1] - 1.0
+
+def rolling_returns(matrix: np.ndarray, window: int = DEFAULT_WINDOW) -> np.ndarray:
+    """
+    Return over each trailing window of rows.
+
+    Returns:
+        Array of shape (rows - window, tickers); row i is the return from
+        row i to row i + window
+    """
+    if window <= 0:
+        raise ValueError("window must be positive")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return matrix[window:] / matrix[:-window] - 1.0
+
+def volatility(returns: np.ndarray, periods: int = TRADING_DAYS) -> np.ndarray:
+    """Annualized standard deviation of each column, ignoring NaNs."""
+    counts = np.sum(~np.isnan(returns), axis=0)
+    result = np.full(returns.shape[1], np.nan)
+    enough = counts > 1
+    if enough.any():
+        result[enough] = np.nanstd(returns[:, enough], axis=0, ddof=1) * np.sqrt(periods)
+    return result
+
+def correlation(returns: np.ndarray) -> np.ndarray:
+    """
+    Correlation matrix of the columns.
+
+    Missing returns count as the column's mean, and constant columns
+    correlate as NaN.
+    """
+    if returns.shape[0] < 2:
+        return np.full((returns.shape[1], returns.shape[1]), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centered = returns - np.nanmean(returns, axis=0)
+        centered = np.nan_to_num(centered, nan=0.0)
+        scale = np.sqrt(np.sum(centered * centered, axis=0))
+        normalized = centered / scale
+        result = normalized.T @ normalized
+    result[:, scale == 0] = np.nan
+    result[scale == 0, :] = np.nan
+    return result
+
+def historical_var(
+    returns: np.ndarray,
+    weights: np.ndarray,
+    value: float,
+    confidence: float = DEFAULT_CONFIDENCE
+) -> float:
+    """
+    One-day historical value at risk.
+
+    Replays each past day's returns on today's weights and takes the loss
+    that was only exceeded on (1 - confidence) of days. Missing returns
+    count as zero.
+
+    Returns:
+        Loss in currency, as a positive number (0.0 with no history)
+    """
+    if not 0.0 < confidence < 1.0:
+        raise ValueError("confidence must be between 0 and 1")
+    if not len(returns):
+        return 0.0
+    portfolio_returns = np.nan_to_num(returns, nan=0.0) @ weights
+    return float(max(0.0, -np.quantile(portfolio_returns, 1.0 - confidence) * value))
+
+@dataclass
+class AnalyticsResult:
+    """
+    Analytics for one portfolio at one point in time.
+
+    Per-ticker arrays follow the order of tickers.
+
+    Attributes:
+        tickers: Stock symbols
+        values: Market value of each holding
+        total_value: Sum of values
+        pnl: Profit or loss of each holding against its cost
+        total_pnl: Sum of pnl
+        weights: Share of total value in each holding
+        days: Days of the close matrix
+        closes: Daily closes, days x tickers
+        rolling_returns: Returns over each trailing window, one row per window end
+        volatility: Annualized volatility of daily returns per ticker
+        correlation: Correlation matrix of daily returns, tickers x tickers
+        var: One-day historical value at risk of the whole portfolio
+    """
+    tickers: List[str]
+    values: np.ndarray
+    total_value: float
+    pnl: np.ndarray
+    total_pnl: float
+    weights: np.ndarray
+    days: np.ndarray
+    closes: np.ndarray
+    rolling_returns: np.ndarray
+    volatility: np.ndarray
+    correlation: np.ndarray
+    var: float
+
+class PortfolioAnalytics:
+    """
+    Computes and caches AnalyticsResult for portfolios.
+
+    A result is reused while the holdings, the history version, the date
+    range and the parameters are all unchanged.
+    """
+
+    def __init__(
+        self,
+        history: Optional[HistoryStore] = None,
+        window: int = DEFAULT_WINDOW,
+        confidence: float = DEFAULT_CONFIDENCE,
+        cache_size: int = CACHE_SIZE
+    ) -> None:
+        """
+        Initialize the engine.
+
+        Args:
+            history: Source of daily closes (defaults to a HistoryStore on
+                config.HISTORY_DIR)
+            window: Trading days per rolling return
+            confidence: VaR confidence level
+            cache_size: Number of results to keep
+        """
+        self._history = history if history is not None else HistoryStore()
+        self._window = window
+        self._confidence = confidence
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[tuple, AnalyticsResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compute(
+        self,
+        portfolio: Portfolio,
+        cost_basis: Optional[Mapping[str, float]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> AnalyticsResult:
+        """
+        Get analytics for a portfolio, from cache if nothing changed.
+
+        Args:
+            portfolio: Holdings to analyse
+            cost_basis: Cost per share by ticker. Tickers without one are
+                measured against their first close in the range, which
+                makes pnl the profit or loss over the period.
+            start: First day of history to use
+            end: Last day of history to use
+
+        Returns:
+            AnalyticsResult (shared with other callers; don't modify it)
+        """
+        tickers, quantities, prices = holdings_arrays(portfolio)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("\0".join(tickers).encode())
+        digest.update(quantities.tobytes())
+        digest.update(prices.tobytes())
+        if cost_basis:
+            digest.update(repr(sorted(cost_basis.items())).encode())
+        key = (digest.digest(), self._history.version, start, end)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        result = self._compute(tickers, quantities, prices, cost_basis or {}, start, end)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _compute(
+        self,
+        tickers: List[str],
+        quantities: np.ndarray,
+        prices: np.ndarray,
+        cost_basis: Mapping[str, float],
+        start: Optional[datetime],
+        end: Optional[datetime]
+    ) -> AnalyticsResult:
+        days, closes = align_closes(self._history.daily_closes(tickers, start, end), tickers)
+
+        values = quantities * prices
+        total_value = float(values.sum())
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weights = values / total_value if total_value else np.zeros_like(values)
+
+        # First close in the range, for tickers without a cost basis
+        if len(days):
+            has_close = ~np.isnan(closes)
+            first_close = closes[np.argmax(has_close, axis=0), np.arange(len(tickers))]
+        else:
+            first_close = np.full(len(tickers), np.nan)
+        costs = np.array([cost_basis.get(t, np.nan) for t in tickers], dtype=np.float64)
+        costs = np.where(np.isnan(costs), first_close, costs)
+        # No cost and no history: nothing to measure against
+        pnl = np.where(np.isnan(costs), 0.0, (prices - costs) * quantities)
+
+        returns = daily_returns(closes)
+        return AnalyticsResult(
+            tickers=tickers,
+            values=values,
+            total_value=total_value,
+            pnl=pnl,
+            total_pnl=float(pnl.sum()),
+            weights=weights,
+            days=days,
+            closes=closes,
+            rolling_returns=rolling_returns(closes, self._window) if len(days) > self._window
+                else np.empty((0, len(tickers))),
+            volatility=volatility(returns),
+            correlation=correlation(returns),
+            var=historical_var(returns, weights, total_value, self._confidence)
+        )
+
+    def clear(self) -> None:
+        """Drop every cached result."""
+        with self._lock:
+            self._cache.clear()
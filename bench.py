@@ -0,0 +1,344 @@
+"""
+Benchmarks for the stock importer application.
+
+Times the hot paths (storage, portfolio updates and the table rebuild) on
+synthetic portfolios, writes the results as JSON, and compares a run
+against a saved baseline. Portfolios and prices are generated from a seed
+and prices come from FakePriceProvider, so two runs do the same work.
+
+Usage:
+    python bench.py run --out baseline.json
+    python bench.py run --sizes 1000 100000 --out current.json
+    python bench.py compare baseline.json current.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+import config
+from models import Portfolio, Stock
+from providers import FakePriceProvider
+from storage import StorageManager
+from snapshot import snapshot_path
+from viewport import SlotCache, format_row, visible_range
+
+SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_REPEAT = 3
+# Slowdown of the median, as a fraction, that counts as a regression
+DEFAULT_THRESHOLD = 0.10
+# Rows the holdings table shows at its default window size
+TABLE_ROWS = 20
+
+@dataclass
+class BenchResult:
+    """
+    Timings for one benchmark at one portfolio size.
+
+    Attributes:
+        name: Benchmark name
+        size: Number of holdings
+        times: Seconds taken by each repeat
+    """
+    name: str
+    size: int
+    times: List[float] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        """Name and size, used to match results across runs."""
+        return f"{self.name}[{self.size}]"
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.times)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a JSON-friendly dict."""
+        return {
+            "name": self.name,
+            "size": self.size,
+            "min": min(self.times),
+            "median": self.median,
+            "mean": statistics.mean(self.times),
+            "times": self.times
+        }
+
+def make_stocks(count: int, seed: int = 0) -> List[Stock]:
+    """
+    Generate holdings.
+
+    Args:
+        count: Number of holdings
+        seed: Changes the quantities, prices and times
+
+    Returns:
+        Stocks with unique tickers
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 2, 9, 30)
+    return [
+        Stock(
+            ticker=f"S{i:07d}",
+            quantity=rng.randint(1, 1000),
+            price=round(rng.uniform(1.0, 500.0), 2),
+            last_updated=start + timedelta(seconds=rng.randint(0, 86_400))
+        )
+        for i in range(count)
+    ]
+
+def make_portfolio(count: int, seed: int = 0) -> Portfolio:
+    """
+    Generate a portfolio priced by a FakePriceProvider.
+
+    Args:
+        count: Number of holdings
+        seed: Seed for the holdings and the provider
+    """
+    portfolio = Portfolio(provider=FakePriceProvider(seed=seed))
+    for stock in make_stocks(count, seed):
+        portfolio.add_stock(stock)
+    return portfolio
+
+@contextmanager
+def temp_stocks_file() -> Iterator[Path]:
+    """Point config.STOCKS_FILE at a temporary file for the duration."""
+    directory = Path(tempfile.mkdtemp(prefix="stock-bench-"))
+    original = config.STOCKS_FILE
+    config.STOCKS_FILE = directory / "stocks.csv"
+    try:
+        yield config.STOCKS_FILE
+    finally:
+        config.STOCKS_FILE = original
+        shutil.rmtree(directory, ignore_errors=True)
+
+def time_calls(
+    fn: Callable[[Any], Any],
+    repeat: int,
+    setup: Optional[Callable[[], Any]] = None
+) -> List[float]:
+    """
+    Time a function several times.
+
+    Setup runs untimed before each call and its result is passed to the
+    function. Garbage is collected before each timed call.
+
+    Returns:
+        Seconds taken by each call
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        gc.collect()
+        start = time.perf_counter()
+        fn(state)
+        times.append(time.perf_counter() - start)
+    return times
+
+def rebuild_table(portfolio: Portfolio, rows: int = TABLE_ROWS) -> int:
+    """
+    Do the work of a holdings table redraw, minus Tk.
+
+    Mirrors HoldingsTable.set_holdings: copy the holdings, take their
+    order and format the visible rows.
+
+    Returns:
+        Number of cells that would be reconfigured
+    """
+    holdings = portfolio.get_holdings()
+    order = list(holdings)
+    cache = SlotCache()
+    start, stop = visible_range(len(order), 0, rows)
+    changed = 0
+    for slot, index in enumerate(range(start, stop)):
+        changed += len(cache.diff(slot, format_row(holdings[order[index]])))
+    return changed
+
+def _bench_add_stock(size: int, repeat: int, seed: int) -> List[float]:
+    stocks = make_stocks(size, seed)
+
+    def add_all(portfolio: Portfolio) -> None:
+        for stock in stocks:
+            portfolio.add_stock(stock)
+
+    return time_calls(add_all, repeat, setup=Portfolio)
+
+def _bench_total_value(size: int, repeat: int, seed: int) -> List[float]:
+    portfolio = make_portfolio(size, seed)
+    return time_calls(lambda _: portfolio.get_total_value(), repeat)
+
+def _bench_update_prices(size: int, repeat: int, seed: int) -> List[float]:
+    portfolio = make_portfolio(size, seed)
+    return time_calls(lambda _: portfolio.update_prices(), repeat)
+
+def _bench_save(size: int, repeat: int, seed: int) -> List[float]:
+    portfolio = make_portfolio(size, seed)
+    with temp_stocks_file():
+        return time_calls(lambda _: StorageManager.save_portfolio(portfolio), repeat)
+
+def _bench_load(size: int, repeat: int, seed: int) -> List[float]:
+    with temp_stocks_file():
+        StorageManager.save_portfolio(make_portfolio(size, seed))
+        return time_calls(lambda _: StorageManager.load_portfolio(), repeat)
+
+def _bench_load_csv(size: int, repeat: int, seed: int) -> List[float]:
+    with temp_stocks_file() as path:
+        StorageManager.save_portfolio(make_portfolio(size, seed))
+        snapshot_path(path).unlink()
+        return time_calls(lambda _: StorageManager.load_portfolio(), repeat)
+
+def _bench_table_rebuild(size: int, repeat: int, seed: int) -> List[float]:
+    portfolio = make_portfolio(size, seed)
+    return time_calls(lambda _: rebuild_table(portfolio), repeat)
+
+# Benchmark name -> function(size, repeat, seed) returning timings
+BENCHMARKS: Dict[str, Callable[[int, int, int], List[float]]] = {
+    "add_stock": _bench_add_stock,
+    "get_total_value": _bench_total_value,
+    "update_prices": _bench_update_prices,
+    "save_portfolio": _bench_save,
+    "load_portfolio": _bench_load,
+    "load_portfolio_csv": _bench_load_csv,
+    "table_rebuild": _bench_table_rebuild,
+}
+
+def run(
+    sizes: Sequence[int] = SIZES,
+    repeat: int = DEFAULT_REPEAT,
+    names: Optional[Sequence[str]] = None,
+    seed: int = 0,
+    verbose: bool = False
+) -> Dict[str, Any]:
+    """
+    Run benchmarks.
+
+    Args:
+        sizes: Portfolio sizes to run each benchmark at
+        repeat: Timed calls per benchmark and size
+        names: Benchmarks to run (defaults to all of BENCHMARKS)
+        seed: Seed for the generated data
+        verbose: Print each result to stderr as it finishes
+
+    Returns:
+        Report with environment details and a result per benchmark and size
+
+    Raises:
+        ValueError: If a name isn't a known benchmark
+    """
+    names = list(names or BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    results = []
+    for size in sizes:
+        for name in names:
+            result = BenchResult(name, size, BENCHMARKS[name](size, repeat, seed))
+            results.append(result)
+            if verbose:
+                print(f"{result.key:<40} {result.median * 1000:>12.3f} ms", file=sys.stderr)
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "results": [result.to_dict() for result in results]
+    }
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD
+) -> List[Dict[str, Any]]:
+    """
+    Compare two reports by median time.
+
+    Only benchmarks present in both reports are compared.
+
+    Args:
+        baseline: Report to compare against
+        current: New report
+        threshold: Slowdown fraction that counts as a regression
+
+    Returns:
+        A row per benchmark with both medians, their ratio and whether it regressed
+    """
+    def by_key(report):
+        return {f"{r['name']}[{r['size']}]": r for r in report["results"]}
+
+    old = by_key(baseline)
+    rows = []
+    for key, result in by_key(current).items():
+        if key not in old:
+            continue
+        before, after = old[key]["median"], result["median"]
+        ratio = after / before if before else float("inf")
+        rows.append({
+            "benchmark": key,
+            "baseline": before,
+            "current": after,
+            "ratio": ratio,
+            "regressed": ratio > 1.0 + threshold
+        })
+    return rows
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the benchmark command line.
+
+    Returns:
+        Exit code: 1 if compare found a regression, 0 otherwise
+    """
+    parser = argparse.ArgumentParser(description="Stock importer benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--out", help="write JSON here instead of stdout")
+
+    compare_parser = commands.add_parser("compare", help="compare a run against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        report = run(args.sizes, args.repeat, args.only, args.seed, verbose=True)
+        text = json.dumps(report, indent=2)
+        if args.out:
+            Path(args.out).write_text(text)
+        else:
+            print(text)
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    rows = compare(baseline, current, args.threshold)
+
+    print(f"{'benchmark':<40} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for row in rows:
+        flag = "  REGRESSED" if row["regressed"] else ""
+        print(f"{row['benchmark']:<40} {row['baseline'] * 1000:>12.3f} "
+              f"{row['current'] * 1000:>12.3f} {row['ratio']:>7.2f}{flag}")
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Quote caches for the stock importer application.
+
+QuoteCache keeps quotes in memory for a fixed time-to-live and evicts the
+least recently used ones once it's full. QuoteStore keeps them in an
+SQLite file under the data directory, so other processes and later runs
+reuse them. CachingPriceProvider wraps any PriceProvider so the GUI and
+portfolio refresh share the same caches.
+
+With a QuoteStore, quotes a little past their time-to-live are still
+served (stale-while-revalidate) while a background thread fetches new
+ones, so a lookup only waits for the network when a quote is missing or
+too old.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Union
+import logging
+import sqlite3
+import threading
+import time
+import config
+import db
+from config import QUOTE_CACHE_TTL, QUOTE_CACHE_SIZE, QUOTE_STALE_TTL
+from providers import PriceProvider
+
+logger = logging.getLogger(__name__)
+
+class QuoteCache:
+    """Thread-safe TTL cache with LRU eviction and hit/miss counters."""
+
+    def __init__(
+        self,
+        ttl: float = QUOTE_CACHE_TTL,
+        max_entries: int = QUOTE_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: Seconds a quote stays fresh
+            max_entries: Maximum number of quotes kept
+            clock: Time source, replaceable in tests
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, ticker: str) -> Optional[float]:
+        """
+        Get a fresh cached price.
+
+        Args:
+            ticker: Stock symbol
+
+        Returns:
+            The cached price, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(ticker)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            price, stored_at = entry
+            if self._clock() - stored_at >= self._ttl:
+                del self._entries[ticker]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(ticker)
+            self.hits += 1
+            return price
+
+    def put(self, ticker: str, price: float, age: float = 0.0) -> None:
+        """
+        Store a price, evicting the least recently used entry if full.
+
+        Args:
+            ticker: Stock symbol
+            price: Price per share
+            age: Seconds since the price was fetched; it expires that much sooner
+        """
+        with self._lock:
+            self._entries[ticker] = (price, self._clock() - age)
+            self._entries.move_to_end(ticker)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached quote."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the cache counters."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class QuoteStore:
+    """
+    Quotes in an SQLite table keyed on source and ticker, with the time
+    each was fetched.
+
+    Any number of processes can read and write the same file: WAL mode
+    lets readers run alongside a writer, and a write only replaces a quote
+    with a newer one. Quotes from different providers are kept apart by
+    source, so fake prices never stand in for real ones.
+    """
+
+    _UPSERT = (
+        "INSERT INTO quotes (source, ticker, price, fetched_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(source, ticker) DO UPDATE SET price = excluded.price, "
+        "fetched_at = excluded.fetched_at WHERE excluded.fetched_at >= quotes.fetched_at"
+    )
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        source: str = "default",
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        """
+        Open (and create if needed) the quote database.
+
+        Args:
+            path: SQLite file (defaults to config.QUOTE_STORE_FILE)
+            source: Name of the provider the quotes come from
+            clock: Wall-clock time source, shared by every process using the file
+        """
+        self._path = Path(path if path is not None else config.QUOTE_STORE_FILE)
+        self.source = source
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = db.connect(self._path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS quotes ("
+                "source TEXT NOT NULL, "
+                "ticker TEXT NOT NULL, "
+                "price REAL NOT NULL, "
+                "fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (source, ticker)"
+                ") WITHOUT ROWID"
+            )
+
+    def get_many(self, tickers: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+        """
+        Look up stored quotes.
+
+        Returns:
+            Ticker -> (price, fetch time) for the tickers that have a quote
+        """
+        tickers = list(tickers)
+        found = {}
+        with self._lock:
+            rows = db.select_in(
+                self._conn,
+                "SELECT ticker, price, fetched_at FROM quotes WHERE source = ? AND ticker IN ({})",
+                tickers,
+                [self.source]
+            )
+            for ticker, price, fetched_at in rows:
+                found[ticker] = (price, fetched_at)
+        return found
+
+    def get(self, ticker: str) -> Optional[Tuple[float, float]]:
+        """Get (price, fetch time) for one ticker, or None."""
+        return self.get_many([ticker]).get(ticker)
+
+    def put_many(self, prices: Mapping[str, float], fetched_at: Optional[float] = None) -> None:
+        """
+        Store quotes fetched at one time.
+
+        Args:
+            prices: Ticker -> price
+            fetched_at: When they were fetched (defaults to now)
+        """
+        if not prices:
+            return
+        fetched_at = fetched_at if fetched_at is not None else self.clock()
+        rows = [(self.source, ticker, price, fetched_at) for ticker, price in prices.items()]
+        with self._lock, self._conn:
+            self._conn.executemany(self._UPSERT, rows)
+
+    def prune(self, older_than: float) -> int:
+        """
+        Delete quotes fetched more than `older_than` seconds ago, from every source.
+
+        Returns:
+            Number of quotes deleted
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM quotes WHERE fetched_at < ?", (self.clock() - older_than,)
+            )
+            return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM quotes WHERE source = ?", (self.source,)
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+class CachingPriceProvider(PriceProvider):
+    """
+    Serves fresh quotes from a QuoteCache, then from a QuoteStore if there
+    is one, and fetches only the rest.
+
+    quote_times() reports the fetch time of stale quotes, so callers can
+    stamp holdings with when the price was really quoted.
+
+    Attributes:
+        store_hits: Quotes served fresh from the store
+        stale_served: Stale quotes served from the store while being revalidated
+        revalidations: Background fetches started for stale quotes
+    """
+
+    def __init__(
+        self,
+        provider: PriceProvider,
+        cache: Optional[QuoteCache] = None,
+        store: Optional[QuoteStore] = None,
+        ttl: float = QUOTE_CACHE_TTL,
+        stale_ttl: float = QUOTE_STALE_TTL
+    ) -> None:
+        """
+        Initialize the caching provider.
+
+        Args:
+            provider: Provider used on a cache miss
+            cache: Cache to use (a new one with default settings if omitted)
+            store: Persistent quotes shared with other processes (None for memory only)
+            ttl: Seconds a stored quote is fresh
+            stale_ttl: Seconds past ttl a stored quote is still served while
+                it's fetched again in the background
+        """
+        self._provider = provider
+        self.cache = cache if cache is not None else QuoteCache()
+        self.store = store
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._revalidating: Set[str] = set()
+        self._futures: Set[Future] = set()
+        # Ticker -> fetch time, for tickers whose last served quote was stale
+        self._stale_times: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.store_hits = 0
+        self.stale_served = 0
+        self.revalidations = 0
+
+    def _remember(self, prices: Mapping[str, float]) -> None:
+        """Put freshly fetched prices in both caches."""
+        for ticker, price in prices.items():
+            self.cache.put(ticker, price)
+        if self.store is not None:
+            try:
+                self.store.put_many(prices)
+            except sqlite3.Error as e:
+                logger.error(f"Could not store quotes: {e}")
+
+    def _from_store(
+        self,
+        tickers: List[str],
+        prices: Dict[str, float],
+        stale_times: Dict[str, float]
+    ) -> List[str]:
+        """
+        Fill `prices` from the store and start revalidating stale quotes.
+
+        Args:
+            tickers: Tickers to look up
+            prices: Filled with the prices served
+            stale_times: Filled with the fetch time of each stale price served
+
+        Returns:
+            Tickers the store couldn't serve
+        """
+        if self.store is None or not tickers:
+            return tickers
+        try:
+            stored = self.store.get_many(tickers)
+        except sqlite3.Error as e:
+            logger.error(f"Could not read stored quotes: {e}")
+            return tickers
+
+        now = self.store.clock()
+        missing = []
+        stale = []
+        for ticker in tickers:
+            entry = stored.get(ticker)
+            age = now - entry[1] if entry is not None else None
+            if age is not None and age < self._ttl:
+                prices[ticker] = entry[0]
+                # Only fresh quotes go in memory, and only for the rest of their TTL
+                self.cache.put(ticker, entry[0], age)
+                self.store_hits += 1
+            elif age is not None and age < self._ttl + self._stale_ttl:
+                prices[ticker] = entry[0]
+                stale_times[ticker] = entry[1]
+                stale.append(ticker)
+                self.stale_served += 1
+            else:
+                missing.append(ticker)
+        if stale:
+            self._revalidate(stale)
+        return missing
+
+    def _revalidate(self, tickers: List[str]) -> None:
+        """Fetch stale tickers on a background thread, once per ticker."""
+        with self._lock:
+            tickers = [t for t in tickers if t not in self._revalidating]
+            if not tickers:
+                return
+            self._revalidating.update(tickers)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="revalidate")
+            self.revalidations += 1
+            future = self._executor.submit(self._fetch_stale, tickers)
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _fetch_stale(self, tickers: List[str]) -> None:
+        try:
+            self._remember(self._provider.get_prices(tickers))
+        except Exception as e:
+            logger.warning(f"Could not revalidate {len(tickers)} quotes: {e}")
+        finally:
+            with self._lock:
+                self._revalidating.difference_update(tickers)
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def wait_for_revalidation(self, timeout: Optional[float] = None) -> None:
+        """Wait for the background fetches started so far."""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures, timeout)
+
+    def _served(self, tickers: Iterable[str], stale_times: Mapping[str, float]) -> None:
+        """Note which of the quotes just served were stale, for quote_times."""
+        with self._lock:
+            for ticker in tickers:
+                if ticker in stale_times:
+                    self._stale_times[ticker] = stale_times[ticker]
+                else:
+                    self._stale_times.pop(ticker, None)
+
+    def quote_times(self, tickers: Iterable[str]) -> Dict[str, float]:
+        """Get the fetch time of each ticker whose last served quote was stale."""
+        with self._lock:
+            return {t: self._stale_times[t] for t in tickers if t in self._stale_times}
+
+    def get_price(self, ticker: str) -> float:
+        """Get one price, from the caches if fresh enough."""
+        stale_times: Dict[str, float] = {}
+        price = self.cache.get(ticker)
+        if price is None:
+            prices: Dict[str, float] = {}
+            if self._from_store([ticker], prices, stale_times):
+                price = self._provider.get_price(ticker)
+                self._remember({ticker: price})
+            else:
+                price = prices[ticker]
+        self._served([ticker], stale_times)
+        return price
+
+    def get_prices(self, tickers: List[str]) -> Dict[str, float]:
+        """Get several prices, fetching only the ones not cached."""
+        prices = {}
+        missing = []
+        for ticker in tickers:
+            price = self.cache.get(ticker)
+            if price is None:
+                missing.append(ticker)
+            else:
+                prices[ticker] = price
+
+        stale_times: Dict[str, float] = {}
+        missing = self._from_store(missing, prices, stale_times)
+        if missing:
+            fetched = self._provider.get_prices(missing)
+            self._remember(fetched)
+            prices.update(fetched)
+        self._served(prices, stale_times)
+        return prices
+
+    def close(self) -> None:
+        """Stop background revalidation, then close the store and the wrapped provider."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if self.store is not None:
+            self.store.close()
+        self._provider.close()
@@ -0,0 +1,355 @@
+"""
+Headless command line mode for the stock importer application.
+
+Runs bulk jobs without opening a window, so they can be scheduled on
+servers with no display. Results go to stdout as JSON (or plain text),
+logs go to stderr, and the exit code says how it went.
+
+Usage:
+    python cli.py import holdings.txt
+    cat holdings.txt | python cli.py import -
+    python cli.py refresh
+    python cli.py watch --duration 3600
+    python cli.py totals --holdings --format text
+
+Credentials come from --username/--password or the STOCK_USERNAME and
+STOCK_PASSWORD environment variables.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import instrumentation
+from auth import CredentialManager
+from models import Portfolio, Stock
+from providers import PriceProvider, create_provider
+from scheduler import RefreshScheduler
+from storage import StorageBackend, create_storage
+from config import (
+    PRICE_PROVIDER, STORAGE_MODE, REFRESH_CHUNK_SIZE, REFRESH_MAX_WORKERS, ensure_data_dir
+)
+
+logger = logging.getLogger(__name__)
+
+# Exit codes
+EXIT_OK = 0
+EXIT_PARTIAL = 1  # Finished, but some tickers or lines failed
+EXIT_USAGE = 2  # Bad arguments (argparse uses 2 as well)
+EXIT_AUTH = 3  # Credentials rejected
+EXIT_ERROR = 4  # Job couldn't run (storage error, unreadable input, ...)
+
+def parse_pairs(lines: Iterable[str]) -> Tuple[List[Tuple[str, int]], List[Dict[str, Any]]]:
+    """
+    Parse ticker/quantity pairs.
+
+    Accepts "AAPL,10", "AAPL 10" or "AAPL<tab>10" per line. Blank lines,
+    lines starting with # and a leading "Ticker,Quantity" header are skipped.
+
+    Args:
+        lines: Input lines
+
+    Returns:
+        (pairs, invalid) where invalid lists the rejected lines with reasons
+    """
+    pairs = []
+    invalid = []
+    seen_data = False
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        fields = line.replace(",", " ").replace("\t", " ").split()
+        if not seen_data and fields and fields[0].lower() == "ticker":
+            seen_data = True
+            continue
+        seen_data = True
+
+        if len(fields) != 2:
+            invalid.append({"line": number, "text": line, "reason": "expected ticker and quantity"})
+            continue
+        ticker = fields[0].upper()
+        try:
+            quantity = int(fields[1])
+        except ValueError:
+            invalid.append({"line": number, "text": line, "reason": "quantity is not a number"})
+            continue
+        if quantity <= 0:
+            invalid.append({"line": number, "text": line, "reason": "quantity must be positive"})
+            continue
+        pairs.append((ticker, quantity))
+    return pairs, invalid
+
+def run_import(
+    portfolio: Portfolio,
+    storage: StorageBackend,
+    provider: PriceProvider,
+    lines: Iterable[str],
+    chunk_size: int = REFRESH_CHUNK_SIZE,
+    max_workers: int = REFRESH_MAX_WORKERS
+) -> Dict[str, Any]:
+    """
+    Import ticker/quantity pairs at current prices.
+
+    Tickers that can't be priced aren't added, same as in the GUI.
+
+    Returns:
+        Result fields for the command output
+    """
+    pairs, invalid = parse_pairs(lines)
+    tickers = list(dict.fromkeys(ticker for ticker, _ in pairs))
+    report = portfolio.fetch_prices(
+        tickers,
+        provider=provider,
+        chunk_size=chunk_size,
+        max_workers=max_workers
+    )
+
+    now = datetime.now()
+    added = []
+    for ticker, quantity in pairs:
+        result = report.results[ticker]
+        if result.ok:
+            portfolio.add_stock(Stock(ticker, quantity, result.price, now))
+            added.append(ticker)
+
+    storage.save_changes(portfolio, list(dict.fromkeys(added)))
+    return {
+        "processed": len(tickers),
+        "succeeded": len(tickers) - len(report.failed),
+        "failed": report.failed,
+        "invalid_lines": invalid
+    }
+
+def run_refresh(
+    portfolio: Portfolio,
+    storage: StorageBackend,
+    provider: PriceProvider,
+    chunk_size: int = REFRESH_CHUNK_SIZE,
+    max_workers: int = REFRESH_MAX_WORKERS
+) -> Dict[str, Any]:
+    """
+    Refresh prices for every holding.
+
+    Returns:
+        Result fields for the command output
+    """
+    report = portfolio.update_prices(
+        provider=provider,
+        chunk_size=chunk_size,
+        max_workers=max_workers
+    )
+    storage.save_changes(portfolio, report.succeeded)
+    return {
+        "processed": len(report.results),
+        "succeeded": len(report.succeeded),
+        "failed": report.failed
+    }
+
+def run_watch(
+    portfolio: Portfolio,
+    storage: StorageBackend,
+    provider: PriceProvider,
+    duration: float = 0.0,
+    chunk_size: int = REFRESH_CHUNK_SIZE,
+    max_workers: int = REFRESH_MAX_WORKERS
+) -> Dict[str, Any]:
+    """
+    Keep prices fresh on the market-hours schedule.
+
+    Runs until `duration` seconds have passed, or until interrupted if
+    it's 0. Each refresh is saved as it lands.
+
+    Returns:
+        Result fields for the command output, with `failed` holding each
+        ticker's latest failure
+    """
+    scheduler = RefreshScheduler(portfolio)
+    stop = threading.Event()
+    timer = threading.Timer(duration, stop.set) if duration > 0 else None
+    result: Dict[str, Any] = {"ticks": 0, "processed": 0, "succeeded": 0, "failed": {}}
+
+    def on_report(report) -> None:
+        storage.save_changes(portfolio, report.succeeded)
+        if portfolio.history is not None:
+            portfolio.history.flush()
+        result["ticks"] += 1
+        result["processed"] += len(report.results)
+        result["succeeded"] += len(report.succeeded)
+        result["failed"].update(report.failed)
+        for ticker in report.succeeded:
+            result["failed"].pop(ticker, None)
+
+    if timer is not None:
+        timer.start()
+    try:
+        scheduler.run(stop, on_report=on_report, chunk_size=chunk_size, max_workers=max_workers)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if timer is not None:
+            timer.cancel()
+        scheduler.close()
+    return result
+
+def run_totals(portfolio: Portfolio, list_holdings: bool = False) -> Dict[str, Any]:
+    """
+    Summarize the portfolio.
+
+    Returns:
+        Result fields for the command output
+    """
+    result: Dict[str, Any] = {"processed": 0}
+    if list_holdings:
+        result["holdings_detail"] = [
+            {
+                "ticker": stock.ticker,
+                "quantity": stock.quantity,
+                "price": stock.price,
+                "total_value": stock.total_value,
+                "last_updated": stock.last_updated.isoformat()
+            }
+            for stock in portfolio.get_holdings().values()
+        ]
+    return result
+
+def format_text(result: Dict[str, Any]) -> str:
+    """Format a result as "key: value" lines."""
+    lines = []
+    for key, value in result.items():
+        if key == "holdings_detail":
+            for holding in value:
+                lines.append(
+                    f"  {holding['ticker']:<10} {holding['quantity']:>10} "
+                    f"{holding['price']:>12.2f} {holding['total_value']:>14.2f}"
+                )
+        elif isinstance(value, dict) and key == "stats":
+            lines.extend(f"{k}: {v}" for k, v in value.items())
+        elif isinstance(value, dict):
+            lines.append(f"{key}: {len(value)}")
+            lines.extend(f"  {k}: {v}" for k, v in value.items())
+        elif isinstance(value, list):
+            lines.append(f"{key}: {len(value)}")
+            lines.extend(f"  line {item['line']}: {item['reason']}" for item in value)
+        else:
+            lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser."""
+    parser = argparse.ArgumentParser(description="Headless stock portfolio jobs")
+    parser.add_argument("--username", default=os.environ.get("STOCK_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("STOCK_PASSWORD"))
+    parser.add_argument("--storage", choices=["csv", "journal", "sqlite"], default=STORAGE_MODE)
+    parser.add_argument("--provider", choices=["yfinance", "http", "fake"], default=PRICE_PROVIDER)
+    parser.add_argument("--format", choices=["json", "text"], default="json")
+    parser.add_argument("--chunk-size", type=int, default=REFRESH_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=REFRESH_MAX_WORKERS)
+    parser.add_argument("--no-quote-store", action="store_true",
+                        help="don't read or write the shared on-disk quote cache")
+    parser.add_argument("--instrument", action="store_true", help="include timing spans in the output")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress to stderr")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="add ticker/quantity pairs")
+    import_parser.add_argument("file", help="input file, or - for stdin")
+    commands.add_parser("refresh", help="refresh every price")
+    watch_parser = commands.add_parser("watch", help="keep prices fresh while markets are open")
+    watch_parser.add_argument("--duration", type=float, default=0.0,
+                              help="seconds to run for (default: until interrupted)")
+    totals_parser = commands.add_parser("totals", help="print portfolio totals")
+    totals_parser.add_argument("--holdings", action="store_true", help="list every holding")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run one headless command.
+
+    Returns:
+        Exit code
+    """
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+
+    result: Dict[str, Any] = {"command": args.command}
+    if not CredentialManager.verify_credentials(args.username or "", args.password or ""):
+        result.update(ok=False, error="invalid credentials")
+        print(json.dumps(result) if args.format == "json" else format_text(result))
+        return EXIT_AUTH
+
+    if args.instrument:
+        instrumentation.enable()
+    start = time.perf_counter()
+    storage = None
+    provider = None
+    try:
+        ensure_data_dir()
+        storage = create_storage(args.storage)
+        # Quotes fetched by earlier runs or other processes are reused
+        provider = create_provider(args.provider, store=not args.no_quote_store)
+        portfolio = storage.load_portfolio()
+        portfolio.provider = provider
+
+        if args.command == "import":
+            if args.file == "-":
+                result.update(run_import(
+                    portfolio, storage, provider, sys.stdin, args.chunk_size, args.workers
+                ))
+            else:
+                with open(args.file, "r") as file:
+                    result.update(run_import(
+                        portfolio, storage, provider, file, args.chunk_size, args.workers
+                    ))
+        elif args.command == "refresh":
+            from history import HistoryStore
+            portfolio.history = HistoryStore()
+            result.update(run_refresh(portfolio, storage, provider, args.chunk_size, args.workers))
+            portfolio.history.flush()
+        elif args.command == "watch":
+            from history import HistoryStore
+            portfolio.history = HistoryStore()
+            result.update(run_watch(
+                portfolio, storage, provider, args.duration, args.chunk_size, args.workers
+            ))
+        else:
+            result.update(run_totals(portfolio, args.holdings))
+
+        elapsed = time.perf_counter() - start
+        result["holdings"] = len(portfolio.get_tickers())
+        result["total_value"] = round(portfolio.get_total_value(), 2)
+        result["stats"] = {
+            "elapsed_s": round(elapsed, 3),
+            "tickers_per_sec": round(result["processed"] / elapsed, 1) if elapsed else 0.0,
+            "bytes_written": storage.bytes_written,
+            "quote_store_hits": provider.store_hits
+        }
+        if instrumentation.enabled():
+            result["instrumentation"] = instrumentation.snapshot()
+        partial = bool(result.get("failed") or result.get("invalid_lines"))
+        result["ok"] = not partial
+        code = EXIT_PARTIAL if partial else EXIT_OK
+
+    except Exception as e:
+        logger.error(f"{args.command} failed: {e}")
+        result.update(ok=False, error=str(e))
+        code = EXIT_ERROR
+    finally:
+        if provider is not None:
+            provider.close()
+        if storage is not None:
+            storage.close()
+
+    print(json.dumps(result) if args.format == "json" else format_text(result))
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main())
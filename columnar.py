@@ -0,0 +1,397 @@
+"""
+Columnar holdings store for the stock importer application.
+
+ColumnarPortfolio keeps the same API as Portfolio, but holds quantities,
+prices and update times in contiguous NumPy arrays with a ticker-to-row
+index instead of one Stock object per holding. Totals and bulk price
+updates are array operations, which matters once a portfolio has
+hundreds of thousands of holdings.
+
+The running total and change notifications work as for Portfolio; bulk
+updates adjust the total with one dot product over the rows they touch.
+"""
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import numpy as np
+from models import HoldingState, Portfolio, Stock
+from providers import PriceProvider
+from refresh import RefreshReport
+
+logger = logging.getLogger(__name__)
+
+# Microsecond precision matches datetime
+TIME_DTYPE = "datetime64[us]"
+
+class ColumnarPortfolio(Portfolio):
+    """
+    Portfolio backed by NumPy arrays.
+
+    Stock objects are only built when asked for (get_holdings, get_stock),
+    so editing a returned Stock doesn't change the portfolio. Removing a
+    holding moves the last row into its place, so row order isn't
+    insertion order.
+    """
+
+    def __init__(self, provider: Optional[PriceProvider] = None, capacity: int = 1024) -> None:
+        """
+        Initialize an empty portfolio.
+
+        Args:
+            provider: Source of prices for update_prices
+            capacity: Number of rows to allocate up front
+        """
+        super().__init__(provider)
+        capacity = max(1, capacity)
+        self._ticker_index: Dict[str, int] = {}
+        self._ticker_list: List[str] = []
+        # Set by from_arrays until the tickers are first needed
+        self._load_tickers: Optional[Callable[[], List[str]]] = None
+        self._quantity = np.zeros(capacity, dtype=np.int64)
+        self._price = np.zeros(capacity, dtype=np.float64)
+        # Naive local times, same as Stock.last_updated
+        self._updated = np.zeros(capacity, dtype=TIME_DTYPE)
+        self._size = 0
+
+    @classmethod
+    def from_portfolio(cls, portfolio: Portfolio) -> "ColumnarPortfolio":
+        """
+        Copy any portfolio into a columnar one.
+
+        Args:
+            portfolio: Portfolio to copy
+
+        Returns:
+            ColumnarPortfolio with the same holdings and provider
+        """
+        holdings = list(portfolio.get_holdings().values())
+        columnar = cls(portfolio._provider, capacity=len(holdings))
+        columnar.add_many(
+            [s.ticker for s in holdings],
+            [s.quantity for s in holdings],
+            [s.price for s in holdings],
+            [s.last_updated for s in holdings]
+        )
+        return columnar
+
+    @classmethod
+    def from_arrays(
+        cls,
+        tickers: Callable[[], List[str]],
+        quantities: np.ndarray,
+        prices: np.ndarray,
+        last_updated: np.ndarray,
+        provider: Optional[PriceProvider] = None
+    ) -> "ColumnarPortfolio":
+        """
+        Wrap existing columns without copying them.
+
+        The arrays become the portfolio's storage and are written to by
+        price updates until a growth reallocates them. Tickers are only
+        decoded when something first needs them, so totals are available
+        without touching them.
+
+        Args:
+            tickers: Returns the ticker of every row, in row order (called once)
+            quantities: Quantity column (int64)
+            prices: Price column (float64)
+            last_updated: Last-updated column (datetime64[us])
+            provider: Source of prices for update_prices
+
+        Returns:
+            ColumnarPortfolio over the given arrays
+        """
+        columnar = cls(provider, capacity=1)
+        columnar._quantity = quantities
+        columnar._price = prices
+        columnar._updated = last_updated
+        columnar._size = len(quantities)
+        columnar._load_tickers = tickers
+        columnar._total_value = columnar._sum_values()
+        return columnar
+
+    @property
+    def _index(self) -> Dict[str, int]:
+        """Ticker-to-row index."""
+        if self._load_tickers is not None:
+            self._decode_tickers()
+        return self._ticker_index
+
+    @property
+    def _tickers(self) -> List[str]:
+        """Ticker of every row, in row order."""
+        if self._load_tickers is not None:
+            self._decode_tickers()
+        return self._ticker_list
+
+    def _decode_tickers(self) -> None:
+        """Build the ticker list and index for arrays wrapped by from_arrays."""
+        load, self._load_tickers = self._load_tickers, None
+        self._ticker_list = load()
+        self._ticker_index = {ticker: row for row, ticker in enumerate(self._ticker_list)}
+
+    def _reserve(self, extra: int) -> None:
+        """Grow the arrays so `extra` more rows fit."""
+        needed = self._size + extra
+        capacity = len(self._quantity)
+        if needed <= capacity:
+            return
+        capacity = max(capacity * 2, needed)
+        for name in ("_quantity", "_price", "_updated"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _row_of(self, ticker: str) -> int:
+        """Get the row for a ticker, adding an empty row if it's new."""
+        row = self._index.get(ticker)
+        if row is None:
+            self._reserve(1)
+            row = self._size
+            self._index[ticker] = row
+            self._tickers.append(ticker)
+            self._quantity[row] = 0
+            self._size += 1
+        return row
+
+    def _state(self, row: int) -> HoldingState:
+        """Snapshot of a row for change tracking."""
+        return (int(self._quantity[row]), float(self._price[row]), self._updated[row].item())
+
+    def add_stock(self, stock: Stock) -> None:
+        """
+        Add a stock to the portfolio.
+
+        Args:
+            stock: Stock instance to add
+        """
+        row = self._index.get(stock.ticker)
+        if row is None:
+            old = None
+            row = self._row_of(stock.ticker)
+        else:
+            old = self._state(row)
+        self._quantity[row] += stock.quantity
+        self._price[row] = stock.price
+        self._updated[row] = np.datetime64(stock.last_updated, "us")
+        new = self._state(row)
+        self._adjust_total(new[0] * new[1] - (old[0] * old[1] if old else 0.0))
+        self._changed(stock.ticker, old, new)
+
+    def add_many(
+        self,
+        tickers: Sequence[str],
+        quantities: Iterable[int],
+        prices: Iterable[float],
+        last_updated: Optional[Iterable[datetime]] = None
+    ) -> None:
+        """
+        Add many holdings at once.
+
+        Quantities of repeated tickers are summed, like add_stock. Prices
+        and times of repeated tickers come from one of the repeats.
+
+        Args:
+            tickers: Stock symbols
+            quantities: Number of shares for each ticker
+            prices: Price per share for each ticker
+            last_updated: Update times, as datetimes or datetime64 (defaults to now)
+        """
+        count = len(tickers)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        if last_updated is None:
+            updated = np.full(count, np.datetime64(datetime.now(), "us"))
+        else:
+            updated = np.asarray(last_updated, dtype=TIME_DTYPE)
+        if not len(quantities) == len(prices) == len(updated) == count:
+            raise ValueError("All columns must have the same length")
+
+        self._reserve(count)
+        # Plain loop with locals; this is the only per-ticker Python work
+        index = self._index
+        all_tickers = self._tickers
+        old_size = size = self._size
+        rows = []
+        for ticker in tickers:
+            row = index.get(ticker)
+            if row is None:
+                row = index[ticker] = size
+                all_tickers.append(ticker)
+                size += 1
+            rows.append(row)
+        self._quantity[self._size:size] = 0
+        self._size = size
+
+        rows = np.array(rows, dtype=np.int64)
+        touched = np.unique(rows)
+        old_quantity = self._quantity[touched]
+        old_price = self._price[touched]
+        old_updated = self._updated[touched]
+        np.add.at(self._quantity, rows, quantities)
+        self._price[rows] = prices
+        self._updated[rows] = updated
+
+        new_quantity = self._quantity[touched]
+        new_price = self._price[touched]
+        self._adjust_total(
+            float(np.dot(new_quantity, new_price) - np.dot(old_quantity, old_price)),
+            len(touched)
+        )
+        if self._subscribers:
+            old_states = zip(old_quantity.tolist(), old_price.tolist(), old_updated.tolist())
+            new_states = zip(
+                new_quantity.tolist(), new_price.tolist(), self._updated[touched].tolist()
+            )
+            with self.batch():
+                for row, old, new in zip(touched.tolist(), old_states, new_states):
+                    self._changed(all_tickers[row], old if row < old_size else None, new)
+
+    def remove_stock(self, ticker: str) -> None:
+        """
+        Remove a stock from the portfolio.
+
+        Args:
+            ticker: Stock symbol to remove
+
+        Raises:
+            KeyError: If ticker not in portfolio
+        """
+        if ticker not in self._index:
+            raise KeyError(f"Stock {ticker} not found in portfolio")
+
+        row = self._index.pop(ticker)
+        old = self._state(row)
+        last = self._size - 1
+        if row != last:
+            # Move the last row into the gap
+            moved = self._tickers[last]
+            self._tickers[row] = moved
+            self._index[moved] = row
+            self._quantity[row] = self._quantity[last]
+            self._price[row] = self._price[last]
+            self._updated[row] = self._updated[last]
+        self._tickers.pop()
+        self._size -= 1
+        if self._size:
+            self._adjust_total(-old[0] * old[1])
+        else:
+            self._total_value = 0.0
+        self._changed(ticker, old, None)
+
+    def set_prices(
+        self,
+        tickers: Sequence[str],
+        prices: Iterable[float],
+        when: Optional[datetime] = None
+    ) -> int:
+        """
+        Update many prices in one array operation.
+
+        Tickers that aren't held are ignored.
+
+        Args:
+            tickers: Stock symbols
+            prices: New price for each ticker
+            when: Time of the update (defaults to now)
+
+        Returns:
+            Number of holdings updated
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        index = self._index
+        keep = [(i, index[t]) for i, t in enumerate(tickers) if t in index]
+        if not keep:
+            return 0
+
+        positions, rows = (np.array(column, dtype=np.int64) for column in zip(*keep))
+        touched = np.unique(rows)
+        quantity = self._quantity[touched]
+        old_price = self._price[touched]
+        old_updated = self._updated[touched]
+        when = np.datetime64(when or datetime.now(), "us")
+        self._price[rows] = prices[positions]
+        self._updated[rows] = when
+
+        new_price = self._price[touched]
+        self._adjust_total(float(np.dot(quantity, new_price - old_price)), len(rows))
+        if self._subscribers:
+            new_updated = when.item()
+            with self.batch():
+                for row, q, old, new, updated in zip(
+                    touched.tolist(), quantity.tolist(), old_price.tolist(),
+                    new_price.tolist(), old_updated.tolist()
+                ):
+                    self._changed(self._tickers[row], (q, old, updated), (q, new, new_updated))
+        return len(rows)
+
+    def columns(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the holdings as columns, in row order.
+
+        Returns:
+            (tickers, quantities, prices, last updated). The arrays are views;
+            don't modify them.
+        """
+        n = self._size
+        return self._tickers, self._quantity[:n], self._price[:n], self._updated[:n]
+
+    def holding_values(self) -> np.ndarray:
+        """Get quantity * price for every row, in row order."""
+        n = self._size
+        return self._quantity[:n] * self._price[:n]
+
+    def _has(self, ticker: str) -> bool:
+        """Check a ticker is held."""
+        return ticker in self._index
+
+    def get_stock(self, ticker: str) -> Optional[Stock]:
+        """
+        Build a Stock for one holding.
+
+        Args:
+            ticker: Stock symbol
+
+        Returns:
+            Stock copy, or None if the ticker isn't held
+        """
+        row = self._index.get(ticker)
+        if row is None:
+            return None
+        return Stock(
+            ticker=ticker,
+            quantity=int(self._quantity[row]),
+            price=float(self._price[row]),
+            last_updated=self._updated[row].item()
+        )
+
+    def get_tickers(self) -> List[str]:
+        """Get the symbols of all holdings, in row order."""
+        return list(self._tickers)
+
+    def get_states(self) -> Dict[str, HoldingState]:
+        """Get (quantity, price, last updated) for every holding, in row order."""
+        n = self._size
+        return dict(zip(self._tickers, zip(
+            self._quantity[:n].tolist(), self._price[:n].tolist(), self._updated[:n].tolist()
+        )))
+
+    def get_holdings(self) -> Dict[str, Stock]:
+        """Build Stock copies of all holdings, in row order."""
+        n = self._size
+        quantities = self._quantity[:n].tolist()
+        prices = self._price[:n].tolist()
+        updated = self._updated[:n].tolist()
+        return {
+            ticker: Stock(ticker, quantities[i], prices[i], updated[i])
+            for i, ticker in enumerate(self._tickers)
+        }
+
+    def _sum_values(self) -> float:
+        """Add up every holding's value from scratch."""
+        n = self._size
+        return float(np.dot(self._quantity[:n], self._price[:n]))
+
+    def __len__(self) -> int:
+        return self._size
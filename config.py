@@ -3,15 +3,23 @@ Configuration settings for the stock importer application.
 
 This module contains all configuration variables used across the application.
 """
+import os
 from pathlib import Path
 
 # File paths
 DATA_DIR = Path("data")
 CREDENTIALS_FILE = DATA_DIR / "credentials.txt"
 STOCKS_FILE = DATA_DIR / "stocks.csv"
+JOURNAL_FILE = DATA_DIR / "stocks.journal"
+SQLITE_FILE = DATA_DIR / "stocks.db"
+HISTORY_DIR = DATA_DIR / "history"
+LEDGER_FILE = DATA_DIR / "transactions.csv"
+QUOTE_STORE_FILE = DATA_DIR / "quotes.db"
+METADATA_FILE = DATA_DIR / "tickers.db"
 
-# Create data directory if it doesn't exist
-DATA_DIR.mkdir(exist_ok=True)
+def ensure_data_dir() -> None:
+    """Create the data directory if it doesn't exist."""
+    DATA_DIR.mkdir(exist_ok=True)
 
 # Default credentials (moved to top for visibility)
 DEFAULT_USERNAME = "pybro"
@@ -34,6 +42,67 @@ THEME = {
     }
 }
 
+# Storage mode ("csv" rewrites the file on every change, "journal" appends,
+# "sqlite" updates single rows)
+STORAGE_MODE = os.environ.get("STOCK_STORAGE_MODE", "csv")
+JOURNAL_COMPACT_THRESHOLD = 1000  # Journal records before folding into the snapshot
+SAVE_DELAY = 0.5  # Seconds the GUI collects changes before saving them in one background write
+SAVE_MAX_RETRY_DELAY = 60.0  # Longest wait between retries of a failing background save
+
+# Price source ("yfinance", "http" for a quote server, or "fake" for offline
+# testing and benchmarks)
+PRICE_PROVIDER = os.environ.get("STOCK_PRICE_PROVIDER", "yfinance")
+QUOTE_SERVER_URL = os.environ.get("STOCK_QUOTE_SERVER_URL", "http://127.0.0.1:8765")
+# Live tick stream ("host:port" of a streaming quote server; see streaming.py)
+QUOTE_STREAM_ADDRESS = os.environ.get("STOCK_QUOTE_STREAM", "127.0.0.1:8766")
+
+# Quote client settings (network providers go through quote_client.QuoteClient)
+QUOTE_RATE = 5.0  # Requests per second allowed on average
+QUOTE_BURST = 10  # Requests allowed back to back before the rate applies
+QUOTE_MAX_CONCURRENCY = 8  # Requests in flight at once
+QUOTE_MAX_RETRIES = 3  # Retries after a failed or throttled request
+QUOTE_BACKOFF_BASE = 0.5  # Seconds; doubles with every retry, with full jitter
+QUOTE_BACKOFF_MAX = 30.0  # Longest wait between retries, in seconds
+
+# Price refresh settings
+REFRESH_CHUNK_SIZE = 100  # Tickers per bulk quote request
+REFRESH_MAX_WORKERS = 8  # Worker threads for tickers the bulk request missed
+REFRESH_TIMEOUT = 10.0  # Seconds allowed per single-ticker fetch
+
+# How sells are matched to bought lots ("fifo" or "average")
+COST_METHOD = "fifo"
+
+# Price history settings
+HISTORY_BLOCK_SIZE = 1024  # Quotes per compressed block in a history file
+
+# Quote cache settings
+QUOTE_CACHE_TTL = 60.0  # Seconds a fetched quote is reused
+QUOTE_CACHE_SIZE = 5000  # Maximum cached quotes before LRU eviction
+QUOTE_STALE_TTL = 300.0  # Seconds past the TTL a stored quote is served while refetched
+
+# Ticker metadata cache settings
+TICKER_INVALID_TTL = 24 * 3600.0  # Seconds a ticker with no price is skipped
+TICKER_METADATA_TTL = 7 * 24 * 3600.0  # Seconds a remembered lookup path is trusted
+
+# Auto refresh settings (see scheduler.py)
+AUTO_REFRESH_INTERVAL = 60.0  # Starting seconds between refreshes of a ticker while its market is open
+AUTO_REFRESH_MIN_INTERVAL = 15.0  # Shortest interval, for tickers whose price keeps moving
+AUTO_REFRESH_MAX_INTERVAL = 600.0  # Longest interval while open, for tickers that don't move
+AUTO_REFRESH_MOVE = 0.001  # Relative price change that counts as a move
+AUTO_REFRESH_CLOSE_GRACE = 300.0  # Seconds after the close of the last refresh, for the closing price
+
+# Instrumentation (off by default; see instrumentation.py)
+INSTRUMENT = os.environ.get("STOCK_INSTRUMENT", "") not in ("", "0")
+TRACE_MEMORY = os.environ.get("STOCK_TRACE_MEMORY", "") not in ("", "0")  # tracemalloc, slow
+PROFILE_FILE = os.environ.get("STOCK_PROFILE") or None  # cProfile output path
+
+# How often the GUI checks background jobs, in milliseconds
+UI_POLL_INTERVAL_MS = 50
+# Most table redraws per second from live ticks; faster ticks are merged
+STREAM_MAX_FPS = 10
+STREAM_RECONNECT_DELAY = 2.0  # Seconds between attempts to reach the tick stream
+
 # Window settings
 LOGIN_WINDOW_SIZE = "500x350"
-MAIN_WINDOW_SIZE = "800x600"
\ No newline at end of file
+MAIN_WINDOW_SIZE = "800x600"
+TABLE_ROW_HEIGHT = 32  # Pixel height of one holdings table row
\ No newline at end of file
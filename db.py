@@ -0,0 +1,57 @@
+"""
+SQLite helpers for the stock importer application.
+
+QuoteStore, MetadataStore and SqliteStorage each keep one connection to
+a file under the data directory that other processes may be using at
+the same time. connect() opens it the same way for all of them, and
+select_in() runs the chunked IN (...) lookups they share.
+"""
+from pathlib import Path
+from typing import Iterator, Sequence
+import sqlite3
+
+CHUNK = 500  # Values per IN (...) list, well under SQLite's parameter limit
+
+def connect(path: Path) -> sqlite3.Connection:
+    """
+    Open (and create if needed) a database shared with other processes.
+
+    The connection may be used from any thread; callers serialize access
+    with their own lock. WAL mode lets readers run alongside a writer,
+    and a busy database is waited on rather than failing at once.
+
+    Args:
+        path: SQLite file; its directory is created if missing
+
+    Returns:
+        Open connection
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+def select_in(
+    conn: sqlite3.Connection,
+    sql: str,
+    values: Sequence,
+    params: Sequence = ()
+) -> Iterator[tuple]:
+    """
+    Run a SELECT with an IN list of any length, CHUNK values at a time.
+
+    Args:
+        conn: Connection to query
+        sql: Query with "{}" where the IN list's placeholders go,
+            e.g. "SELECT ... WHERE ticker IN ({})"
+        values: Values for the IN list
+        params: Parameters that come before the IN list
+
+    Returns:
+        Rows from every chunk
+    """
+    for i in range(0, len(values), CHUNK):
+        chunk = values[i:i + CHUNK]
+        yield from conn.execute(sql.format(",".join("?" * len(chunk))), [*params, *chunk])
@@ -0,0 +1,307 @@
+"""
+Local fake quote server for the stock importer application.
+
+Serves the HttpPriceProvider protocol on 127.0.0.1 with prices from a
+FakePriceProvider. It can be made slow, flaky or rate limited, so the
+quote client's retries and throttling can be tested without a network.
+FakeTickServer does the same for the streaming protocol in streaming.py.
+
+Usage:
+    python fake_server.py --port 8765 --rate 20
+    STOCK_PRICE_PROVIDER=http python main.py
+    python fake_server.py --stream-port 8766 --tick-rate 5000
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import random
+import threading
+import time
+from providers import FakePriceProvider
+from quote_client import TokenBucket
+
+class FakeQuoteServer:
+    """
+    In-process HTTP quote server.
+
+    Attributes:
+        requests: Requests received, including rejected ones
+        rejected: Requests answered with 429 or 503
+        ticker_requests: How often each ticker was asked for
+    """
+
+    def __init__(
+        self,
+        prices: Optional[Dict[str, float]] = None,
+        port: int = 0,
+        rate: float = 0.0,
+        burst: Optional[int] = None,
+        error_rate: float = 0.0,
+        latency: float = 0.0,
+        retry_after: float = 0.0,
+        seed: int = 0
+    ) -> None:
+        """
+        Initialize the server (call start() to serve).
+
+        Args:
+            prices: Fixed prices to serve, as for FakePriceProvider
+            port: Port to listen on (0 picks a free one)
+            rate: Requests per second before answering 429 (0 for no limit)
+            burst: Requests allowed back to back before the rate applies
+            error_rate: Fraction of requests answered with 503
+            latency: Seconds to wait before answering
+            retry_after: Retry-After value sent with 429 responses
+            seed: Seed for prices and for which requests fail
+        """
+        self._source = FakePriceProvider(prices, seed=seed)
+        self._bucket = TokenBucket(rate, burst)
+        self._error_rate = error_rate
+        self._latency = latency
+        self._retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.ticker_requests: Counter = Counter()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to give HttpPriceProvider."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status, headers, body = server._answer(self.path)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+    def _answer(self, path: str):
+        """Build (status, headers, body) for a request."""
+        url = urlparse(path)
+        if url.path != "/quotes":
+            return 404, {}, b'{"error": "not found"}'
+        symbols = [s for s in parse_qs(url.query).get("symbols", [""])[0].split(",") if s]
+
+        with self._lock:
+            self.requests += 1
+            self.ticker_requests.update(symbols)
+            failed = self._random.random() < self._error_rate
+        if self._latency:
+            time.sleep(self._latency)
+
+        if self._bucket.try_acquire():
+            with self._lock:
+                self.rejected += 1
+            return 429, {"Retry-After": str(self._retry_after)}, b'{"error": "rate limited"}'
+        if failed:
+            with self._lock:
+                self.rejected += 1
+            return 503, {}, b'{"error": "unavailable"}'
+        prices = self._source.get_prices(symbols)
+        return 200, {}, json.dumps({"prices": prices}).encode()
+
+    def start(self) -> "FakeQuoteServer":
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve on the calling thread until interrupted, then release the port."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        """Stop serving and release the port."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeQuoteServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+class FakeTickServer:
+    """
+    In-process streaming quote server.
+
+    Each connection gets random-walk ticks for the tickers it subscribed
+    to, `rate` ticks per second sent in small batches, starting from the
+    FakePriceProvider price.
+
+    Attributes:
+        connections: Connections accepted so far
+        ticks_sent: Ticks sent over all connections
+    """
+
+    def __init__(
+        self,
+        prices: Optional[Dict[str, float]] = None,
+        port: int = 0,
+        rate: float = 1000.0,
+        batch_interval: float = 0.01,
+        seed: int = 0
+    ) -> None:
+        """
+        Initialize the server (call start() to serve).
+
+        Args:
+            prices: Starting prices, as for FakePriceProvider
+            port: Port to listen on (0 picks a free one)
+            rate: Ticks per second per connection
+            batch_interval: Seconds between batches of ticks
+            seed: Seed for the starting prices and the random walk
+        """
+        self._source = FakePriceProvider(prices, seed=seed)
+        self._rate = rate
+        self._batch_interval = batch_interval
+        self._seed = seed
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.connections = 0
+        self.ticks_sent = 0
+        self._server = ThreadingTCPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        """Address to give QuoteStream."""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self) -> None:
+                server._stream(self)
+
+        return Handler
+
+    def _stream(self, handler: StreamRequestHandler) -> None:
+        """Serve one connection until it closes or the server stops."""
+        with self._lock:
+            self.connections += 1
+            seed = self._seed + self.connections
+        subscribed: Set[str] = set()
+        subscribed_lock = threading.Lock()
+
+        def read() -> None:
+            try:
+                for line in handler.rfile:
+                    message = json.loads(line)
+                    with subscribed_lock:
+                        subscribed.update(message.get("subscribe", ()))
+                        subscribed.difference_update(message.get("unsubscribe", ()))
+            except (OSError, ValueError):
+                pass
+
+        threading.Thread(target=read, daemon=True).start()
+        rng = random.Random(seed)
+        prices: Dict[str, float] = {}
+        owed = 0.0
+        while not self._stopping.is_set():
+            with subscribed_lock:
+                tickers = list(subscribed)
+            owed += self._rate * self._batch_interval
+            count = int(owed)
+            if tickers and count:
+                owed -= count
+                ticks = []
+                for ticker in rng.choices(tickers, k=count):
+                    price = prices.get(ticker)
+                    if price is None:
+                        try:
+                            price = self._source.get_price(ticker)
+                        except ValueError:
+                            continue
+                    price = prices[ticker] = round(max(0.01, price * (1.0 + rng.gauss(0.0, 0.001))), 4)
+                    ticks.append((ticker, price))
+                try:
+                    handler.wfile.write(json.dumps({"ticks": ticks}).encode() + b"\n")
+                    handler.wfile.flush()
+                except OSError:
+                    return
+                with self._lock:
+                    self.ticks_sent += len(ticks)
+            time.sleep(self._batch_interval)
+
+    def start(self) -> "FakeTickServer":
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving, end every stream and release the port."""
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeTickServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+def main() -> None:
+    """Run the server until interrupted."""
+    parser = argparse.ArgumentParser(description="Fake quote server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=float, default=0.0, help="requests/sec before 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503s")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--stream-port", type=int, default=0, help="also stream ticks on this port")
+    parser.add_argument("--tick-rate", type=float, default=1000.0, help="ticks/sec per stream")
+    args = parser.parse_args()
+
+    ticks = None
+    if args.stream_port:
+        ticks = FakeTickServer(port=args.stream_port, rate=args.tick_rate).start()
+        print(f"Streaming ticks on {ticks.address}")
+
+    server = FakeQuoteServer(
+        port=args.port,
+        rate=args.rate,
+        error_rate=args.error_rate,
+        latency=args.latency
+    )
+    print(f"Serving quotes on {server.url}")
+    server.serve_forever()
+    if ticks is not None:
+        ticks.stop()
+
+if __name__ == "__main__":
+    main()
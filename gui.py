@@ -12,22 +12,40 @@ input when it comes to exception handling but the unit tests I just want to see
 GET API TO WORK SOMEHOW 
 """
 import customtkinter as ctk
-from typing import Dict
+from typing import Callable, Container, Dict, List, Optional, Sequence, Set
 import logging
-import yfinance as yf
+import threading
 from datetime import datetime
-from models import Stock, Portfolio
-from storage import StorageManager
+from models import ADDED, REMOVED, Stock, Portfolio, PortfolioChanges
+from indexes import HoldingsIndex
+from providers import PriceProvider, create_provider
+from cache import CachingPriceProvider, QuoteStore
+from refresh import RefreshReport, RefreshResult
+from scheduler import RefreshScheduler
+from streaming import QuoteStream
+from storage import WriteBehindStorage, create_storage
 from auth import CredentialManager
-from config import THEME, LOGIN_WINDOW_SIZE, MAIN_WINDOW_SIZE
+from tasks import BackgroundRunner, Job
+import instrumentation
+from viewport import SlotCache, format_row, visible_range
+from config import (
+    THEME, LOGIN_WINDOW_SIZE, MAIN_WINDOW_SIZE, UI_POLL_INTERVAL_MS, TABLE_ROW_HEIGHT,
+    PRICE_PROVIDER, STREAM_MAX_FPS
+)
 
 logger = logging.getLogger(__name__)
 
 class LoginWindow:
     """Login window for user authentication."""
 
-    def __init__(self) -> None:
-        """Initialize login window."""
+    def __init__(self, provider: Optional[PriceProvider] = None) -> None:
+        """
+        Initialize login window.
+
+        Args:
+            provider: Price provider handed to the main window
+        """
+        self._provider = provider
         self._root = ctk.CTk()
         self._root.geometry(LOGIN_WINDOW_SIZE)
         self._root.title("Stock Portfolio Login")
@@ -111,7 +129,7 @@ class LoginWindow:
                 CredentialManager.save_credentials(username, password)
 
             self._root.destroy()
-            main_app = MainWindow()
+            main_app = MainWindow(provider=self._provider)
             main_app.run()
         else:
             self._status_label.configure(text="Invalid credentials")
@@ -130,11 +148,261 @@ class LoginWindow:
         """Run the login window."""
         self._root.mainloop()
 
+class HoldingsTable:
+    """
+    Virtualized holdings table.
+
+    Only creates widgets for the rows that fit in the window and rebinds
+    them to other holdings while scrolling, so redraw cost depends on the
+    window size rather than the number of holdings. Rows come from any
+    sequence of tickers that supports len() and slicing, such as a
+    HoldingsView, and only the visible slice is ever read.
+    """
+
+    HEADERS = ["Ticker", "Quantity", "Price", "Total Value", ""]
+    # Sort key behind each clickable header
+    SORT_KEYS = {0: "ticker", 2: "price", 3: "value"}
+    COLUMN_WIDTH = 120
+
+    def __init__(
+        self,
+        parent: ctk.CTkFrame,
+        on_remove: Callable[[str], None],
+        on_sort: Optional[Callable[[str], None]] = None
+    ) -> None:
+        """
+        Initialize the table.
+
+        Args:
+            parent: Widget to place the table in
+            on_remove: Called with the ticker when a row's Remove button is clicked
+            on_sort: Called with a sort key when a sortable header is clicked
+        """
+        self._on_remove = on_remove
+        self._rows: Sequence[str] = []
+        self._lookup: Callable[[str], Optional[Stock]] = lambda ticker: None
+        self._first = 0
+        self._capacity = 0
+        self._slots: List[List] = []
+        self._cache = SlotCache()
+
+        self._frame = ctk.CTkFrame(parent)
+
+        # Headers
+        header_frame = ctk.CTkFrame(self._frame, fg_color="transparent")
+        header_frame.pack(fill="x")
+        self._headers = []
+        font = (THEME["font_family"], THEME["normal_size"], "bold")
+        for i, header in enumerate(self.HEADERS):
+            key = self.SORT_KEYS.get(i)
+            if key is not None and on_sort is not None:
+                widget = ctk.CTkButton(
+                    header_frame,
+                    text=header,
+                    width=self.COLUMN_WIDTH,
+                    anchor="w",
+                    font=font,
+                    fg_color="transparent",
+                    command=lambda k=key: on_sort(k)
+                )
+            else:
+                widget = ctk.CTkLabel(
+                    header_frame,
+                    text=header,
+                    width=self.COLUMN_WIDTH,
+                    anchor="w",
+                    font=font
+                )
+            widget.grid(row=0, column=i, padx=5, pady=5, sticky="w")
+            self._headers.append(widget)
+
+        # Rows and scrollbar
+        body_frame = ctk.CTkFrame(self._frame, fg_color="transparent")
+        body_frame.pack(fill="both", expand=True)
+
+        self._scrollbar = ctk.CTkScrollbar(body_frame, command=self._on_scrollbar)
+        self._scrollbar.pack(side="right", fill="y")
+
+        self._body = ctk.CTkFrame(body_frame, fg_color="transparent")
+        self._body.pack(side="left", fill="both", expand=True)
+        # Keep the body at the window's size instead of growing to fit rows
+        self._body.grid_propagate(False)
+        self._body.bind("<Configure>", self._on_resize)
+        self._bind_wheel(self._body)
+
+    def pack(self, **kwargs) -> None:
+        """Pack the table into its parent."""
+        self._frame.pack(**kwargs)
+
+    def set_holdings(self, holdings: Dict[str, Stock]) -> None:
+        """
+        Show a new set of holdings.
+
+        Only cells whose text changed are reconfigured.
+
+        Args:
+            holdings: Holdings in display order
+        """
+        self.set_rows(list(holdings), holdings.get)
+
+    def set_rows(self, rows: Sequence[str], lookup: Callable[[str], Optional[Stock]]) -> None:
+        """
+        Show tickers in the given order.
+
+        Args:
+            rows: Tickers in display order; a live view can keep changing
+                under the table, call refresh() when it has
+            lookup: Returns the current Stock for a ticker
+        """
+        self._rows = rows
+        self._lookup = lookup
+        self._render()
+
+    def refresh(self) -> None:
+        """Redraw the visible rows, e.g. after the rows' order changed."""
+        self._render()
+
+    def update_rows(self, tickers: Container[str]) -> None:
+        """
+        Redraw holdings whose values changed, if they're on screen.
+
+        Args:
+            tickers: Holdings that changed
+        """
+        for slot, widgets in enumerate(self._slots):
+            ticker = self._cache.ticker(slot)
+            if ticker is not None and ticker in tickers:
+                self._draw_slot(slot, widgets, ticker)
+
+    def show_sort(self, key: str, descending: bool) -> None:
+        """Mark the header the rows are sorted by."""
+        for column, header in self.SORT_KEYS.items():
+            widget = self._headers[column]
+            if isinstance(widget, ctk.CTkButton):
+                arrow = (" \u25bc" if descending else " \u25b2") if header == key else ""
+                widget.configure(text=self.HEADERS[column] + arrow)
+
+    def _draw_slot(self, slot: int, widgets: List, ticker: str) -> bool:
+        """
+        Show a holding in a slot, reconfiguring only the cells that changed.
+
+        Returns:
+            False if the ticker is no longer held
+        """
+        stock = self._lookup(ticker)
+        if stock is None:
+            return False
+        for column, text in self._cache.diff(slot, format_row(stock)):
+            widgets[column].configure(text=text)
+        return True
+
+    def _create_slot(self, slot: int) -> None:
+        """Create the widgets for one recyclable row."""
+        widgets = []
+        for column in range(4):
+            label = ctk.CTkLabel(
+                self._body,
+                text="",
+                width=self.COLUMN_WIDTH,
+                height=TABLE_ROW_HEIGHT - 4,
+                anchor="w"
+            )
+            widgets.append(label)
+
+        # Remove button looks up whichever ticker the slot shows right now
+        widgets.append(ctk.CTkButton(
+            self._body,
+            text="Remove",
+            command=lambda s=slot: self._remove_slot(s),
+            width=80,
+            height=TABLE_ROW_HEIGHT - 4
+        ))
+
+        for column, widget in enumerate(widgets):
+            widget.grid(row=slot, column=column, padx=5, pady=2, sticky="w")
+            widget.grid_remove()
+            self._bind_wheel(widget)
+        self._slots.append(widgets)
+
+    def _render(self) -> None:
+        """Bind the visible holdings to row slots."""
+        total = len(self._rows)
+        start, stop = visible_range(total, self._first, self._capacity)
+        self._first = start
+        visible = self._rows[start:stop]
+
+        for slot, widgets in enumerate(self._slots):
+            was_shown = self._cache.ticker(slot) is not None
+            if slot < len(visible) and self._draw_slot(slot, widgets, visible[slot]):
+                if not was_shown:
+                    for widget in widgets:
+                        widget.grid()
+            elif self._cache.clear(slot):
+                for widget in widgets:
+                    widget.grid_remove()
+
+        if total:
+            self._scrollbar.set(start / total, stop / total)
+        else:
+            self._scrollbar.set(0.0, 1.0)
+
+    def _remove_slot(self, slot: int) -> None:
+        """Handle a Remove click on a row slot."""
+        ticker = self._cache.ticker(slot)
+        if ticker is not None:
+            self._on_remove(ticker)
+
+    def _on_resize(self, event) -> None:
+        """Create more row slots if the window got taller."""
+        self._capacity = max(1, event.height // TABLE_ROW_HEIGHT)
+        while len(self._slots) < self._capacity:
+            self._create_slot(len(self._slots))
+        self._render()
+
+    def _on_scrollbar(self, *args) -> None:
+        """Handle scrollbar drags and clicks."""
+        if args[0] == "moveto":
+            self._first = int(float(args[1]) * len(self._rows))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            self._first += step * self._capacity if args[2] == "pages" else step
+        self._render()
+
+    def _on_wheel(self, event) -> None:
+        """Scroll three rows per mouse wheel notch."""
+        if event.num == 4 or (event.num != 5 and event.delta > 0):
+            self._first -= 3
+        else:
+            self._first += 3
+        self._render()
+
+    def _bind_wheel(self, widget) -> None:
+        """Scroll the table when the mouse wheel is used over a widget."""
+        widget.bind("<MouseWheel>", self._on_wheel)
+        # Linux reports wheel as buttons 4 and 5
+        widget.bind("<Button-4>", self._on_wheel)
+        widget.bind("<Button-5>", self._on_wheel)
+
 class MainWindow:
     """Main window for the stock portfolio application."""
 
-    def __init__(self) -> None:
-        """Initialize the main window."""
+    # Sort menu entries and their HoldingsIndex keys
+    SORT_LABELS = {"Ticker": "ticker", "Value": "value", "Price": "price", "Last Updated": "last_updated"}
+
+    def __init__(self, provider: Optional[PriceProvider] = None) -> None:
+        """
+        Initialize the main window.
+
+        Args:
+            provider: Source of stock prices (defaults to yfinance)
+        """
+        if provider is None:
+            provider = create_provider("yfinance")
+        # Adding a stock and refreshing right after share one quote cache,
+        # backed by the on-disk one other runs and the CLI also use
+        if not isinstance(provider, CachingPriceProvider):
+            provider = CachingPriceProvider(provider, store=QuoteStore(source=PRICE_PROVIDER))
+        self._provider = provider
         self._root = ctk.CTk()
         self._root.geometry(MAIN_WINDOW_SIZE)
         self._root.title("Stock Portfolio Manager")
@@ -146,8 +414,47 @@ class MainWindow:
         y = (screen_height - 600) // 2  # 600 is window height
         self._root.geometry(f"+{x}+{y}")
 
-        self._portfolio = StorageManager.load_portfolio()
+        # Saves return at once; a burst of edits becomes one background write
+        self._storage = WriteBehindStorage(create_storage())
+        self._portfolio = self._storage.load_portfolio()
+        self._portfolio.provider = self._provider
+        # Subscribes before the window does, so views are current when it redraws
+        self._index = HoldingsIndex(self._portfolio)
+        self._sort_key = "ticker"
+        self._descending = False
+        self._search = ""
+
+        # Imported here so the login window doesn't wait for NumPy
+        from history import HistoryStore
+        self._history = HistoryStore()
+        self._portfolio.history = self._history
+        # Price fetches run on worker threads so the window keeps repainting
+        self._runner = BackgroundRunner()
+        # Every add and remove is also booked as a buy or sell. The ledger
+        # is replayed on a worker so a long history doesn't delay the window
+        from ledger import Ledger
+        self._ledger: Optional[Ledger] = None
+        self._ledger_ready = False
+        # Trades made while it loads, booked in order once it has
+        self._pending_trades: List[Callable[[Ledger], None]] = []
+        self._ledger_job = self._runner.submit(lambda job: Ledger.from_file())
+        self._poll_job(self._ledger_job, None, self._ledger_loaded)
+        self._refresh_job: Optional[Job] = None
+        self._refresh_total = 0
+        self._refresh_completed = 0
+        # Created the first time auto refresh is switched on
+        self._scheduler: Optional[RefreshScheduler] = None
+        self._scheduler_metadata = None
+        self._auto_refresh_after: Optional[str] = None
+        # Live prices, applied once per frame while the switch is on
+        self._stream: Optional[QuoteStream] = None
+        self._stream_after: Optional[str] = None
+        self._streamed: Set[str] = set()
+        self._root.protocol("WM_DELETE_WINDOW", self._on_close)
+
         self._setup_ui()
+        # From here on the table only redraws what each change touched
+        self._portfolio.subscribe(self._on_portfolio_changed)
 
     def _setup_ui(self) -> None:
         """Set up the user interface."""
@@ -186,22 +493,38 @@ class MainWindow:
         button_frame.pack(fill="x", padx=20, pady=10)
 
         # Add stock button
-        add_button = ctk.CTkButton(
+        self._add_button = ctk.CTkButton(
             button_frame,
             text="Add Stock",
             command=self._add_stock,
             width=150
         )
-        add_button.pack(side="left", padx=5)
+        self._add_button.pack(side="left", padx=5)
 
-        # Refresh button
-        refresh_button = ctk.CTkButton(
+        # Refresh button (turns into a cancel button while refreshing)
+        self._refresh_button = ctk.CTkButton(
             button_frame,
             text="Refresh Prices",
             command=self._refresh_prices,
             width=150
         )
-        refresh_button.pack(side="left", padx=5)
+        self._refresh_button.pack(side="left", padx=5)
+
+        # Auto refresh polls each holding while its market is open
+        self._auto_refresh_switch = ctk.CTkSwitch(
+            button_frame,
+            text="Auto Refresh",
+            command=self._toggle_auto_refresh
+        )
+        self._auto_refresh_switch.pack(side="left", padx=5)
+
+        # Live prices pushed by the quote stream instead of polled
+        self._stream_switch = ctk.CTkSwitch(
+            button_frame,
+            text="Live Prices",
+            command=self._toggle_stream
+        )
+        self._stream_switch.pack(side="left", padx=5)
 
         # Status message
         self._status_label = ctk.CTkLabel(
@@ -216,61 +539,83 @@ class MainWindow:
 
     def _setup_portfolio_display(self, parent: ctk.CTkFrame) -> None:
         """Set up the portfolio display area."""
-        # Create scrollable frame
-        self._portfolio_frame = ctk.CTkScrollableFrame(parent)
-        self._portfolio_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        # Search and sort controls
+        view_frame = ctk.CTkFrame(parent, fg_color="transparent")
+        view_frame.pack(fill="x", padx=20)
 
-        # Headers
-        headers = ["Ticker", "Quantity", "Price", "Total Value", ""]
-        for i, header in enumerate(headers):
-            label = ctk.CTkLabel(
-                self._portfolio_frame,
-                text=header,
-                font=(THEME["font_family"], THEME["normal_size"], "bold")
-            )
-            label.grid(row=0, column=i, padx=5, pady=5, sticky="w")
+        search_label = ctk.CTkLabel(view_frame, text="Search:")
+        search_label.pack(side="left", padx=5)
+
+        self._search_entry = ctk.CTkEntry(view_frame, width=120, placeholder_text="Ticker prefix")
+        self._search_entry.pack(side="left", padx=5)
+        self._search_entry.bind("<KeyRelease>", self._on_search)
+
+        sort_label = ctk.CTkLabel(view_frame, text="Sort by:")
+        sort_label.pack(side="left", padx=5)
+
+        self._sort_menu = ctk.CTkOptionMenu(
+            view_frame,
+            values=list(self.SORT_LABELS),
+            command=lambda label: self._sort_by(self.SORT_LABELS[label]),
+            width=130
+        )
+        self._sort_menu.pack(side="left", padx=5)
+
+        self._total_label = ctk.CTkLabel(
+            view_frame,
+            text="",
+            font=(THEME["font_family"], THEME["normal_size"], "bold")
+        )
+        self._total_label.pack(side="right", padx=5)
+
+        self._table = HoldingsTable(parent, on_remove=self._remove_stock, on_sort=self._sort_by)
+        self._table.pack(fill="both", expand=True, padx=20, pady=10)
 
         self._update_portfolio_display()
 
+    @instrumentation.timed("gui.update_portfolio_display")
     def _update_portfolio_display(self) -> None:
-        """Update the portfolio display."""
-        # Clear existing rows (except headers)
-        for widget in self._portfolio_frame.winfo_children()[5:]:
-            widget.destroy()
-
-        # Add each stock
-        for i, (ticker, stock) in enumerate(self._portfolio.get_holdings().items(), 1):
-            # Ticker
-            ctk.CTkLabel(
-                self._portfolio_frame,
-                text=ticker
-            ).grid(row=i, column=0, padx=5, pady=2)
-
-            # Quantity
-            ctk.CTkLabel(
-                self._portfolio_frame,
-                text=str(stock.quantity)
-            ).grid(row=i, column=1, padx=5, pady=2)
-
-            # Price
-            ctk.CTkLabel(
-                self._portfolio_frame,
-                text=f"${stock.price:.2f}"
-            ).grid(row=i, column=2, padx=5, pady=2)
-
-            # Total Value
-            ctk.CTkLabel(
-                self._portfolio_frame,
-                text=f"${stock.total_value:.2f}"
-            ).grid(row=i, column=3, padx=5, pady=2)
-
-            # Remove button
-            ctk.CTkButton(
-                self._portfolio_frame,
-                text="Remove",
-                command=lambda t=ticker: self._remove_stock(t),
-                width=80
-            ).grid(row=i, column=4, padx=5, pady=2)
+        """Show the current sort and search from the holdings index."""
+        view = self._index.view(self._sort_key, self._descending, self._search)
+        self._table.set_rows(view, self._portfolio.get_stock)
+        self._table.show_sort(self._sort_key, self._descending)
+        self._show_total(self._portfolio.get_total_value())
+
+    def _sort_by(self, key: str) -> None:
+        """Sort by a key, or flip the direction if already sorted by it."""
+        if key == self._sort_key:
+            self._descending = not self._descending
+        else:
+            # Biggest first for numbers and newest first for times
+            self._sort_key, self._descending = key, key != "ticker"
+        label = next(label for label, k in self.SORT_LABELS.items() if k == key)
+        self._sort_menu.set(label)
+        self._update_portfolio_display()
+
+    def _on_search(self, event=None) -> None:
+        """Filter the table to tickers starting with the search text."""
+        search = self._search_entry.get().strip().upper()
+        if search != self._search:
+            self._search = search
+            self._update_portfolio_display()
+
+    def _show_total(self, total: float) -> None:
+        """Show the portfolio's total value."""
+        self._total_label.configure(text=f"Total Value: ${total:,.2f}")
+
+    @instrumentation.timed("gui.portfolio_changed")
+    def _on_portfolio_changed(self, event: PortfolioChanges) -> None:
+        """Update the display for one batch of portfolio changes."""
+        if event.structural or self._sort_key != "ticker":
+            # Rows came, went or may have moved; the view is live, so
+            # redrawing what's on screen is enough
+            self._table.refresh()
+        else:
+            self._table.update_rows(event.changes)
+        self._show_total(event.total_value)
+        if self._stream is not None and event.structural:
+            self._stream.subscribe(event.tickers(ADDED))
+            self._stream.unsubscribe(event.tickers(REMOVED))
 
     def _add_stock(self) -> None:
         """Add a stock to the portfolio."""
@@ -292,18 +637,39 @@ class MainWindow:
                 text="Fetching stock price...",
                 text_color=THEME["colors"]["text"]
             )
-            self._root.update()
+            self._add_button.configure(state="disabled")
+
+            # Get current price in the background
+            job = self._runner.submit(lambda job: self._get_stock_price(ticker))
+            self._poll_job(job, None, lambda job: self._finish_add_stock(job, ticker, quantity))
+
+        except ValueError as e:
+            self._status_label.configure(
+                text=str(e),
+                text_color=THEME["colors"]["error"]
+            )
+        except Exception as e:
+            logger.error(f"Error adding stock: {e}")
+            self._add_button.configure(state="normal")
+            self._status_label.configure(
+                text="Error adding stock",
+                text_color=THEME["colors"]["error"]
+            )
 
-            # Get current price
-            price = self._get_stock_price(ticker)
+    def _finish_add_stock(self, job: Job, ticker: str, quantity: int) -> None:
+        """Add the stock once its price has been fetched."""
+        self._add_button.configure(state="normal")
+        try:
+            price = job.result()
 
             # Create and add stock
-            stock = Stock(ticker=ticker, quantity=quantity, price=price)
+            stock = Stock(ticker=ticker, quantity=quantity, price=price, last_updated=datetime.now())
             self._portfolio.add_stock(stock)
+            when = stock.last_updated
+            self._book_trade(lambda ledger: ledger.buy(ticker, quantity, price, when))
 
-            # Save and update display
-            StorageManager.save_portfolio(self._portfolio)
-            self._update_portfolio_display()
+            # Save (the display updates from the portfolio's change event)
+            self._storage.save_changes(self._portfolio, [ticker])
 
             # Clear inputs and show success message
             self._ticker_entry.delete(0, 'end')
@@ -328,9 +694,23 @@ class MainWindow:
     def _remove_stock(self, ticker: str) -> None:
         """Remove a stock from the portfolio."""
         try:
+            stock = self._portfolio.get_stock(ticker)
             self._portfolio.remove_stock(ticker)
-            StorageManager.save_portfolio(self._portfolio)
-            self._update_portfolio_display()
+            if stock is not None:
+                # Book the sale at a fresh cached quote if there is one;
+                # otherwise at the holding's price, which is the last quote
+                # applied to it (removing shouldn't wait on the network)
+                price = self._provider.cache.get(ticker) or stock.price
+                when = datetime.now()
+
+                def sell(ledger: "Ledger") -> None:
+                    # Holdings added before the ledger existed aren't in it
+                    position = ledger.position(ticker)
+                    if position is not None and position.quantity:
+                        ledger.sell(ticker, min(stock.quantity, position.quantity), price, when)
+
+                self._book_trade(sell)
+            self._storage.save_changes(self._portfolio, [ticker])
             self._status_label.configure(
                 text=f"Removed {ticker}",
                 text_color=THEME["colors"]["success"]
@@ -342,21 +722,111 @@ class MainWindow:
                 text_color=THEME["colors"]["error"]
             )
 
-    def _refresh_prices(self) -> None:
-        """Refresh all stock prices."""
+    def _ledger_loaded(self, job: Job) -> None:
+        """Keep the loaded ledger and book the trades made while it loaded."""
         try:
+            self._ledger = job.result()
+        except Exception as e:
+            # Trades then aren't booked, but the portfolio still works
+            logger.error(f"Transaction ledger unavailable: {e}")
+        self._ledger_ready = True
+        trades, self._pending_trades = self._pending_trades, []
+        for trade in trades:
+            self._book_trade(trade)
+
+    def _book_trade(self, trade: Callable[["Ledger"], None]) -> None:
+        """
+        Book a trade in the ledger, or queue it if the ledger is still loading.
+
+        Args:
+            trade: Function that records the trade on the ledger
+        """
+        if not self._ledger_ready:
+            self._pending_trades.append(trade)
+            return
+        if self._ledger is None:
+            return
+        try:
+            trade(self._ledger)
+        except Exception as e:
+            logger.error(f"Could not book trade: {e}")
+
+    def _refresh_prices(self, tickers: Optional[List[str]] = None) -> None:
+        """
+        Start refreshing stock prices in the background.
+
+        Args:
+            tickers: Holdings to refresh (defaults to all of them)
+        """
+        # Only one refresh at a time
+        if self._refresh_job is not None:
+            return
+
+        if tickers is None:
+            tickers = self._portfolio.get_tickers()
+        if not tickers:
             self._status_label.configure(
-                text="Updating prices...",
+                text="No stocks to refresh",
                 text_color=THEME["colors"]["text"]
             )
-            self._root.update()
+            return
 
-            self._portfolio.update_prices()
-            StorageManager.save_portfolio(self._portfolio)
-            self._update_portfolio_display()
+        self._refresh_total = len(tickers)
+        self._refresh_completed = 0
+        self._status_label.configure(
+            text=f"Updating prices... 0/{self._refresh_total}",
+            text_color=THEME["colors"]["text"]
+        )
+        self._refresh_button.configure(text="Cancel Refresh", command=self._cancel_refresh)
+
+        self._refresh_job = self._runner.submit(
+            lambda job: self._portfolio.fetch_prices(
+                tickers,
+                progress=job.report_progress,
+                cancel=job.cancel_event
+            )
+        )
+        self._poll_job(self._refresh_job, self._on_refresh_progress, self._finish_refresh)
+
+    def _cancel_refresh(self) -> None:
+        """Cancel the running refresh."""
+        if self._refresh_job is not None:
+            self._refresh_job.cancel()
+            self._status_label.configure(
+                text="Cancelling refresh...",
+                text_color=THEME["colors"]["text"]
+            )
 
+    def _on_refresh_progress(self, results: List[RefreshResult]) -> None:
+        """Show how many tickers have been fetched so far."""
+        self._refresh_completed += len(results)
+        if not self._refresh_job.cancelled:
             self._status_label.configure(
-                text="Prices updated successfully",
+                text=f"Updating prices... {self._refresh_completed}/{self._refresh_total}"
+            )
+
+    def _finish_refresh(self, job: Job) -> None:
+        """Apply the fetched prices on the UI thread."""
+        self._refresh_job = None
+        self._refresh_button.configure(text="Refresh Prices", command=self._refresh_prices)
+        try:
+            report: RefreshReport = job.result()
+            self._portfolio.apply_prices(report)
+            if self._scheduler is not None:
+                # Manual refreshes push back the automatic ones too
+                self._scheduler.record(report)
+            self._storage.save_changes(self._portfolio, report.succeeded)
+            self._runner.submit(lambda job: self._history.flush())
+
+            failed = len(report.failed)
+            if report.cancelled:
+                text = f"Refresh cancelled ({len(report.succeeded)} prices updated)"
+            elif failed:
+                text = f"Prices updated ({failed} failed)"
+            else:
+                text = "Prices updated successfully"
+            self._status_label.configure(
+                text=text,
                 text_color=THEME["colors"]["success"]
             )
         except Exception as e:
@@ -366,27 +836,134 @@ class MainWindow:
                 text_color=THEME["colors"]["error"]
             )
 
-    def _get_stock_price(self, ticker: str) -> float:
-        """Get the current stock price."""
-        try:
-            stock = yf.Ticker(ticker)
-            info = stock.fast_info
-
-            if hasattr(info, 'last_price') and info.last_price:
-                return float(info.last_price)
+    def _toggle_auto_refresh(self) -> None:
+        """Start or stop refreshing prices on the market-hours schedule."""
+        if self._auto_refresh_switch.get():
+            if self._scheduler is None:
+                from metadata import MetadataStore
+                self._scheduler_metadata = MetadataStore()
+                self._scheduler = RefreshScheduler(self._portfolio, metadata=self._scheduler_metadata)
+            self._auto_refresh_tick()
+        elif self._auto_refresh_after is not None:
+            self._root.after_cancel(self._auto_refresh_after)
+            self._auto_refresh_after = None
+
+    def _auto_refresh_tick(self) -> None:
+        """Refresh whatever is due, then sleep until the next ticker is."""
+        if self._refresh_job is None:
+            due = self._scheduler.due()
+            if due:
+                self._refresh_prices(due)
+        # Wake at least once a minute; while a refresh runs, check back soon
+        next_due = self._scheduler.next_due()
+        wait = 60.0 if next_due is None else min(max(next_due - self._scheduler.clock(), 1.0), 60.0)
+        self._auto_refresh_after = self._root.after(int(wait * 1000), self._auto_refresh_tick)
+
+    def _toggle_stream(self) -> None:
+        """Start or stop live prices from the quote stream."""
+        if self._stream_switch.get():
+            self._stream = QuoteStream().start()
+            self._stream.subscribe(self._portfolio.get_tickers())
+            self._stream_frame()
+            self._status_label.configure(
+                text="Live prices on",
+                text_color=THEME["colors"]["text"]
+            )
+        else:
+            self._stop_stream()
+            self._status_label.configure(
+                text="Live prices off",
+                text_color=THEME["colors"]["text"]
+            )
 
-            # Fallback to regular info
-            info = stock.info
-            price = info.get('regularMarketPrice')
-            if price:
-                return float(price)
+    def _stream_frame(self) -> None:
+        """
+        Apply the ticks that arrived since the last frame.
 
-            raise ValueError(f"Could not get price for {ticker}")
+        Ticks are merged per ticker between frames, so however fast they
+        come the table gets at most STREAM_MAX_FPS batches a second.
+        """
+        try:
+            self._streamed.update(self._stream.apply(self._portfolio))
+        except Exception as e:
+            logger.error(f"Error applying live prices: {e}")
+        finally:
+            # One bad frame mustn't stop the stream while the switch shows it on
+            self._stream_after = self._root.after(1000 // STREAM_MAX_FPS, self._stream_frame)
+
+    @staticmethod
+    def _join_stream(stream: QuoteStream) -> None:
+        """Wait for a stopped stream's reader thread (runs on its own thread)."""
+        if not stream.join():
+            logger.warning("Quote stream reader didn't stop in time")
+
+    def _stop_stream(self) -> None:
+        """Disconnect the quote stream and save what it changed."""
+        if self._stream is None:
+            return
+        if self._stream_after is not None:
+            self._root.after_cancel(self._stream_after)
+            self._stream_after = None
+        # Joining can take up to the reconnect delay, so it's done off the UI thread
+        stream = self._stream
+        stream.stop()
+        threading.Thread(
+            target=self._join_stream, args=(stream,), name="quote-stream-join", daemon=True
+        ).start()
+        self._stream = None
+        # Streamed prices are saved once here, not on every frame
+        if self._streamed:
+            self._storage.save_changes(self._portfolio, list(self._streamed))
+            self._streamed.clear()
+
+    def _poll_job(
+        self,
+        job: Job,
+        on_progress: Optional[Callable[[List], None]],
+        on_done: Callable[[Job], None]
+    ) -> None:
+        """
+        Check a background job from the UI thread.
+
+        Re-schedules itself with after() until the job finishes, handling a
+        bounded batch of progress items per tick so repaints aren't starved.
+        """
+        items = job.drain(limit=500)
+        if items and on_progress is not None:
+            on_progress(items)
+
+        if job.done:
+            on_done(job)
+        else:
+            self._root.after(UI_POLL_INTERVAL_MS, self._poll_job, job, on_progress, on_done)
 
+    def _get_stock_price(self, ticker: str) -> float:
+        """Get the current stock price (from the quote caches if recent)."""
+        try:
+            return self._provider.get_price(ticker)
         except Exception as e:
             logger.error(f"Error fetching price for {ticker}: {str(e)}")
             raise ValueError(f"Error fetching price for {ticker}. Please verify the ticker symbol.")
 
+    def _on_close(self) -> None:
+        """Stop background work and close the window."""
+        if self._auto_refresh_after is not None:
+            self._root.after_cancel(self._auto_refresh_after)
+        if not self._ledger_ready and self._pending_trades:
+            # Closing anyway, so wait for the ledger rather than lose trades
+            self._ledger_loaded(self._ledger_job)
+        self._runner.shutdown()
+        self._stop_stream()
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler_metadata.close()
+        self._index.close()
+        self._provider.close()
+        self._history.close()
+        # Writes whatever is still pending
+        self._storage.close()
+        self._root.destroy()
+
     def run(self) -> None:
         """Run the main window."""
         self._root.mainloop()
\ No newline at end of file
@@ -0,0 +1,528 @@
+"""
+Price history store for the stock importer application.
+
+Every quote a refresh sees is appended to a per-ticker series file, so
+the price history survives update_prices overwriting Stock.price. Each
+file is a run of compressed blocks of up to HISTORY_BLOCK_SIZE points.
+Times are delta-encoded, and times and prices are byte-shuffled before
+zlib, which shrinks a point from 16 bytes to a few. Every block header
+holds the block's first and last time, so a range query only
+decompresses the blocks it overlaps.
+
+A second series per ticker keeps only the last quote of each day. Daily
+downsampling reads that instead of the raw quotes, so a year of daily
+closes is about one block per ticker however often prices were refreshed.
+
+Layout of a series file (little-endian):
+    header   MAGIC, VERSION (see _FILE_HEADER)
+    blocks   _BLOCK_HEADER, then payload_size bytes of zlib data holding
+             count-1 time deltas (int64 us) and count prices (float64)
+
+Times are naive local datetime64[us], like Stock.last_updated.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote, unquote
+import logging
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+from columnar import TIME_DTYPE
+from refresh import RefreshReport
+import config
+from config import HISTORY_BLOCK_SIZE
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STKHIST\0"
+VERSION = 1
+RAW_SUFFIX = ".hist"
+DAILY_SUFFIX = ".daily.hist"
+
+# magic, version, reserved
+_FILE_HEADER = struct.Struct("<8sII")
+# count, first time (us), last time (us), payload size, payload checksum
+_BLOCK_HEADER = struct.Struct("<IqqII")
+
+_DAY_US = 86_400_000_000
+# Reducers for downsample(); each takes (values, bucket starts)
+_REDUCERS = {
+    "first": lambda values, starts: values[starts],
+    "last": lambda values, starts: values[np.concatenate([starts[1:], [len(values)]]) - 1],
+    "min": np.minimum.reduceat,
+    "max": np.maximum.reduceat,
+    "mean": lambda values, starts: (
+        np.add.reduceat(values, starts) / np.diff(np.concatenate([starts, [len(values)]]))
+    ),
+}
+
+class HistoryError(Exception):
+    """Raised when a history file is not a series file or from another version."""
+    pass
+
+def _shuffle(values: np.ndarray) -> bytes:
+    """Group the bytes of 8-byte values by position, which zlib compresses far better."""
+    return values.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+def _unshuffle(data: bytes, dtype: str) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint8).reshape(8, -1).T.copy().view(dtype).ravel()
+
+def _encode(times: np.ndarray, prices: np.ndarray) -> bytes:
+    """Compress one block of points."""
+    deltas = np.diff(times)
+    return zlib.compress(_shuffle(deltas) + _shuffle(prices), 1)
+
+def _decode(payload: bytes, count: int, first: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Decompress one block of points."""
+    data = zlib.decompress(payload)
+    split = (count - 1) * 8
+    times = np.empty(count, dtype=np.int64)
+    times[0] = first
+    np.cumsum(_unshuffle(data[:split], "<i8"), out=times[1:])
+    times[1:] += first
+    return times, _unshuffle(data[split:], "<f8")
+
+def _daily_last(times: np.ndarray, prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep only the last point of each day (times must be sorted)."""
+    days = times // _DAY_US
+    last = np.flatnonzero(np.concatenate([days[1:] != days[:-1], [True]]))
+    return times[last], prices[last]
+
+@dataclass
+class _Block:
+    """Where one block sits in its file, and the times it covers."""
+    offset: int
+    count: int
+    first: int
+    last: int
+    size: int
+    crc: int
+
+class _SeriesFile:
+    """
+    One append-only series of (time, price) points.
+
+    The block index is read from the headers once and kept in memory; only
+    one process should write a series at a time.
+    """
+
+    def __init__(self, path: Path, block_size: int) -> None:
+        self.path = path
+        self._block_size = block_size
+        self._blocks: Optional[List[_Block]] = None
+        self._tail: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._end = _FILE_HEADER.size
+
+    def _load_index(self) -> List[_Block]:
+        """Read every block header, stopping at the first damaged block."""
+        if self._blocks is not None:
+            return self._blocks
+        blocks: List[_Block] = []
+        self._end = _FILE_HEADER.size
+        if self.path.exists():
+            with open(self.path, "rb") as file:
+                header = file.read(_FILE_HEADER.size).ljust(_FILE_HEADER.size, b"\0")
+                magic, version, _ = _FILE_HEADER.unpack(header)
+                if magic != MAGIC:
+                    raise HistoryError(f"{self.path} is not a history file")
+                if version != VERSION:
+                    raise HistoryError(f"Unsupported history version {version} in {self.path}")
+                offset = _FILE_HEADER.size
+                size = os.fstat(file.fileno()).st_size
+                while offset + _BLOCK_HEADER.size <= size:
+                    header = file.read(_BLOCK_HEADER.size)
+                    count, first, last, payload_size, crc = _BLOCK_HEADER.unpack(header)
+                    if offset + _BLOCK_HEADER.size + payload_size > size:
+                        logger.warning(f"Ignoring truncated block at end of {self.path}")
+                        break
+                    blocks.append(_Block(offset, count, first, last, payload_size, crc))
+                    offset += _BLOCK_HEADER.size + payload_size
+                    file.seek(offset)
+                self._end = offset
+                if blocks:
+                    # Appends and most reads need the tail, so decode it while the file is open
+                    self._tail = self._read_block(file, blocks[-1])
+        self._blocks = blocks
+        return blocks
+
+    def _read_block(self, file, block: _Block) -> Tuple[np.ndarray, np.ndarray]:
+        file.seek(block.offset + _BLOCK_HEADER.size)
+        payload = file.read(block.size)
+        if zlib.crc32(payload) != block.crc:
+            raise HistoryError(f"Checksum mismatch in {self.path} at {block.offset}")
+        return _decode(payload, block.count, block.first)
+
+    def append(self, times: np.ndarray, prices: np.ndarray, daily: bool = False) -> None:
+        """
+        Append points, merging them into the last block if it isn't full.
+
+        Args:
+            times: Times as int64 microseconds
+            prices: Prices
+            daily: Keep only the last point per day (for the daily series)
+        """
+        blocks = self._load_index()
+        if blocks and blocks[-1].count < self._block_size:
+            # Rewrite the partial tail block together with the new points
+            old_times, old_prices = self._tail_points()
+            times = np.concatenate([old_times, times])
+            prices = np.concatenate([old_prices, prices])
+            self._end = blocks.pop().offset
+        order = np.argsort(times, kind="stable")
+        times, prices = times[order], prices[order]
+        if daily:
+            times, prices = _daily_last(times, prices)
+
+        mode = "r+b" if self.path.exists() else "wb"
+        with open(self.path, mode) as file:
+            if mode == "wb":
+                file.write(_FILE_HEADER.pack(MAGIC, VERSION, 0))
+            file.seek(self._end)
+            file.truncate()
+            for start in range(0, len(times), self._block_size):
+                block_times = times[start:start + self._block_size]
+                block_prices = prices[start:start + self._block_size]
+                payload = _encode(block_times, block_prices)
+                header = (len(block_times), int(block_times[0]), int(block_times[-1]),
+                          len(payload), zlib.crc32(payload))
+                file.write(_BLOCK_HEADER.pack(*header))
+                file.write(payload)
+                blocks.append(_Block(self._end, *header))
+                self._end += _BLOCK_HEADER.size + len(payload)
+        self._tail = (block_times, block_prices)
+
+    def _tail_points(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Decoded last block, kept in memory since every append rewrites it."""
+        if self._tail is None:
+            with open(self.path, "rb") as file:
+                self._tail = self._read_block(file, self._blocks[-1])
+        return self._tail
+
+    def read(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Read the points with start <= time <= end, sorted by time.
+
+        Only blocks that overlap the range are decompressed.
+        """
+        blocks = self._load_index()
+        lo = -2**63 if start is None else start
+        hi = 2**63 - 1 if end is None else end
+        wanted = [i for i, b in enumerate(blocks) if b.first <= hi and b.last >= lo]
+        if not wanted:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        parts = []
+        file = None
+        try:
+            for i in wanted:
+                if i == len(blocks) - 1:
+                    parts.append(self._tail_points())
+                    continue
+                if file is None:
+                    file = open(self.path, "rb")
+                parts.append(self._read_block(file, blocks[i]))
+        finally:
+            if file is not None:
+                file.close()
+
+        if len(parts) == 1:
+            times, prices = parts[0]
+        else:
+            times = np.concatenate([p[0] for p in parts])
+            prices = np.concatenate([p[1] for p in parts])
+            if np.any(times[1:] < times[:-1]):
+                # Late quotes went into a later block
+                order = np.argsort(times, kind="stable")
+                times, prices = times[order], prices[order]
+        first = np.searchsorted(times, lo, side="left")
+        last = np.searchsorted(times, hi, side="right")
+        return times[first:last], prices[first:last]
+
+    def disk_size(self) -> int:
+        """Bytes used on disk."""
+        return self.path.stat().st_size if self.path.exists() else 0
+
+def _to_us(when: Union[datetime, np.datetime64, None]) -> Optional[int]:
+    if when is None:
+        return None
+    return int(np.datetime64(when, "us").astype(np.int64))
+
+def _interval_us(interval: Union[str, np.timedelta64]) -> int:
+    """Parse an interval like "1D", "4h", "15m" or "30s"."""
+    if isinstance(interval, np.timedelta64):
+        return int(interval.astype("timedelta64[us]").astype(np.int64))
+    units = {"D": "D", "d": "D", "h": "h", "H": "h", "m": "m", "s": "s", "W": "W", "w": "W"}
+    number, unit = interval[:-1] or "1", interval[-1]
+    if unit not in units:
+        raise ValueError(f"Unknown interval: {interval}")
+    return int(np.timedelta64(int(number), units[unit]).astype("timedelta64[us]").astype(np.int64))
+
+class HistoryStore:
+    """
+    Quote history for every ticker, one series file per ticker.
+
+    Quotes are buffered in memory and written by flush(). Queries include
+    buffered quotes, so nothing has to be flushed before reading.
+    Recording only takes the buffer lock, so it never waits for a flush's
+    disk writes.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path, None] = None,
+        block_size: int = HISTORY_BLOCK_SIZE
+    ) -> None:
+        """
+        Initialize the store.
+
+        Args:
+            directory: Directory holding the series files (defaults to config.HISTORY_DIR)
+            block_size: Points per compressed block
+        """
+        self._dir = Path(directory if directory is not None else config.HISTORY_DIR)
+        self._block_size = block_size
+        # Guards the buffer
+        self._lock = threading.Lock()
+        # Guards the series files; taken before _lock when both are needed
+        self._io_lock = threading.Lock()
+        self._files: Dict[Tuple[str, bool], _SeriesFile] = {}
+        self._pending: Dict[str, Tuple[List[int], List[float]]] = {}
+        # Bumped whenever quotes are recorded, so callers can cache query results
+        self.version = 0
+
+    def _series(self, ticker: str, daily: bool = False) -> _SeriesFile:
+        key = (ticker, daily)
+        series = self._files.get(key)
+        if series is None:
+            name = quote(ticker, safe="") + (DAILY_SUFFIX if daily else RAW_SUFFIX)
+            series = self._files[key] = _SeriesFile(self._dir / name, self._block_size)
+        return series
+
+    def record(self, ticker: str, price: float, when: Optional[datetime] = None) -> None:
+        """
+        Buffer one quote.
+
+        Args:
+            ticker: Stock symbol
+            price: Quoted price
+            when: Time of the quote (defaults to now)
+        """
+        self.record_many([ticker], [price], when)
+
+    def record_many(
+        self,
+        tickers: Sequence[str],
+        prices: Iterable[float],
+        when: Optional[datetime] = None
+    ) -> None:
+        """
+        Buffer quotes for many tickers taken at the same time.
+
+        Args:
+            tickers: Stock symbols
+            prices: Quoted price for each ticker
+            when: Time of the quotes (defaults to now)
+        """
+        stamp = _to_us(when or datetime.now())
+        with self._lock:
+            for ticker, price in zip(tickers, prices):
+                times, values = self._pending.setdefault(ticker, ([], []))
+                times.append(stamp)
+                values.append(float(price))
+            self.version += 1
+
+    def record_report(self, report: RefreshReport, when: Optional[datetime] = None) -> None:
+        """Buffer every successful quote in a refresh report."""
+        ok = [(t, r.price) for t, r in report.results.items() if r.ok]
+        if ok:
+            tickers, prices = zip(*ok)
+            self.record_many(tickers, prices, when)
+
+    def flush(self) -> int:
+        """
+        Write buffered quotes to disk.
+
+        Returns:
+            Number of quotes written
+        """
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            written = 0
+            remaining = dict(pending)
+            try:
+                self._dir.mkdir(parents=True, exist_ok=True)
+                for ticker, (times, prices) in pending.items():
+                    times = np.array(times, dtype=np.int64)
+                    prices = np.array(prices, dtype=np.float64)
+                    self._series(ticker).append(times, prices)
+                    self._series(ticker, daily=True).append(times, prices, daily=True)
+                    del remaining[ticker]
+                    written += len(times)
+            except Exception:
+                # Put back what wasn't written, ahead of anything recorded since
+                with self._lock:
+                    for ticker, (times, prices) in self._pending.items():
+                        old_times, old_prices = remaining.setdefault(ticker, ([], []))
+                        old_times.extend(times)
+                        old_prices.extend(prices)
+                    self._pending = remaining
+                raise
+            return written
+
+    def close(self) -> None:
+        """Flush buffered quotes."""
+        self.flush()
+
+    def tickers(self) -> List[str]:
+        """Tickers with any history, on disk or buffered."""
+        with self._lock:
+            names = set(self._pending)
+        if self._dir.exists():
+            for path in self._dir.iterdir():
+                if path.name.endswith(RAW_SUFFIX) and not path.name.endswith(DAILY_SUFFIX):
+                    names.add(unquote(path.name[:-len(RAW_SUFFIX)]))
+        return sorted(names)
+
+    def _read(
+        self,
+        ticker: str,
+        start: Optional[int],
+        end: Optional[int],
+        daily: bool
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        with self._io_lock:
+            times, prices = self._series(ticker, daily).read(start, end)
+            with self._lock:
+                pending = self._pending.get(ticker)
+                if pending:
+                    new_times = np.array(pending[0], dtype=np.int64)
+                    new_prices = np.array(pending[1], dtype=np.float64)
+        if pending:
+            keep = np.ones(len(new_times), dtype=bool)
+            if start is not None:
+                keep &= new_times >= start
+            if end is not None:
+                keep &= new_times <= end
+            times = np.concatenate([times, new_times[keep]])
+            prices = np.concatenate([prices, new_prices[keep]])
+            order = np.argsort(times, kind="stable")
+            times, prices = times[order], prices[order]
+        return times, prices
+
+    def range(
+        self,
+        ticker: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get every quote for a ticker between two times (inclusive).
+
+        Args:
+            ticker: Stock symbol
+            start: Earliest time (defaults to the beginning)
+            end: Latest time (defaults to the end)
+
+        Returns:
+            (times as datetime64[us], prices), sorted by time
+        """
+        times, prices = self._read(ticker, _to_us(start), _to_us(end), daily=False)
+        return times.view(TIME_DTYPE), prices
+
+    def downsample(
+        self,
+        ticker: str,
+        interval: Union[str, np.timedelta64] = "1D",
+        how: str = "last",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Bucket a ticker's quotes by time and reduce each bucket to one value.
+
+        Buckets are aligned to 1970-01-01, like NumPy datetimes, so weekly
+        buckets start on Thursdays. Whole-day intervals with how="last"
+        (closing prices) are answered from the daily series without
+        touching the raw quotes.
+
+        Args:
+            ticker: Stock symbol
+            interval: Bucket width, e.g. "1D", "1W", "4h", "15m"
+            how: "last", "first", "min", "max" or "mean"
+            start: Earliest time (defaults to the beginning)
+            end: Latest time (defaults to the end)
+
+        Returns:
+            (bucket start times as datetime64[us], values), one per
+            non-empty bucket
+
+        Raises:
+            ValueError: If the interval or reducer is unknown
+        """
+        if how not in _REDUCERS:
+            raise ValueError(f"Unknown reducer: {how}")
+        width = _interval_us(interval)
+        if width <= 0:
+            raise ValueError(f"Interval must be positive: {interval}")
+        return self._downsample(ticker, width, how, _to_us(start), _to_us(end))
+
+    def _downsample(
+        self,
+        ticker: str,
+        width: int,
+        how: str,
+        start: Optional[int],
+        end: Optional[int]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        daily = how == "last" and width % _DAY_US == 0
+        times, prices = self._read(ticker, start, end, daily=daily)
+        if not len(times):
+            return np.empty(0, dtype=TIME_DTYPE), np.empty(0, dtype=np.float64)
+        if daily:
+            # Also drops a day whose close is split across two blocks
+            times, prices = _daily_last(times, prices)
+            if width == _DAY_US:
+                return (times - times % _DAY_US).view(TIME_DTYPE), prices
+
+        buckets = times // width
+        starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+        values = _REDUCERS[how](prices, starts)
+        return (buckets[starts] * width).view(TIME_DTYPE), values
+
+    def daily_closes(
+        self,
+        tickers: Iterable[str],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Get daily closing prices for many tickers.
+
+        Returns:
+            Ticker -> (days as datetime64[us], closes)
+        """
+        start_us, end_us = _to_us(start), _to_us(end)
+        return {
+            ticker: self._downsample(ticker, _DAY_US, "last", start_us, end_us)
+            for ticker in tickers
+        }
+
+    def disk_size(self, ticker: Optional[str] = None) -> int:
+        """Bytes on disk for one ticker, or for the whole store."""
+        if ticker is not None:
+            with self._io_lock:
+                return self._series(ticker).disk_size() + self._series(ticker, True).disk_size()
+        if not self._dir.exists():
+            return 0
+        return sum(path.stat().st_size for path in self._dir.glob("*" + RAW_SUFFIX))
@@ -0,0 +1,336 @@
+"""
+Sort and search indexes over portfolio holdings.
+
+HoldingsIndex subscribes to a Portfolio and keeps its holdings sorted by
+ticker, value, price or last update time as they change, so a sorted or
+filtered view never sorts the whole portfolio on redraw. The ticker
+index doubles as the prefix index for search: every ticker starting with
+a prefix sits in one contiguous run of it.
+
+Each index is a bucketed sorted list (small sorted lists of at most a
+couple of thousand items under a list of their maximums). Inserting or
+removing costs a binary search plus moving at most one bucket, instead
+of shifting a list the size of the portfolio.
+"""
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+from models import HoldingState, Portfolio, PortfolioChanges
+
+logger = logging.getLogger(__name__)
+
+SORT_KEYS = ("ticker", "value", "price", "last_updated")
+BUCKET_SIZE = 1000  # Buckets are split once they reach twice this
+# A batch touching more than this share of the holdings rebuilds the
+# index with one sort instead of moving every entry
+REBUILD_FRACTION = 0.125
+
+# Sort key of each holding state; the ticker breaks ties
+_KEYS: Dict[str, Callable[[str, Tuple[int, float, Any]], Any]] = {
+    "ticker": lambda ticker, state: ticker,
+    "value": lambda ticker, state: (state[0] * state[1], ticker),
+    "price": lambda ticker, state: (state[1], ticker),
+    "last_updated": lambda ticker, state: (state[2], ticker),
+}
+
+class SortedList:
+    """
+    List of unique items kept in sorted order.
+
+    Items are stored in buckets so add and remove don't shift the whole
+    list. Positions are found by adding up bucket sizes.
+    """
+
+    def __init__(self, items: Optional[List] = None) -> None:
+        """
+        Initialize the list.
+
+        Args:
+            items: Initial items, in any order
+        """
+        self._buckets: List[List] = []
+        self._maxes: List = []
+        self._size = 0
+        if items:
+            self.rebuild(items)
+
+    def rebuild(self, items: List) -> None:
+        """Replace the contents with `items`, sorting them in one go."""
+        items = sorted(items)
+        self._buckets = [items[i:i + BUCKET_SIZE] for i in range(0, len(items), BUCKET_SIZE)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._size = len(items)
+
+    def add(self, item) -> None:
+        """Insert an item in order."""
+        if not self._buckets:
+            self._buckets.append([item])
+            self._maxes.append(item)
+        else:
+            pos = bisect_left(self._maxes, item)
+            if pos == len(self._maxes):
+                pos -= 1
+                self._buckets[pos].append(item)
+                self._maxes[pos] = item
+            else:
+                insort(self._buckets[pos], item)
+            bucket = self._buckets[pos]
+            if len(bucket) >= 2 * BUCKET_SIZE:
+                self._buckets[pos:pos + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+                self._maxes[pos:pos + 1] = [bucket[BUCKET_SIZE - 1], bucket[-1]]
+        self._size += 1
+
+    def remove(self, item) -> None:
+        """
+        Remove an item.
+
+        Raises:
+            ValueError: If the item isn't in the list
+        """
+        pos = bisect_left(self._maxes, item)
+        if pos < len(self._buckets):
+            bucket = self._buckets[pos]
+            i = bisect_left(bucket, item)
+            if i < len(bucket) and bucket[i] == item:
+                del bucket[i]
+                self._size -= 1
+                if bucket:
+                    self._maxes[pos] = bucket[-1]
+                else:
+                    del self._buckets[pos]
+                    del self._maxes[pos]
+                return
+        raise ValueError(f"{item!r} not in list")
+
+    def bisect_left(self, item) -> int:
+        """Position where `item` would be inserted, before any equal item."""
+        pos = bisect_left(self._maxes, item)
+        if pos == len(self._buckets):
+            return self._size
+        return self._offset(pos) + bisect_left(self._buckets[pos], item)
+
+    def bisect_right(self, item) -> int:
+        """Position where `item` would be inserted, after any equal item."""
+        pos = bisect_right(self._maxes, item)
+        if pos == len(self._buckets):
+            return self._size
+        return self._offset(pos) + bisect_right(self._buckets[pos], item)
+
+    def _offset(self, pos: int) -> int:
+        """Number of items in the buckets before bucket `pos`."""
+        return sum(len(bucket) for bucket in self._buckets[:pos])
+
+    def islice(self, start: int, stop: int) -> Iterator:
+        """Iterate over the items at positions start to stop."""
+        start = max(0, start)
+        stop = min(self._size, stop)
+        if start >= stop:
+            return iter(())
+        pos = 0
+        # Skip whole buckets before the start
+        while start >= len(self._buckets[pos]):
+            start -= len(self._buckets[pos])
+            stop -= len(self._buckets[pos])
+            pos += 1
+
+        def items() -> Iterator:
+            remaining = stop - start
+            first = start
+            for bucket in islice(self._buckets, pos, None):
+                chunk = bucket[first:first + remaining]
+                yield from chunk
+                remaining -= len(chunk)
+                if not remaining:
+                    return
+                first = 0
+
+        return items()
+
+    def __iter__(self) -> Iterator:
+        for bucket in self._buckets:
+            yield from bucket
+
+    def __len__(self) -> int:
+        return self._size
+
+class HoldingsView:
+    """
+    Live, read-only list of tickers in one sort order, optionally filtered
+    by ticker prefix.
+
+    Supports len() and slicing, which is all the holdings table needs.
+    Reads always reflect the index's current state.
+    """
+
+    def __init__(self, index: "HoldingsIndex", key: str, descending: bool, prefix: str) -> None:
+        self._index = index
+        self._key = key
+        self._descending = descending
+        self._prefix = prefix
+        self._version = -1
+        self._matches: List[str] = []
+
+    def _range(self) -> Tuple[int, int]:
+        """Positions of the prefix's tickers in the ticker index."""
+        tickers = self._index._sorted["ticker"]
+        if not self._prefix:
+            return 0, len(tickers)
+        # No ticker contains this character, so it sorts after every match
+        return tickers.bisect_left(self._prefix), tickers.bisect_left(self._prefix + "\uffff")
+
+    def _filtered(self) -> List[str]:
+        """Tickers matching the prefix, in sort order (cached until the holdings change)."""
+        if self._version != self._index.version:
+            start, stop = self._range()
+            tickers = list(self._index._sorted["ticker"].islice(start, stop))
+            key = _KEYS[self._key]
+            states = self._index._states
+            tickers.sort(key=lambda t: key(t, states[t]))
+            self._matches = tickers
+            self._version = self._index.version
+        return self._matches
+
+    def __len__(self) -> int:
+        if self._prefix and self._key != "ticker":
+            return len(self._filtered())
+        start, stop = self._range()
+        return stop - start
+
+    def __getitem__(self, item: slice) -> List[str]:
+        if not isinstance(item, slice) or item.step not in (None, 1):
+            raise TypeError("HoldingsView only supports contiguous slices")
+        length = len(self)
+        start, stop, _ = item.indices(length)
+        if start >= stop:
+            return []
+        if self._descending:
+            # Rows start..stop counted from the end
+            start, stop = length - stop, length - start
+
+        if self._prefix and self._key != "ticker":
+            rows = self._filtered()[start:stop]
+        else:
+            first, _ = self._range()
+            entries = self._index._sorted[self._key].islice(first + start, first + stop)
+            if self._key == "ticker":
+                rows = list(entries)
+            else:
+                rows = [entry[-1] for entry in entries]
+        if self._descending:
+            rows.reverse()
+        return rows
+
+class HoldingsIndex:
+    """
+    Sorted indexes over a portfolio's holdings, kept up to date from its
+    change events.
+
+    The ticker index is built up front; the others on first use. Create
+    the index before any subscriber that reads views from it, so it
+    has already seen each change when they're told about it.
+
+    Attributes:
+        version: Goes up on every change that reached the index
+    """
+
+    def __init__(self, portfolio: Portfolio) -> None:
+        """
+        Index a portfolio and follow its changes.
+
+        Args:
+            portfolio: Holdings to index
+        """
+        self._portfolio = portfolio
+        self._states: Dict[str, HoldingState] = portfolio.get_states()
+        self._sorted: Dict[str, SortedList] = {"ticker": SortedList(list(self._states))}
+        self.version = 0
+        portfolio.subscribe(self._on_changes)
+
+    def close(self) -> None:
+        """Stop following the portfolio."""
+        self._portfolio.unsubscribe(self._on_changes)
+
+    def _entries(self, key: str) -> List:
+        """Index entries for every holding under one sort key."""
+        fn = _KEYS[key]
+        return [fn(ticker, state) for ticker, state in self._states.items()]
+
+    def _index(self, key: str) -> SortedList:
+        """The sorted list for a key, built on first use."""
+        if key not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {key}")
+        index = self._sorted.get(key)
+        if index is None:
+            index = self._sorted[key] = SortedList(self._entries(key))
+        return index
+
+    def _on_changes(self, event: PortfolioChanges) -> None:
+        """Move the changed holdings to their new positions."""
+        self.version += 1
+        changes = event.changes.values()
+        states = self._states
+        if len(event.changes) > REBUILD_FRACTION * max(len(states), 1):
+            for change in changes:
+                if change.new_quantity is None:
+                    states.pop(change.ticker, None)
+                else:
+                    states[change.ticker] = (change.new_quantity, change.new_price, change.new_updated)
+            for key, index in self._sorted.items():
+                # Tickers only move when holdings come and go
+                if key != "ticker" or event.structural:
+                    index.rebuild(self._entries(key))
+            return
+
+        for change in changes:
+            ticker = change.ticker
+            old = states.get(ticker)
+            new = None
+            if change.new_quantity is not None:
+                new = (change.new_quantity, change.new_price, change.new_updated)
+            for key, index in self._sorted.items():
+                fn = _KEYS[key]
+                old_entry = fn(ticker, old) if old is not None else None
+                new_entry = fn(ticker, new) if new is not None else None
+                if old_entry == new_entry:
+                    continue
+                if old_entry is not None:
+                    index.remove(old_entry)
+                if new_entry is not None:
+                    index.add(new_entry)
+            if new is None:
+                states.pop(ticker, None)
+            else:
+                states[ticker] = new
+
+    def view(self, key: str = "ticker", descending: bool = False, prefix: str = "") -> HoldingsView:
+        """
+        Get the holdings in one order.
+
+        Args:
+            key: One of SORT_KEYS
+            descending: Largest first
+            prefix: Only tickers starting with this (case-sensitive)
+
+        Returns:
+            Live HoldingsView of tickers
+
+        Raises:
+            ValueError: If the key is unknown
+        """
+        self._index(key)
+        return HoldingsView(self, key, descending, prefix)
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Get tickers starting with a prefix, in ticker order.
+
+        Args:
+            prefix: Start of the ticker
+            limit: Most tickers to return
+        """
+        view = self.view("ticker", prefix=prefix)
+        return view[:limit if limit is not None else len(view)]
+
+    def __len__(self) -> int:
+        return len(self._states)
@@ -0,0 +1,258 @@
+"""
+Opt-in instrumentation for the stock importer application.
+
+Timing spans, counters and latency histograms for the hot paths, plus
+tracemalloc snapshot diffs and cProfile capture on demand. Everything is
+off unless STOCK_INSTRUMENT is set or enable() is called; while off,
+span() hands back a shared no-op context manager and count()/observe()
+return after one flag check, so the calls can stay in hot code.
+
+Usage:
+    with instrumentation.span("storage.save_portfolio"):
+        ...
+
+    @instrumentation.timed("models.update_prices")
+    def update_prices(...): ...
+"""
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Union
+import bisect
+import logging
+import threading
+import time
+import tracemalloc
+from config import INSTRUMENT
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in seconds; the last bucket is open-ended
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+_enabled = INSTRUMENT
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_histograms: Dict[str, "Histogram"] = {}
+_NULL_SPAN = nullcontext()
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram."""
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        """Record one duration."""
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile.
+
+        Returns:
+            Upper bound of the bucket holding the quantile (the max for the
+            open-ended bucket), or 0.0 if nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, float]:
+        """Summarize as a JSON-friendly dict."""
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max
+        }
+
+def enabled() -> bool:
+    """True if instrumentation is recording."""
+    return _enabled
+
+def enable() -> None:
+    """Start recording spans, counters and histograms."""
+    global _enabled
+    _enabled = True
+
+def disable() -> None:
+    """Stop recording. Data recorded so far is kept."""
+    global _enabled
+    _enabled = False
+
+def reset() -> None:
+    """Drop everything recorded so far."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def count(name: str, n: int = 1) -> None:
+    """Add to a counter."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def observe(name: str, seconds: float) -> None:
+    """Record a duration in a histogram."""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(seconds)
+
+@contextmanager
+def _span(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def span(name: str) -> ContextManager[None]:
+    """
+    Time a block into the histogram called name.
+
+    Args:
+        name: Histogram name, e.g. "storage.save_portfolio"
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _span(name)
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorator that times every call of a function with span(name)."""
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def snapshot() -> Dict[str, Any]:
+    """
+    Get everything recorded so far.
+
+    Returns:
+        {"counters": {...}, "histograms": {name: summary}}
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {name: h.to_dict() for name, h in _histograms.items()}
+        }
+
+def format_report(data: Optional[Dict[str, Any]] = None) -> str:
+    """Format a snapshot() as a text table."""
+    data = data if data is not None else snapshot()
+    lines = [f"{'span':<36} {'count':>8} {'mean ms':>10} {'p95 ms':>10} {'max ms':>10}"]
+    for name, h in sorted(data["histograms"].items()):
+        lines.append(
+            f"{name:<36} {h['count']:>8} {h['mean'] * 1000:>10.2f} "
+            f"{h['p95'] * 1000:>10.2f} {h['max'] * 1000:>10.2f}"
+        )
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"{name:<36} {value:>8}")
+    return "\n".join(lines)
+
+def start_memory_tracing(frames: int = 1) -> None:
+    """Start tracemalloc if it isn't running. Slows every allocation."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def stop_memory_tracing() -> None:
+    """Stop tracemalloc."""
+    tracemalloc.stop()
+
+def memory_snapshot() -> Optional[tracemalloc.Snapshot]:
+    """Take a tracemalloc snapshot, or None if tracing isn't running."""
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.take_snapshot()
+
+def memory_diff(
+    before: tracemalloc.Snapshot,
+    after: Optional[tracemalloc.Snapshot] = None,
+    top: int = 10
+) -> List[str]:
+    """
+    Compare two tracemalloc snapshots.
+
+    Args:
+        before: Earlier snapshot
+        after: Later snapshot (defaults to one taken now)
+        top: Number of lines to return
+
+    Returns:
+        The biggest allocation changes by source line, largest first
+    """
+    after = after if after is not None else memory_snapshot()
+    if after is None:
+        return []
+    return [str(stat) for stat in after.compare_to(before, "lineno")[:top]]
+
+def memory_top(top: int = 3) -> List[str]:
+    """Current and peak traced memory plus the biggest allocators."""
+    if not tracemalloc.is_tracing():
+        return []
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Current memory usage: {current / 10**6:.1f}MB, peak {peak / 10**6:.1f}MB"]
+    lines.extend(str(stat) for stat in tracemalloc.take_snapshot().statistics("lineno")[:top])
+    return lines
+
+@contextmanager
+def profile(path: Union[str, Path, None] = None, top: int = 30) -> Iterator[Any]:
+    """
+    Capture a cProfile of a block.
+
+    Args:
+        path: Write pstats data here (view with `python -m pstats path`).
+            If None, the top functions by cumulative time are logged instead.
+        top: Functions to log when there's no path
+
+    Yields:
+        The cProfile.Profile being recorded
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path is not None:
+            profiler.dump_stats(str(path))
+            logger.info(f"Profile written to {path}")
+        else:
+            import io
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+            logger.info(out.getvalue())
@@ -0,0 +1,415 @@
+"""
+Transaction ledger for the stock importer application.
+
+Records buys and sells as lots and keeps each position's quantity, cost
+basis and realized P&L up to date as every transaction is applied, so
+nothing is ever recomputed from the full ledger. Sells are matched
+against lots first-in first-out ("fifo") or at the position's average
+cost ("average").
+
+Transactions are stored in an append-only CSV next to the portfolio.
+Ledger.from_file streams it in one pass without keeping the
+transactions in memory. Unless asked to be strict it skips rows it can't
+apply (such as a line torn by a crash mid-append) and logs them, so one
+bad row doesn't make the whole history unreadable.
+"""
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Iterator, Mapping, Optional, Union
+import csv
+import logging
+import os
+import config
+from config import COST_METHOD
+from models import Portfolio, Stock
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("fifo", "average")
+COLUMNS = ("Date", "Ticker", "Side", "Quantity", "Price")
+BUY = "buy"
+SELL = "sell"
+
+@dataclass
+class Transaction:
+    """
+    One buy or sell.
+
+    Attributes:
+        ticker: Stock symbol
+        side: "buy" or "sell"
+        quantity: Number of shares (positive)
+        price: Price per share
+        when: Time of the trade
+    """
+    ticker: str
+    side: str
+    quantity: int
+    price: float
+    when: datetime
+
+@dataclass
+class Lot:
+    """
+    Shares bought in one transaction that haven't been sold yet.
+
+    Attributes:
+        quantity: Shares left in the lot
+        price: Cost per share
+        when: Time of the purchase
+    """
+    __slots__ = ("quantity", "price", "when")
+    quantity: int
+    price: float
+    when: datetime
+
+class Position:
+    """
+    Open lots and running totals for one ticker.
+
+    Attributes:
+        ticker: Stock symbol
+        method: "fifo" or "average"
+        lots: Open lots, oldest first
+        quantity: Shares held
+        cost_basis: Total cost of the shares held
+        realized_pnl: Profit or loss on everything sold so far
+    """
+
+    def __init__(self, ticker: str, method: str = COST_METHOD) -> None:
+        """
+        Initialize an empty position.
+
+        Raises:
+            ValueError: If the method is unknown
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown cost method: {method}")
+        self.ticker = ticker
+        self.method = method
+        self.lots: Deque[Lot] = deque()
+        self.quantity = 0
+        self.cost_basis = 0.0
+        self.realized_pnl = 0.0
+
+    @property
+    def average_cost(self) -> float:
+        """Cost per share held (0.0 when flat)."""
+        return self.cost_basis / self.quantity if self.quantity else 0.0
+
+    def buy(self, quantity: int, price: float, when: datetime) -> None:
+        """Open a lot."""
+        self.lots.append(Lot(quantity, price, when))
+        self.quantity += quantity
+        self.cost_basis += quantity * price
+
+    def sell(self, quantity: int, price: float) -> float:
+        """
+        Close shares against open lots.
+
+        Args:
+            quantity: Shares sold
+            price: Sale price per share
+
+        Returns:
+            Realized P&L of this sale
+
+        Raises:
+            ValueError: If more shares are sold than held
+        """
+        if quantity > self.quantity:
+            raise ValueError(f"Cannot sell {quantity} {self.ticker}, only {self.quantity} held")
+
+        if self.method == "average":
+            cost = self.average_cost * quantity
+        else:
+            cost = 0.0
+        # Lots are always used up oldest first; under "average" only the
+        # quantities matter, not the lot prices
+        remaining = quantity
+        lots = self.lots
+        while remaining:
+            lot = lots[0]
+            used = min(lot.quantity, remaining)
+            if self.method == "fifo":
+                cost += used * lot.price
+            lot.quantity -= used
+            remaining -= used
+            if not lot.quantity:
+                lots.popleft()
+
+        self.quantity -= quantity
+        # Snap to zero when flat so rounding errors don't linger
+        self.cost_basis = self.cost_basis - cost if self.quantity else 0.0
+        pnl = quantity * price - cost
+        self.realized_pnl += pnl
+        return pnl
+
+    def unrealized_pnl(self, price: float) -> float:
+        """Profit or loss on the shares held at a given price."""
+        return self.quantity * price - self.cost_basis
+
+class Ledger:
+    """
+    Positions built from transactions, with portfolio-wide running totals.
+
+    Attributes:
+        method: "fifo" or "average"
+        realized_pnl: Realized P&L across all positions
+        transaction_count: Transactions applied
+        skipped_rows: Ledger file rows that couldn't be applied
+    """
+
+    def __init__(self, method: str = COST_METHOD, path: Union[str, Path, None] = None) -> None:
+        """
+        Initialize an empty ledger.
+
+        Args:
+            method: How sells are matched to lots
+            path: CSV file that record() appends to (None keeps the
+                ledger in memory only)
+
+        Raises:
+            ValueError: If the method is unknown
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown cost method: {method}")
+        self.method = method
+        self._path = Path(path) if path is not None else None
+        self._positions: Dict[str, Position] = {}
+        self.realized_pnl = 0.0
+        self.transaction_count = 0
+        self.skipped_rows = 0
+
+    @classmethod
+    def from_file(
+        cls,
+        path: Union[str, Path, None] = None,
+        method: str = COST_METHOD,
+        strict: bool = False
+    ) -> "Ledger":
+        """
+        Build positions from a transaction file in one streaming pass.
+
+        Later record() calls append to the same file.
+
+        Args:
+            path: Transaction CSV (defaults to config.LEDGER_FILE)
+            method: How sells are matched to lots
+            strict: Raise on a malformed or oversold row instead of
+                logging and skipping it
+
+        Returns:
+            Ledger with every transaction applied (empty if the file doesn't exist)
+
+        Raises:
+            ValueError: If the header is wrong, or in strict mode a row is
+        """
+        path = Path(path if path is not None else config.LEDGER_FILE)
+        ledger = cls(method, path)
+        if path.exists():
+            ledger._apply_file(path, strict)
+        return ledger
+
+    def _apply_file(self, path: Path, strict: bool = False) -> None:
+        """
+        Apply every row of a ledger file.
+
+        Same result as apply_all(iter_transactions(path)), but goes
+        straight from CSV fields to the position without building a
+        Transaction per row, which is most of the cost on big ledgers.
+        """
+        positions = self._positions
+        method = self.method
+        parse_time = datetime.fromisoformat
+        with open(path, mode="r", newline="") as file:
+            reader = csv.reader(file)
+            _check_header(path, next(reader, None))
+            for line, row in enumerate(reader, 2):
+                try:
+                    when, ticker, side, quantity, price = row
+                    quantity = int(quantity)
+                    price = float(price)
+                    if quantity <= 0:
+                        raise ValueError(f"Quantity must be positive: {quantity}")
+                    if side not in (BUY, SELL):
+                        raise ValueError(f"Unknown side: {side}")
+                    position = positions.get(ticker)
+                    # A new position is only kept once its first trade applies
+                    new = position is None
+                    if new:
+                        position = Position(ticker, method)
+                    if side == BUY:
+                        position.buy(quantity, price, parse_time(when))
+                    else:
+                        self.realized_pnl += position.sell(quantity, price)
+                    if new:
+                        positions[ticker] = position
+                except ValueError as e:
+                    if strict:
+                        raise ValueError(f"Bad ledger row at {path}:{line}: {e}") from e
+                    logger.warning(f"Skipped bad ledger row at {path}:{line}: {e}")
+                    self.skipped_rows += 1
+                    continue
+                self.transaction_count += 1
+
+    def apply(self, transaction: Transaction) -> float:
+        """
+        Apply one transaction to its position.
+
+        Returns:
+            Realized P&L of the transaction (0.0 for buys)
+
+        Raises:
+            ValueError: If the side is unknown, the quantity isn't positive,
+                or a sell exceeds the position
+        """
+        if transaction.quantity <= 0:
+            raise ValueError(f"Quantity must be positive: {transaction.quantity}")
+        if transaction.side not in (BUY, SELL):
+            raise ValueError(f"Unknown side: {transaction.side}")
+        position = self._positions.get(transaction.ticker)
+        # A new position is only kept once its first trade applies
+        new = position is None
+        if new:
+            position = Position(transaction.ticker, self.method)
+
+        if transaction.side == BUY:
+            position.buy(transaction.quantity, transaction.price, transaction.when)
+            pnl = 0.0
+        else:
+            pnl = position.sell(transaction.quantity, transaction.price)
+            self.realized_pnl += pnl
+        if new:
+            self._positions[transaction.ticker] = position
+        self.transaction_count += 1
+        return pnl
+
+    def apply_all(self, transactions: Iterable[Transaction]) -> int:
+        """
+        Apply transactions in order without keeping them.
+
+        Returns:
+            Number of transactions applied
+        """
+        count = 0
+        for transaction in transactions:
+            self.apply(transaction)
+            count += 1
+        return count
+
+    def record(self, transaction: Transaction) -> float:
+        """
+        Apply a transaction and append it to the ledger file.
+
+        The file is only written if the transaction applies cleanly.
+
+        Returns:
+            Realized P&L of the transaction
+        """
+        pnl = self.apply(transaction)
+        if self._path is not None:
+            append_transaction(self._path, transaction)
+        return pnl
+
+    def buy(self, ticker: str, quantity: int, price: float, when: Optional[datetime] = None) -> float:
+        """Record a purchase."""
+        return self.record(Transaction(ticker, BUY, quantity, price, when or datetime.now()))
+
+    def sell(self, ticker: str, quantity: int, price: float, when: Optional[datetime] = None) -> float:
+        """Record a sale and return its realized P&L."""
+        return self.record(Transaction(ticker, SELL, quantity, price, when or datetime.now()))
+
+    def position(self, ticker: str) -> Optional[Position]:
+        """Get a position, or None if the ticker was never traded."""
+        return self._positions.get(ticker)
+
+    def positions(self, include_closed: bool = False) -> Dict[str, Position]:
+        """Get positions by ticker (open ones only, unless include_closed)."""
+        if include_closed:
+            return dict(self._positions)
+        return {t: p for t, p in self._positions.items() if p.quantity}
+
+    def cost_basis(self) -> float:
+        """Total cost of everything held."""
+        return sum(p.cost_basis for p in self._positions.values())
+
+    def unrealized_pnl(self, prices: Mapping[str, float]) -> float:
+        """
+        Profit or loss on everything held.
+
+        Args:
+            prices: Current price by ticker; positions without one are skipped
+        """
+        return sum(
+            p.unrealized_pnl(prices[t])
+            for t, p in self._positions.items()
+            if p.quantity and t in prices
+        )
+
+    def to_portfolio(self, prices: Optional[Mapping[str, float]] = None) -> Portfolio:
+        """
+        Build a Portfolio of the open positions.
+
+        Args:
+            prices: Current prices; positions without one use their average cost
+        """
+        prices = prices or {}
+        portfolio = Portfolio()
+        now = datetime.now()
+        for ticker, position in self.positions().items():
+            price = prices.get(ticker, position.average_cost)
+            portfolio.add_stock(Stock(ticker, position.quantity, price, now))
+        return portfolio
+
+def append_transaction(path: Union[str, Path], transaction: Transaction) -> None:
+    """Append one transaction to a ledger file, writing the header if it's new."""
+    path = Path(path)
+    new = not path.exists() or os.path.getsize(path) == 0
+    torn = False
+    if not new:
+        # A crash mid-append can leave a partial last line; start a fresh one
+        with open(path, mode="rb") as file:
+            file.seek(-1, os.SEEK_END)
+            torn = file.read(1) not in (b"\n", b"\r")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode="a", newline="") as file:
+        writer = csv.writer(file)
+        if new:
+            writer.writerow(COLUMNS)
+        elif torn:
+            file.write("\r\n")
+        writer.writerow([
+            transaction.when.isoformat(),
+            transaction.ticker,
+            transaction.side,
+            transaction.quantity,
+            transaction.price
+        ])
+
+def _check_header(path: Union[str, Path], header: Optional[list]) -> None:
+    """Raise ValueError unless a ledger file starts with the expected columns."""
+    if header is not None and tuple(name.strip() for name in header) != COLUMNS:
+        raise ValueError(f"Unexpected ledger header in {path}: {header}")
+
+def iter_transactions(path: Union[str, Path]) -> Iterator[Transaction]:
+    """
+    Stream transactions from a ledger file.
+
+    Raises:
+        ValueError: If the header or a row is malformed (with its line number)
+    """
+    with open(path, mode="r", newline="") as file:
+        reader = csv.reader(file)
+        _check_header(path, next(reader, None))
+
+        parse_time = datetime.fromisoformat
+        for line, row in enumerate(reader, 2):
+            try:
+                when, ticker, side, quantity, price = row
+                transaction = Transaction(ticker, side, int(quantity), float(price), parse_time(when))
+            except ValueError as e:
+                raise ValueError(f"Bad ledger row at {path}:{line}: {e}") from e
+            yield transaction
@@ -0,0 +1,285 @@
+"""
+Bulk CSV loader for the stock importer application.
+
+Reads the portfolio CSV in batches of rows and parses each column of a
+batch with one NumPy conversion, instead of building a dict, a datetime
+and a Stock per line. Rows that don't parse are collected into a
+LoadReport rather than logged one by one. iter_chunks streams the file
+so a huge portfolio never has to be in memory all at once.
+"""
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+import csv
+import logging
+import re
+import time
+import numpy as np
+from columnar import ColumnarPortfolio, TIME_DTYPE
+from models import Portfolio, Stock
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("Ticker", "Quantity", "Price", "Last Updated")
+DEFAULT_CHUNK_SIZE = 100_000
+# Errors kept in a report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# Time of day followed by "Z" or an offset such as +02:00
+_UTC_OFFSET = re.compile(r"\d\d:\d\d.*([zZ]|[+-]\d\d(:?\d\d)?)\s*$")
+
+@dataclass
+class LoadError:
+    """
+    A row that couldn't be loaded.
+
+    Attributes:
+        line: Line number in the file (the header is line 1)
+        row: Fields of the row as read (or its ticker, quantity, price and
+            timestamp fields if one of those didn't parse)
+        reason: Why it was rejected
+    """
+    line: int
+    row: List[str]
+    reason: str
+
+@dataclass
+class LoadReport:
+    """
+    Summary of a bulk load.
+
+    Attributes:
+        rows_read: Data lines read from the file
+        rows_loaded: Rows that parsed
+        error_count: Rows that didn't parse
+        errors: Details of the first MAX_REPORTED_ERRORS bad rows
+        elapsed: Wall time in seconds
+    """
+    rows_read: int = 0
+    rows_loaded: int = 0
+    error_count: int = 0
+    errors: List[LoadError] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def add_error(self, error: LoadError) -> None:
+        """Record a bad row."""
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(error)
+
+@dataclass
+class HoldingsChunk:
+    """
+    One batch of parsed rows, column by column.
+
+    Attributes:
+        tickers: Stock symbols
+        quantities: Number of shares (int64)
+        prices: Price per share (float64)
+        last_updated: Update times (datetime64[us])
+    """
+    tickers: List[str]
+    quantities: np.ndarray
+    prices: np.ndarray
+    last_updated: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def to_stocks(self) -> Iterator[Stock]:
+        """Build a Stock for each row."""
+        yield from map(
+            Stock,
+            self.tickers,
+            self.quantities.tolist(),
+            self.prices.tolist(),
+            self.last_updated.tolist()
+        )
+
+def _parse_columns(
+    tickers: List[str],
+    quantities: List[str],
+    prices: List[str],
+    updated: List[str]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert string columns to arrays in one pass each.
+
+    Raises:
+        ValueError: If any value in the batch doesn't parse
+    """
+    quantity_values = np.array(quantities, dtype=np.float64)
+    if not np.all(np.mod(quantity_values, 1) == 0):
+        raise ValueError("quantity is not a whole number")
+    price_values = np.array(prices, dtype=np.float64)
+    # NumPy would shift a UTC offset away with only a warning. The other
+    # loaders keep such times aware, which a naive datetime64 column can't,
+    # so reject them. A date has two "-"; any more, or a "+"/"Z", may be an
+    # offset, and only then is each timestamp matched.
+    text = "".join(updated)
+    if "+" in text or "Z" in text or text.count("-") != 2 * len(updated):
+        if any(_UTC_OFFSET.search(value) for value in updated):
+            raise ValueError("timestamp has a UTC offset")
+    updated_values = np.array(updated, dtype=TIME_DTYPE)
+    if np.isnat(updated_values).any():
+        raise ValueError("missing timestamp")
+    return quantity_values.astype(np.int64), price_values, updated_values
+
+def _split_batch(
+    lines: List[str],
+    width: int,
+    first_line: int,
+    errors: List[LoadError]
+) -> Tuple[List[List[str]], Optional[List[int]]]:
+    """
+    Split raw lines into columns.
+
+    Returns:
+        (columns, line numbers) where line numbers is None if every line
+        became a row
+    """
+    text = "".join(lines)
+    if '"' not in text:
+        # Fast path: one split over the whole batch. Building a list per
+        # row is what makes csv.reader slow on millions of rows.
+        if not text.endswith("\n"):
+            text += "\n"
+        # The total alone isn't enough: a short row next to a long one
+        # would shift fields between them, so every line must be full
+        commas = width - 1
+        if all(line.count(",") == commas for line in lines):
+            flat = text.replace("\r\n", "\n").replace("\n", ",").split(",")
+            return [flat[i:-1:width] for i in range(width)], None
+
+    # Quoted fields, blank lines or rows with the wrong number of fields
+    columns: List[List[str]] = [[] for _ in range(width)]
+    numbers = []
+    for offset, row in enumerate(csv.reader(lines)):
+        if not row:
+            continue
+        if len(row) != width:
+            errors.append(LoadError(first_line + offset, row, "wrong number of fields"))
+            continue
+        for column, value in zip(columns, row):
+            column.append(value)
+        numbers.append(first_line + offset)
+    return columns, numbers
+
+def _parse_batch(
+    lines: List[str],
+    first_line: int,
+    positions: Tuple[int, int, int, int],
+    width: int,
+    report: LoadReport
+) -> Optional[HoldingsChunk]:
+    """Parse a batch of lines, dropping bad rows into the report."""
+    errors: List[LoadError] = []
+    columns, numbers = _split_batch(lines, width, first_line, errors)
+    columns = [columns[p] for p in positions]
+    rows = len(columns[0])
+
+    try:
+        quantities, prices, updated = _parse_columns(*columns)
+        keep = rows
+    except ValueError:
+        # Something in the batch is bad; only now go row by row to find it
+        good = []
+        for i in range(rows):
+            row = [column[i] for column in columns]
+            try:
+                _parse_columns(*[[value] for value in row])
+                good.append(i)
+            except ValueError as e:
+                line = numbers[i] if numbers is not None else first_line + i
+                errors.append(LoadError(line, row, str(e)))
+        columns = [[column[i] for i in good] for column in columns]
+        quantities, prices, updated = _parse_columns(*columns)
+        keep = len(good)
+
+    for error in sorted(errors, key=lambda e: e.line):
+        report.add_error(error)
+    if not keep:
+        return None
+    report.rows_loaded += keep
+    return HoldingsChunk(columns[0], quantities, prices, updated)
+
+def iter_chunks(
+    path: Union[str, Path],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    report: Optional[LoadReport] = None
+) -> Iterator[HoldingsChunk]:
+    """
+    Stream a portfolio CSV as parsed chunks.
+
+    Only one chunk of rows is in memory at a time.
+
+    Args:
+        path: CSV file to read
+        chunk_size: Rows per chunk
+        report: Report to fill in with counts and bad rows
+
+    Yields:
+        HoldingsChunk for each batch with at least one good row
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        ValueError: If the header is missing a column
+    """
+    report = report if report is not None else LoadReport()
+    start = time.perf_counter()
+    with open(path, mode="r", newline="") as file:
+        header = next(csv.reader([file.readline()]), None)
+        if not header:
+            return
+        header = [name.strip() for name in header]
+        missing = [name for name in COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"CSV header is missing columns: {', '.join(missing)}")
+        positions = tuple(header.index(name) for name in COLUMNS)
+
+        line = 2
+        while True:
+            lines = list(islice(file, chunk_size))
+            if not lines:
+                break
+            report.rows_read += len(lines)
+            chunk = _parse_batch(lines, line, positions, len(header), report)
+            line += len(lines)
+            report.elapsed = time.perf_counter() - start
+            if chunk is not None:
+                yield chunk
+    report.elapsed = time.perf_counter() - start
+
+def load_portfolio(
+    path: Union[str, Path],
+    columnar: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Tuple[Portfolio, LoadReport]:
+    """
+    Load a whole portfolio CSV in bulk.
+
+    Args:
+        path: CSV file to read
+        columnar: Load into a ColumnarPortfolio instead of a Portfolio
+        chunk_size: Rows parsed per batch
+
+    Returns:
+        (portfolio, report)
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        ValueError: If the header is missing a column
+    """
+    report = LoadReport()
+    portfolio = ColumnarPortfolio() if columnar else Portfolio()
+    for chunk in iter_chunks(path, chunk_size, report):
+        if columnar:
+            portfolio.add_many(chunk.tickers, chunk.quantities, chunk.prices, chunk.last_updated)
+        else:
+            for stock in chunk.to_stocks():
+                portfolio.add_stock(stock)
+
+    if report.error_count:
+        logger.warning(f"Skipped {report.error_count} bad rows in {path}")
+    return portfolio, report
@@ -2,11 +2,19 @@
 Main.py, (Start here)
 
 Just starts the app.
+
+Heavy modules (customtkinter, NumPy, yfinance) are imported inside the
+functions that need them so the login window shows as soon as possible.
+Run with --import-profile to see what startup imports cost, and with
+--instrument, --trace-memory or --profile FILE to measure a session.
 """
+import argparse
 import logging
-import tracemalloc
-from gui import LoginWindow
-import customtkinter as ctk
+import sys
+import time
+from typing import List, Optional, Tuple
+
+_START = time.perf_counter()
 
 def setup_logging() -> None:
     """Configure logging for the application."""
@@ -15,10 +23,89 @@ def setup_logging() -> None:
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
-def main() -> None:
+def profile_imports(module: str = "gui", top: int = 20) -> List[Tuple[str, int, int]]:
+    """
+    Measure what importing a module costs, per imported module.
+
+    Runs a fresh interpreter with `-X importtime` so nothing is cached.
+
+    Args:
+        module: Module to import
+        top: Number of slowest modules to print
+
+    Returns:
+        (name, self microseconds, cumulative microseconds) for every
+        imported module, slowest cumulative first
+    """
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        # The error is the last line that isn't an import timing
+        errors = [
+            line for line in result.stderr.splitlines()
+            if line.strip() and not line.startswith("import time:")
+        ]
+        reason = errors[-1] if errors else "no error output"
+        print(f"import {module} failed with exit code {result.returncode}: {reason}", file=sys.stderr)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    rows.sort(key=lambda row: row[2], reverse=True)
+
+    total = sum(row[1] for row in rows)
+    print(f"import {module}: {total / 1000:.1f} ms across {len(rows)} modules")
+    print(f"{'module':<40} {'self ms':>10} {'total ms':>10}")
+    for name, self_us, cumulative_us in rows[:top]:
+        print(f"{name:<40} {self_us / 1000:>10.1f} {cumulative_us / 1000:>10.1f}")
+    return rows
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Stock portfolio manager")
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="print per-module import cost of starting the GUI and exit"
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="record timing spans and counters and log them on exit"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="trace allocations with tracemalloc (slow) and log the top users on exit"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write a cProfile of the session to FILE"
+    )
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
     """Initialize and run the application."""
-    # Enable tracemalloc for debugging (make sure this works properly)
-    tracemalloc.start()
+    args = parse_args(argv)
+    if args.import_profile:
+        profile_imports()
+        return
+
+    # Imported here rather than at the top so --import-profile stays light
+    import customtkinter as ctk
+    import instrumentation
+    from gui import LoginWindow
+    from providers import create_provider
+    from config import PRICE_PROVIDER, PROFILE_FILE, TRACE_MEMORY, ensure_data_dir
 
     # Suppress CustomTkinter warnings (Just annoying and fills the console)
     import warnings
@@ -27,29 +114,42 @@ def main() -> None:
     setup_logging()
     logger = logging.getLogger(__name__)
 
+    if args.instrument:
+        instrumentation.enable()
+    if args.trace_memory or TRACE_MEMORY:
+        instrumentation.start_memory_tracing()
+    baseline = instrumentation.memory_snapshot()
+    profile_file = args.profile or PROFILE_FILE
+
     try:
+        ensure_data_dir()
+
         # Set the default theme
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
 
         # Create and run login window
-        app = LoginWindow()
-        app.run()
+        app = LoginWindow(provider=create_provider(PRICE_PROVIDER))
+        logger.info(f"Login window ready after {(time.perf_counter() - _START) * 1000:.0f} ms")
+        if profile_file:
+            with instrumentation.profile(profile_file):
+                app.run()
+        else:
+            app.run()
 
     except Exception as e:
         logger.error(f"Application error: {e}")
-        # Get tracemalloc info
-        current, peak = tracemalloc.get_traced_memory()
-        logger.error(f"Current memory usage: {current / 10**6}MB")
-        logger.error(f"Peak memory usage: {peak / 10**6}MB")
-        snapshot = tracemalloc.take_snapshot()
-        top_stats = snapshot.statistics('lineno')
-        logger.error("[ Top 3 memory users ]")
-        for stat in top_stats[:3]:
-            logger.error(stat)
+        for line in instrumentation.memory_top():
+            logger.error(line)
         raise
     finally:
-        tracemalloc.stop()
+        if instrumentation.enabled():
+            logger.info("Instrumentation:\n" + instrumentation.format_report())
+        if baseline is not None:
+            logger.info("Memory growth since startup:")
+            for line in instrumentation.memory_diff(baseline):
+                logger.info(line)
+            instrumentation.stop_memory_tracing()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,173 @@
+"""
+Ticker metadata cache for the stock importer application.
+
+Remembers what each ticker is (exchange, currency, quote type), whether
+it could be priced last time, and which yfinance lookup worked for it.
+Known-bad tickers are skipped without a request until their entry
+expires, and tickers that only price through the slow info call go
+straight to it.
+
+Stored in SQLite under the data directory, so like QuoteStore it
+survives restarts and is shared by every process.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Union
+import logging
+import threading
+import time
+import config
+import db
+from config import TICKER_INVALID_TTL, TICKER_METADATA_TTL
+
+logger = logging.getLogger(__name__)
+
+# Lookup that last priced a ticker
+FAST_INFO = "fast_info"
+INFO = "info"
+
+@dataclass
+class TickerMetadata:
+    """
+    What is known about one ticker.
+
+    Attributes:
+        ticker: Stock symbol
+        valid: False if the last full lookup found no price
+        exchange: Exchange code, if known
+        currency: Quote currency, if known
+        quote_type: e.g. "EQUITY" or "ETF", if known
+        price_source: FAST_INFO or INFO, whichever lookup last found a price
+        checked_at: Wall-clock time of the last lookup
+    """
+    ticker: str
+    valid: bool
+    exchange: Optional[str] = None
+    currency: Optional[str] = None
+    quote_type: Optional[str] = None
+    price_source: Optional[str] = None
+    checked_at: float = 0.0
+
+class MetadataStore:
+    """SQLite table of TickerMetadata keyed on ticker."""
+
+    _COLUMNS = "ticker, valid, exchange, currency, quote_type, price_source, checked_at"
+    _UPSERT = (
+        f"INSERT INTO tickers ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(ticker) DO UPDATE SET valid = excluded.valid, "
+        "exchange = COALESCE(excluded.exchange, tickers.exchange), "
+        "currency = COALESCE(excluded.currency, tickers.currency), "
+        "quote_type = COALESCE(excluded.quote_type, tickers.quote_type), "
+        "price_source = COALESCE(excluded.price_source, tickers.price_source), "
+        "checked_at = excluded.checked_at"
+    )
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        invalid_ttl: float = TICKER_INVALID_TTL,
+        metadata_ttl: float = TICKER_METADATA_TTL,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        """
+        Open (and create if needed) the metadata database.
+
+        Args:
+            path: SQLite file (defaults to config.METADATA_FILE)
+            invalid_ttl: Seconds a ticker stays known-bad before it's tried again
+            metadata_ttl: Seconds a remembered lookup path is trusted
+            clock: Wall-clock time source
+        """
+        self._path = Path(path if path is not None else config.METADATA_FILE)
+        self._invalid_ttl = invalid_ttl
+        self._metadata_ttl = metadata_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = db.connect(self._path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickers ("
+                "ticker TEXT PRIMARY KEY, "
+                "valid INTEGER NOT NULL, "
+                "exchange TEXT, "
+                "currency TEXT, "
+                "quote_type TEXT, "
+                "price_source TEXT, "
+                "checked_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def get_many(self, tickers: Iterable[str]) -> Dict[str, TickerMetadata]:
+        """Get the metadata of the tickers that have any."""
+        tickers = list(tickers)
+        found = {}
+        with self._lock:
+            rows = db.select_in(
+                self._conn, f"SELECT {self._COLUMNS} FROM tickers WHERE ticker IN ({{}})", tickers
+            )
+            for row in rows:
+                found[row[0]] = TickerMetadata(row[0], bool(row[1]), *row[2:])
+        return found
+
+    def get(self, ticker: str) -> Optional[TickerMetadata]:
+        """Get one ticker's metadata, or None."""
+        return self.get_many([ticker]).get(ticker)
+
+    def put(self, metadata: TickerMetadata) -> None:
+        """
+        Save a lookup's outcome.
+
+        Fields left as None keep what was stored before. checked_at is
+        set to now if it's 0.
+        """
+        if not metadata.checked_at:
+            metadata.checked_at = self.clock()
+        with self._lock, self._conn:
+            self._conn.execute(self._UPSERT, (
+                metadata.ticker, int(metadata.valid), metadata.exchange, metadata.currency,
+                metadata.quote_type, metadata.price_source, metadata.checked_at
+            ))
+
+    def mark_valid(self, tickers: Iterable[str]) -> None:
+        """Record that tickers were priced, keeping their other metadata."""
+        now = self.clock()
+        rows = [(ticker, 1, None, None, None, None, now) for ticker in tickers]
+        if rows:
+            with self._lock, self._conn:
+                self._conn.executemany(self._UPSERT, rows)
+
+    def mark_invalid(self, ticker: str) -> None:
+        """Record that a ticker had no price by any lookup."""
+        self.put(TickerMetadata(ticker, valid=False))
+
+    def is_known_invalid(self, metadata: Optional[TickerMetadata]) -> bool:
+        """True if the ticker failed recently enough to skip it."""
+        return (
+            metadata is not None
+            and not metadata.valid
+            and self.clock() - metadata.checked_at < self._invalid_ttl
+        )
+
+    def price_source(self, metadata: Optional[TickerMetadata]) -> Optional[str]:
+        """Lookup to try first for a ticker, or None if there's no recent answer."""
+        if (
+            metadata is None
+            or not metadata.valid
+            or self.clock() - metadata.checked_at >= self._metadata_ttl
+        ):
+            return None
+        return metadata.price_source
+
+    def forget(self, ticker: str) -> None:
+        """Drop what is known about a ticker, so the next lookup starts fresh."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tickers WHERE ticker = ?", (ticker,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tickers").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
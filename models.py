@@ -2,15 +2,40 @@
 Data models for the stock importer application.
 
 This module contains the data structures used to represent stocks and portfolios.
+
+Portfolio keeps its total value as a running sum that every add, remove
+and price change adjusts, and tells subscribers what changed. Changes
+made inside Portfolio.batch() (every refresh is one) reach subscribers
+as a single PortfolioChanges with one entry per ticker.
 """
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import logging
-import yfinance as yf
+import math
+import threading
+import instrumentation
+from config import REFRESH_CHUNK_SIZE, REFRESH_MAX_WORKERS, REFRESH_TIMEOUT
+from providers import PriceProvider, create_provider
+from refresh import BatchRefresher, RefreshReport, RefreshResult
 
 logger = logging.getLogger(__name__)
 
+# Kinds of HoldingChange
+ADDED = "added"
+REMOVED = "removed"
+QUANTITY_CHANGED = "quantity_changed"
+PRICE_CHANGED = "price_changed"
+UPDATED = "updated"  # Refreshed, but only the update time changed
+
+# The running total is re-summed after this many updates, or one per
+# holding if there are more, so rounding errors can't build up
+TOTAL_RESYNC_MIN = 4096
+
+# (quantity, price, last updated) of a holding at one moment, or None if it isn't held
+HoldingState = Optional[Tuple[int, float, datetime]]
+
 @dataclass
 class Stock:
     """
@@ -32,13 +57,208 @@ class Stock:
         """Calculate total value of the holding."""
         return self.price * self.quantity
 
+@dataclass
+class HoldingChange:
+    """
+    How one holding changed.
+
+    Old values are None for an added holding, new values are None for a
+    removed one. A quantity change can come with a new price too.
+
+    Attributes:
+        kind: ADDED, REMOVED, QUANTITY_CHANGED, PRICE_CHANGED or UPDATED
+        ticker: Stock symbol
+        old_quantity: Shares before the change
+        old_price: Price before the change
+        new_quantity: Shares after the change
+        new_price: Price after the change
+        old_updated: Update time before the change
+        new_updated: Update time after the change
+    """
+    __slots__ = (
+        "kind", "ticker", "old_quantity", "old_price", "new_quantity", "new_price",
+        "old_updated", "new_updated"
+    )
+    kind: str
+    ticker: str
+    old_quantity: Optional[int]
+    old_price: Optional[float]
+    new_quantity: Optional[int]
+    new_price: Optional[float]
+    old_updated: Optional[datetime]
+    new_updated: Optional[datetime]
+
+    @property
+    def old_value(self) -> float:
+        """Value of the holding before the change (0.0 if it was added)."""
+        return self.old_quantity * self.old_price if self.old_quantity is not None else 0.0
+
+    @property
+    def new_value(self) -> float:
+        """Value of the holding after the change (0.0 if it was removed)."""
+        return self.new_quantity * self.new_price if self.new_quantity is not None else 0.0
+
+@dataclass
+class PortfolioChanges:
+    """
+    One notification to portfolio subscribers.
+
+    Attributes:
+        changes: Net change per ticker, in the order tickers were first touched
+        total_value: Portfolio total after the changes
+    """
+    changes: Dict[str, HoldingChange]
+    total_value: float
+
+    @property
+    def structural(self) -> bool:
+        """True if a holding was added or removed, so row order changed."""
+        return any(c.kind in (ADDED, REMOVED) for c in self.changes.values())
+
+    def tickers(self, kind: Optional[str] = None) -> List[str]:
+        """Tickers that changed, optionally only those of one kind."""
+        if kind is None:
+            return list(self.changes)
+        return [t for t, c in self.changes.items() if c.kind == kind]
+
+def _net_change(ticker: str, old: HoldingState, new: HoldingState) -> Optional[HoldingChange]:
+    """Describe the change from one state to another, or None if there's none."""
+    if old is None and new is None:
+        return None
+    if old is None:
+        kind = ADDED
+    elif new is None:
+        kind = REMOVED
+    elif old[0] != new[0]:
+        kind = QUANTITY_CHANGED
+    elif old[1] != new[1]:
+        kind = PRICE_CHANGED
+    elif old[2] != new[2]:
+        kind = UPDATED
+    else:
+        return None
+    old_quantity, old_price, old_updated = old if old is not None else (None, None, None)
+    new_quantity, new_price, new_updated = new if new is not None else (None, None, None)
+    return HoldingChange(
+        kind, ticker, old_quantity, old_price, new_quantity, new_price, old_updated, new_updated
+    )
+
+def _state(stock: Stock) -> HoldingState:
+    """Snapshot of a holding for change tracking."""
+    return (stock.quantity, stock.price, stock.last_updated)
+
 class Portfolio:
     """
     Manages a collection of stock holdings.
+
+    Change holdings through the portfolio (add_stock, remove_stock,
+    set_prices, apply_prices) rather than by editing a Stock it returned,
+    or the running total and subscribers won't see the change. Like the
+    holdings themselves, subscriptions belong to the thread that owns the
+    portfolio.
     """
-    def __init__(self) -> None:
-        #Initialize an empty portfolio.
+    def __init__(self, provider: Optional[PriceProvider] = None) -> None:
+        """
+        Initialize an empty portfolio.
+
+        Args:
+            provider: Source of prices for update_prices (defaults to yfinance
+                through a QuoteClient, behind the memory and on-disk quote caches)
+        """
         self._holdings: Dict[str, Stock] = {}
+        self._provider = provider
+        # HistoryStore that apply_prices records every quote into, if set
+        self.history = None
+        self._total_value = 0.0
+        self._updates_since_sum = 0
+        self._subscribers: List[Callable[[PortfolioChanges], None]] = []
+        self._batch_depth = 0
+        # Ticker -> [state before the batch, latest state]
+        self._pending: Dict[str, List[HoldingState]] = {}
+
+    @property
+    def provider(self) -> PriceProvider:
+        """Price provider used by update_prices."""
+        if self._provider is None:
+            self._provider = create_provider("yfinance")
+        return self._provider
+
+    @provider.setter
+    def provider(self, provider: PriceProvider) -> None:
+        self._provider = provider
+
+    def subscribe(self, callback: Callable[[PortfolioChanges], None]) -> None:
+        """
+        Get told about every change to the holdings.
+
+        Args:
+            callback: Called with a PortfolioChanges after each change, or
+                once at the end of a batch
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[PortfolioChanges], None]) -> None:
+        """Stop telling a subscriber about changes."""
+        self._subscribers.remove(callback)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Hold back notifications until the block ends.
+
+        Subscribers then get one PortfolioChanges with the net change per
+        ticker. Batches can be nested; the outermost one notifies.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._publish()
+
+    def _changed(self, ticker: str, old: HoldingState, new: HoldingState) -> None:
+        """Note a change to one holding for the subscribers."""
+        if not self._subscribers:
+            return
+        pending = self._pending.get(ticker)
+        if pending is None:
+            self._pending[ticker] = [old, new]
+        else:
+            pending[1] = new
+        if not self._batch_depth:
+            self._publish()
+
+    def _publish(self) -> None:
+        """Send the pending changes to the subscribers."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        changes = {}
+        for ticker, (old, new) in pending.items():
+            change = _net_change(ticker, old, new)
+            if change is not None:
+                changes[ticker] = change
+        if not changes:
+            return
+        event = PortfolioChanges(changes, self._total_value)
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Portfolio subscriber {callback!r} failed: {e}")
+
+    def _adjust_total(self, delta: float, updates: int = 1) -> None:
+        """Add to the running total, re-summing it now and then."""
+        self._total_value += delta
+        self._updates_since_sum += updates
+        if self._updates_since_sum > max(TOTAL_RESYNC_MIN, len(self)):
+            self._total_value = self._sum_values()
+            self._updates_since_sum = 0
+
+    def _sum_values(self) -> float:
+        """Add up every holding's value from scratch."""
+        return math.fsum(stock.price * stock.quantity for stock in self._holdings.values())
 
     def add_stock(self, stock: Stock) -> None:
         """
@@ -47,14 +267,20 @@ class Portfolio:
         Args:
             stock: Stock instance to add
         """
-        if stock.ticker in self._holdings:
+        existing_stock = self._holdings.get(stock.ticker)
+        if existing_stock is not None:
             # Update quantity if stock already exists
-            existing_stock = self._holdings[stock.ticker]
+            old = (existing_stock.quantity, existing_stock.price, existing_stock.last_updated)
+            old_value = existing_stock.total_value
             existing_stock.quantity += stock.quantity
             existing_stock.price = stock.price
             existing_stock.last_updated = stock.last_updated
+            self._adjust_total(existing_stock.total_value - old_value)
+            self._changed(stock.ticker, old, _state(existing_stock))
         else:
             self._holdings[stock.ticker] = stock
+            self._adjust_total(stock.total_value)
+            self._changed(stock.ticker, None, _state(stock))
 
     def remove_stock(self, ticker: str) -> None:
         """
@@ -68,37 +294,222 @@ class Portfolio:
         """
         if ticker not in self._holdings:
             raise KeyError(f"Stock {ticker} not found in portfolio")
-        del self._holdings[ticker]
+        stock = self._holdings.pop(ticker)
+        if self._holdings:
+            self._adjust_total(-stock.total_value)
+        else:
+            self._total_value = 0.0
+        self._changed(ticker, _state(stock), None)
 
-    def update_prices(self) -> None:
-        #Update prices for all stocks in portfolio.
-        for ticker in list(self._holdings.keys()):
-            try:
-                stock = yf.Ticker(ticker)
-                info = stock.fast_info
-
-                if hasattr(info, 'last_price') and info.last_price:
-                    self._holdings[ticker].price = float(info.last_price)
-                else:
-                    # Fallback to regular info
-                    info = stock.info
-                    price = info.get('regularMarketPrice')
-                    if price:
-                        self._holdings[ticker].price = float(price)
+    @instrumentation.timed("portfolio.update_prices")
+    def update_prices(
+        self,
+        provider: Optional[PriceProvider] = None,
+        chunk_size: int = REFRESH_CHUNK_SIZE,
+        max_workers: int = REFRESH_MAX_WORKERS,
+        timeout: float = REFRESH_TIMEOUT,
+        progress: Optional[Callable[[RefreshResult], None]] = None,
+        cancel: Optional[threading.Event] = None,
+        tickers: Optional[List[str]] = None
+    ) -> RefreshReport:
+        """
+        Update prices for all stocks in portfolio, or just some of them.
+
+        Args:
+            provider: Price provider for this refresh (defaults to the portfolio's)
+            chunk_size: Number of tickers per bulk request
+            max_workers: Size of the fallback worker pool
+            timeout: Seconds allowed per single-ticker fetch
+            progress: Called with each ticker's result as it arrives
+            cancel: Event that stops the refresh when set
+            tickers: Holdings to update (defaults to every holding)
+
+        Returns:
+            RefreshReport with the outcome for every ticker updated
+        """
+        report = self.fetch_prices(
+            tickers,
+            provider=provider,
+            chunk_size=chunk_size,
+            max_workers=max_workers,
+            timeout=timeout,
+            progress=progress,
+            cancel=cancel
+        )
+        self.apply_prices(report)
+        return report
+
+    @instrumentation.timed("portfolio.fetch_prices")
+    def fetch_prices(
+        self,
+        tickers: Optional[List[str]] = None,
+        provider: Optional[PriceProvider] = None,
+        chunk_size: int = REFRESH_CHUNK_SIZE,
+        max_workers: int = REFRESH_MAX_WORKERS,
+        timeout: float = REFRESH_TIMEOUT,
+        progress: Optional[Callable[[RefreshResult], None]] = None,
+        cancel: Optional[threading.Event] = None
+    ) -> RefreshReport:
+        """
+        Fetch new prices without changing any holdings.
+
+        This doesn't touch the portfolio, so it can run on a background
+        thread as long as `tickers` is passed in. Hand the report to
+        apply_prices on the thread that owns the portfolio.
+
+        Args:
+            tickers: Stock symbols to fetch (defaults to every holding)
+            provider: Price provider for this refresh (defaults to the portfolio's)
+            chunk_size: Number of tickers per bulk request
+            max_workers: Size of the fallback worker pool
+            timeout: Seconds allowed per single-ticker fetch
+            progress: Called with each ticker's result as it arrives
+            cancel: Event that stops the refresh when set
+
+        Returns:
+            RefreshReport with the outcome for every ticker
+        """
+        if tickers is None:
+            tickers = self.get_tickers()
+        provider = provider or self.provider
+        refresher = BatchRefresher(
+            provider.get_prices,
+            provider.get_price,
+            chunk_size=chunk_size,
+            max_workers=max_workers,
+            timeout=timeout
+        )
+        report = refresher.refresh(tickers, progress=progress, cancel=cancel)
+        # Stale quotes served from a cache keep the time they were fetched
+        for ticker, fetched_at in provider.quote_times(report.succeeded).items():
+            report.results[ticker].quoted_at = datetime.fromtimestamp(fetched_at)
+        return report
+
+    def set_prices(
+        self,
+        tickers: Sequence[str],
+        prices: Iterable[float],
+        when: Optional[datetime] = None
+    ) -> int:
+        """
+        Update many prices as one batch.
+
+        Tickers that aren't held are ignored.
+
+        Args:
+            tickers: Stock symbols
+            prices: New price for each ticker
+            when: Time of the update (defaults to now)
+
+        Returns:
+            Number of holdings updated
+        """
+        when = when or datetime.now()
+        holdings = self._holdings
+        # Same as calling _changed per ticker, inlined as it's per holding
+        pending = self._pending if self._subscribers else None
+        delta = 0.0
+        count = 0
+        with self.batch():
+            for ticker, price in zip(tickers, prices):
+                stock = holdings.get(ticker)
+                if stock is None:
+                    continue
+                old_price = stock.price
+                old_updated = stock.last_updated
+                stock.price = price
+                stock.last_updated = when
+                count += 1
+                delta += (price - old_price) * stock.quantity
+                if pending is not None:
+                    entry = pending.get(ticker)
+                    new = (stock.quantity, price, when)
+                    if entry is None:
+                        pending[ticker] = [(stock.quantity, old_price, old_updated), new]
                     else:
-                        logger.error(f"Could not update price for {ticker}")
-                        continue
+                        entry[1] = new
+            self._adjust_total(delta, count)
+        return count
+
+    @instrumentation.timed("portfolio.apply_prices")
+    def apply_prices(self, report: RefreshReport) -> None:
+        """
+        Apply the successful prices from a refresh report.
 
-                self._holdings[ticker].last_updated = datetime.now()
+        Subscribers get one notification for the whole report. Holdings
+        priced from an older cached quote are stamped with its fetch time,
+        and only quotes fetched for this refresh go into the history.
 
-            except Exception as e:
-                logger.error(f"Error updating price for {ticker}: {e}")
+        Args:
+            report: Report from fetch_prices
+        """
+        tickers = []
+        prices = []
+        older: Dict[datetime, Tuple[List[str], List[float]]] = {}
+        for ticker, result in report.results.items():
+            if not self._has(ticker):
+                # Removed while the refresh was running; don't price or record it
                 continue
+            if result.ok and result.quoted_at is not None:
+                stale_tickers, stale_prices = older.setdefault(result.quoted_at, ([], []))
+                stale_tickers.append(ticker)
+                stale_prices.append(result.price)
+            elif result.ok:
+                tickers.append(ticker)
+                prices.append(result.price)
+            elif result.error != "cancelled":
+                logger.error(f"Could not update price for {ticker}: {result.error}")
+        now = datetime.now()
+        with self.batch():
+            self.set_prices(tickers, prices, now)
+            for when, (stale_tickers, stale_prices) in older.items():
+                self.set_prices(stale_tickers, stale_prices, when)
+        if self.history is not None and tickers:
+            self.history.record_many(tickers, prices, now)
+
+    def _has(self, ticker: str) -> bool:
+        """Check a ticker is held, without building a Stock."""
+        return ticker in self._holdings
+
+    def get_stock(self, ticker: str) -> Optional[Stock]:
+        """
+        Get one holding.
+
+        Args:
+            ticker: Stock symbol
+
+        Returns:
+            Stock, or None if the ticker isn't held
+        """
+        return self._holdings.get(ticker)
+
+    def get_tickers(self) -> List[str]:
+        """Get the symbols of all holdings."""
+        return list(self._holdings.keys())
+
+    def get_states(self) -> Dict[str, HoldingState]:
+        """Get (quantity, price, last updated) for every holding, without copying Stocks."""
+        return {ticker: _state(stock) for ticker, stock in self._holdings.items()}
 
     def get_holdings(self) -> Dict[str, Stock]:
         #Get all holdings in the portfolio.
         return self._holdings.copy()
 
+    def get_holding_value(self, ticker: str) -> float:
+        """
+        Get the value of one holding.
+
+        Raises:
+            KeyError: If ticker not in portfolio
+        """
+        stock = self.get_stock(ticker)
+        if stock is None:
+            raise KeyError(f"Stock {ticker} not found in portfolio")
+        return stock.total_value
+
     def get_total_value(self) -> float:
-        #Calculate total value of portfolio
-        return sum(stock.total_value for stock in self._holdings.values())
\ No newline at end of file
+        """Get the total value of the portfolio from the running sum."""
+        return self._total_value
+
+    def __len__(self) -> int:
+        return len(self._holdings)
\ No newline at end of file
@@ -0,0 +1,415 @@
+"""
+Price providers for the stock importer application.
+
+Everything that needs a quote goes through a PriceProvider, so the
+yfinance source can be swapped for the offline fake when benchmarking
+or testing without network access.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+import email.utils
+import json
+import logging
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from config import QUOTE_SERVER_URL, REFRESH_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class RateLimitedError(Exception):
+    """Raised when a quote source asks us to slow down."""
+
+    def __init__(self, message: str, retry_after: float = 0.0) -> None:
+        """
+        Args:
+            message: Error message
+            retry_after: Seconds the source asked us to wait (0 if it didn't say)
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _retry_after(value: Optional[str]) -> float:
+    """
+    Seconds to wait from a Retry-After header.
+
+    Accepts both forms the header can take: a number of seconds or an
+    HTTP date.
+
+    Args:
+        value: Header value, or None if it wasn't sent
+
+    Returns:
+        Seconds to wait, or 0 (use the default backoff) if the value is
+        missing or can't be parsed
+    """
+    if not value:
+        return 0.0
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            logger.debug(f"Ignoring unparseable Retry-After: {value!r}")
+            return 0.0
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, seconds) if math.isfinite(seconds) else 0.0
+
+class PriceProvider(ABC):
+    """Interface for anything that can look up stock prices."""
+
+    @abstractmethod
+    def get_price(self, ticker: str) -> float:
+        """
+        Get the current price of one ticker.
+
+        Args:
+            ticker: Stock symbol
+
+        Returns:
+            Current price per share
+
+        Raises:
+            ValueError: If no price is available for the ticker
+        """
+
+    @abstractmethod
+    def get_prices(self, tickers: List[str]) -> Dict[str, float]:
+        """
+        Get current prices for several tickers in one request.
+
+        Args:
+            tickers: Stock symbols
+
+        Returns:
+            Prices for the tickers that could be priced. Missing tickers
+            are left out rather than raising.
+        """
+
+    def quote_times(self, tickers: Iterable[str]) -> Dict[str, float]:
+        """
+        Get when the quotes last returned for some tickers were fetched, for
+        those that weren't fetched just now (e.g. served stale from a cache).
+
+        Args:
+            tickers: Stock symbols
+
+        Returns:
+            Ticker -> fetch time (seconds since the epoch); tickers whose
+            last quote was current are left out
+        """
+        return {}
+
+    def close(self) -> None:
+        """Release anything the provider holds open."""
+
+class YFinanceProvider(PriceProvider):
+    """
+    Prices from Yahoo Finance through yfinance.
+
+    With a MetadataStore, tickers that recently had no price are skipped
+    without a request, and tickers that only price through the slow info
+    call go straight to it.
+    """
+
+    def __init__(self, metadata=None) -> None:
+        """
+        Initialize the provider.
+
+        Args:
+            metadata: metadata.MetadataStore to consult and update (None to
+                look every ticker up from scratch). The provider closes it.
+        """
+        self._metadata = metadata
+
+    def close(self) -> None:
+        """Close the metadata store."""
+        if self._metadata is not None:
+            self._metadata.close()
+
+    def _fast_info(self, ticker: str, details: bool) -> Tuple[Optional[float], Dict[str, Any]]:
+        """
+        Look a ticker up through fast_info.
+
+        Args:
+            ticker: Stock symbol
+            details: Also read exchange, currency and quote type
+
+        Returns:
+            (price or None, metadata fields found)
+        """
+        import yfinance as yf
+
+        info = yf.Ticker(ticker).fast_info
+        try:
+            if not (hasattr(info, 'last_price') and info.last_price):
+                return None, {}
+        except (KeyError, ValueError, TypeError):
+            # Unknown tickers come back with parts of the answer missing
+            return None, {}
+        found = {}
+        if details:
+            for field in ("exchange", "currency", "quote_type"):
+                try:
+                    found[field] = getattr(info, field)
+                except Exception:
+                    pass
+        return float(info.last_price), found
+
+    def _full_info(self, ticker: str) -> Tuple[Optional[float], Dict[str, Any]]:
+        """
+        Look a ticker up through the slow info call.
+
+        Returns:
+            (price or None, metadata fields found)
+        """
+        import yfinance as yf
+
+        try:
+            info = yf.Ticker(ticker).info or {}
+        except (KeyError, ValueError, TypeError):
+            return None, {}
+        price = info.get('regularMarketPrice')
+        found = {
+            "exchange": info.get("exchange"),
+            "currency": info.get("currency"),
+            "quote_type": info.get("quoteType")
+        }
+        return (float(price) if price else None), found
+
+    def get_price(self, ticker: str) -> float:
+        """Get one price, falling back to the slow info call."""
+        store = self._metadata
+        if store is None:
+            price, _ = self._fast_info(ticker, details=False)
+            if price is None:
+                # Fallback to regular info
+                price, _ = self._full_info(ticker)
+            if price is None:
+                raise ValueError(f"Could not get price for {ticker}")
+            return price
+
+        from metadata import FAST_INFO, INFO, TickerMetadata
+        known = store.get(ticker)
+        if store.is_known_invalid(known):
+            raise ValueError(f"Could not get price for {ticker} (known invalid, not retried yet)")
+
+        price = None
+        source = FAST_INFO
+        found: Dict[str, Any] = {}
+        if store.price_source(known) != INFO:
+            # Only ask for details the first time
+            price, found = self._fast_info(ticker, details=known is None or known.currency is None)
+        if price is None:
+            source = INFO
+            price, found = self._full_info(ticker)
+        if price is None:
+            # Both lookups answered without a price; don't ask again for a while
+            store.mark_invalid(ticker)
+            raise ValueError(f"Could not get price for {ticker}")
+        store.put(TickerMetadata(ticker, valid=True, price_source=source, **found))
+        return price
+
+    def get_prices(self, tickers: List[str]) -> Dict[str, float]:
+        """Get the latest close for a chunk of tickers in one download."""
+        store = self._metadata
+        if store is None:
+            return self._download(tickers)
+
+        known = store.get_many(tickers)
+        wanted = [t for t in tickers if not store.is_known_invalid(known.get(t))]
+        if len(wanted) < len(tickers):
+            logger.debug(f"Skipping {len(tickers) - len(wanted)} known invalid tickers")
+        if not wanted:
+            return {}
+
+        prices = self._download(wanted)
+        # Misses aren't marked invalid here; the single lookup decides
+        store.mark_valid(t for t in prices if t not in known or not known[t].valid)
+        return prices
+
+    def _download(self, tickers: List[str]) -> Dict[str, float]:
+        """Latest close for each ticker from one yf.download."""
+        import yfinance as yf
+
+        data = yf.download(tickers, period="5d", progress=False, threads=False)
+        if data is None or data.empty:
+            return {}
+
+        closes = data["Close"]
+        if not hasattr(closes, "columns"):
+            # A single ticker can come back as a plain Series
+            closes = closes.to_frame(name=tickers[0])
+
+        prices = {}
+        for ticker in closes.columns:
+            column = closes[ticker].dropna()
+            if not column.empty:
+                prices[str(ticker)] = float(column.iloc[-1])
+        return prices
+
+class FakePriceProvider(PriceProvider):
+    """
+    Deterministic in-process provider for tests and benchmarks.
+
+    Prices and failures depend only on the ticker and seed, so repeated
+    runs see exactly the same data no matter how calls are ordered.
+    """
+
+    def __init__(
+        self,
+        prices: Optional[Dict[str, float]] = None,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0
+    ) -> None:
+        """
+        Initialize the fake provider.
+
+        Args:
+            prices: Fixed prices to serve. If given, other tickers are unknown.
+            latency: Seconds to sleep per request (single or bulk)
+            failure_rate: Fraction of tickers, between 0 and 1, that always fail
+            seed: Changes which tickers fail and the generated prices
+        """
+        if not 0.0 <= failure_rate <= 1.0:
+            raise ValueError("failure_rate must be between 0 and 1")
+        self._prices = dict(prices) if prices is not None else None
+        self._latency = latency
+        self._failure_rate = failure_rate
+        self._seed = seed
+        self._lock = threading.Lock()
+        self.single_calls = 0
+        self.bulk_calls = 0
+
+    def _hash(self, ticker: str) -> float:
+        """Map a ticker to a stable number in [0, 1)."""
+        return zlib.crc32(f"{self._seed}:{ticker}".encode()) / 2**32
+
+    def _lookup(self, ticker: str) -> Optional[float]:
+        """Price for one ticker, or None if it should fail."""
+        if self._hash(ticker + "#fail") < self._failure_rate:
+            return None
+        if self._prices is not None:
+            return self._prices.get(ticker)
+        return round(1.0 + self._hash(ticker) * 999.0, 2)
+
+    def get_price(self, ticker: str) -> float:
+        """Get one fake price."""
+        with self._lock:
+            self.single_calls += 1
+        if self._latency:
+            time.sleep(self._latency)
+
+        price = self._lookup(ticker)
+        if price is None:
+            raise ValueError(f"Could not get price for {ticker}")
+        return price
+
+    def get_prices(self, tickers: Iterable[str]) -> Dict[str, float]:
+        """Get fake prices for a chunk of tickers."""
+        with self._lock:
+            self.bulk_calls += 1
+        if self._latency:
+            time.sleep(self._latency)
+
+        prices = {}
+        for ticker in tickers:
+            price = self._lookup(ticker)
+            if price is not None:
+                prices[ticker] = price
+        return prices
+
+class HttpPriceProvider(PriceProvider):
+    """
+    Prices from a quote server over HTTP.
+
+    GET {base_url}/quotes?symbols=A,B answers {"prices": {"A": 1.0, ...}}.
+    A 429 response raises RateLimitedError with the server's Retry-After.
+    """
+
+    def __init__(self, base_url: str = QUOTE_SERVER_URL, timeout: float = REFRESH_TIMEOUT) -> None:
+        """
+        Initialize the provider.
+
+        Args:
+            base_url: Server address, e.g. "http://127.0.0.1:8765"
+            timeout: Seconds allowed per request
+        """
+        self._base_url = base_url.rstrip("/")
+        self._timeout = timeout
+
+    def _fetch(self, tickers: List[str]) -> Dict[str, float]:
+        """
+        Request quotes for tickers in one GET.
+
+        Args:
+            tickers: Stock symbols
+
+        Returns:
+            Ticker -> price; tickers the server has no price for are left out
+
+        Raises:
+            RateLimitedError: If the server answers 429
+        """
+        url = f"{self._base_url}/quotes?symbols={quote(','.join(tickers))}"
+        try:
+            with urllib.request.urlopen(url, timeout=self._timeout) as response:
+                prices = json.load(response).get("prices", {})
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                retry_after = _retry_after(e.headers.get("Retry-After"))
+                raise RateLimitedError("Quote server throttled the request", retry_after)
+            raise
+        return {ticker: float(price) for ticker, price in prices.items() if price}
+
+    def get_price(self, ticker: str) -> float:
+        """Get one price from the server."""
+        price = self._fetch([ticker]).get(ticker)
+        if price is None:
+            raise ValueError(f"Could not get price for {ticker}")
+        return price
+
+    def get_prices(self, tickers: List[str]) -> Dict[str, float]:
+        """Get prices for a chunk of tickers in one request."""
+        return self._fetch(list(tickers))
+
+def create_provider(name: str, store: bool = True) -> PriceProvider:
+    """
+    Create a provider by name, ready to use.
+
+    Network providers are wrapped in a QuoteClient, which rate limits,
+    retries and coalesces their requests, and every provider sits behind
+    a CachingPriceProvider: cache -> QuoteClient -> provider.
+
+    Args:
+        name: "yfinance", "http" or "fake"
+        store: Back the cache with the on-disk QuoteStore other runs share
+
+    Returns:
+        CachingPriceProvider instance
+
+    Raises:
+        ValueError: If the name is unknown
+    """
+    from cache import CachingPriceProvider, QuoteStore
+    if name == "yfinance":
+        from metadata import MetadataStore
+        from quote_client import QuoteClient
+        provider = QuoteClient(YFinanceProvider(MetadataStore()))
+    elif name == "http":
+        from quote_client import QuoteClient
+        provider = QuoteClient(HttpPriceProvider())
+    elif name == "fake":
+        provider = FakePriceProvider()
+    else:
+        raise ValueError(f"Unknown price provider: {name}")
+    return CachingPriceProvider(provider, store=QuoteStore(source=name) if store else None)
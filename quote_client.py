@@ -0,0 +1,327 @@
+"""
+asyncio quote client for the stock importer application.
+
+AsyncQuoteClient sits in front of a PriceProvider. It spaces requests
+with a token bucket, caps how many are in flight, and retries failures
+with exponential backoff and full jitter. Retries honour a Retry-After
+from the source. Requests for a ticker that is already being fetched
+wait on that fetch instead of sending another.
+
+QuoteClient is a PriceProvider facade over it. It runs the event loop on
+a background thread, so the existing synchronous callers (Portfolio,
+BatchRefresher, the GUI) use it unchanged.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from providers import PriceProvider, RateLimitedError
+from config import (
+    QUOTE_RATE, QUOTE_BURST, QUOTE_MAX_CONCURRENCY, QUOTE_MAX_RETRIES,
+    QUOTE_BACKOFF_BASE, QUOTE_BACKOFF_MAX, REFRESH_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Holds up to `burst` tokens and refills at `rate` tokens per second.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate: Tokens added per second (0 or less means unlimited)
+            burst: Bucket size (defaults to one second's worth, at least 1)
+            clock: Monotonic time source, in seconds
+        """
+        self._rate = rate
+        self._burst = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self._burst
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            0.0 if a token was taken, otherwise seconds until one will be
+        """
+        if self._rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self._rate
+
+    async def acquire(self) -> None:
+        """Wait for a token and take it."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class AsyncQuoteClient:
+    """
+    Rate limited, retrying, coalescing front for a PriceProvider.
+
+    Provider calls run on a thread pool, so blocking providers are fine.
+    Use one client from one event loop.
+
+    Attributes:
+        requests: Provider calls made, including retries
+        retries: Calls that were retried
+        throttled: Calls the source rejected as rate limited
+        coalesced: Lookups that joined a fetch already in flight
+    """
+
+    def __init__(
+        self,
+        provider: PriceProvider,
+        rate: float = QUOTE_RATE,
+        burst: int = QUOTE_BURST,
+        max_concurrency: int = QUOTE_MAX_CONCURRENCY,
+        max_retries: int = QUOTE_MAX_RETRIES,
+        backoff_base: float = QUOTE_BACKOFF_BASE,
+        backoff_max: float = QUOTE_BACKOFF_MAX,
+        timeout: float = REFRESH_TIMEOUT,
+        seed: Optional[int] = None
+    ) -> None:
+        """
+        Initialize the client.
+
+        Args:
+            provider: Source of prices
+            rate: Provider calls per second, on average (0 for no limit)
+            burst: Calls allowed back to back before the rate applies
+            max_concurrency: Provider calls in flight at once
+            max_retries: Retries after a failure; "no price" (ValueError) isn't
+                retried, but a response that doesn't parse as JSON is
+            backoff_base: Backoff before the first retry, doubled every retry
+            backoff_max: Longest backoff
+            timeout: Seconds allowed per provider call
+            seed: Seed for the jitter, for reproducible tests
+        """
+        self._provider = provider
+        self._bucket = TokenBucket(rate, burst)
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._timeout = timeout
+        self._random = random.Random(seed)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="quote")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.coalesced = 0
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (from 0), with full jitter."""
+        return self._random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+    async def _call(self, fn: Callable, *args):
+        """Call the provider with rate limiting, the concurrency cap and retries."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self._max_retries + 1):
+            await self._bucket.acquire()
+            async with self._semaphore:
+                self.requests += 1
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(self._executor, fn, *args),
+                        self._timeout
+                    )
+                except json.JSONDecodeError as e:
+                    # A truncated or garbled response; the next one may be whole
+                    error: Exception = e
+                    delay = self.backoff(attempt)
+                except (ValueError, LookupError, TypeError):
+                    # The source answered; there's just no price (a missing
+                    # key or a null field in its answer means the same)
+                    raise
+                except RateLimitedError as e:
+                    self.throttled += 1
+                    error = e
+                    delay = max(e.retry_after, self.backoff(attempt))
+                except Exception as e:
+                    error = e
+                    delay = self.backoff(attempt)
+
+            if attempt == self._max_retries:
+                raise error
+            self.retries += 1
+            logger.debug(f"Quote request failed ({error!r}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def _join(self, ticker: str) -> Optional[asyncio.Future]:
+        """The in-flight fetch for a ticker, if there is one."""
+        future = self._inflight.get(ticker)
+        if future is not None:
+            self.coalesced += 1
+        return future
+
+    def _track(self, ticker: str, future: asyncio.Future) -> None:
+        """Register an in-flight fetch until it finishes."""
+        self._inflight[ticker] = future
+
+        def done(f: asyncio.Future) -> None:
+            if self._inflight.get(ticker) is f:
+                del self._inflight[ticker]
+            # Mark the error as seen if nobody else waits on this fetch
+            if not f.cancelled():
+                f.exception()
+
+        future.add_done_callback(done)
+
+    async def get_price(self, ticker: str) -> float:
+        """
+        Get one price.
+
+        Raises:
+            ValueError: If the source has no price for the ticker
+            Exception: The last error once retries are used up
+        """
+        future = self._join(ticker)
+        if future is None:
+            future = asyncio.ensure_future(self._call(self._provider.get_price, ticker))
+            self._track(ticker, future)
+        # Shielded so one caller giving up doesn't cancel the fetch for the others
+        return await asyncio.shield(future)
+
+    async def get_prices(self, tickers: Iterable[str]) -> Dict[str, float]:
+        """
+        Get prices for many tickers with one bulk provider call.
+
+        Tickers already being fetched join those fetches instead.
+
+        Returns:
+            Prices for the tickers that could be priced
+
+        Raises:
+            Exception: The last error of the bulk call once retries are used up
+        """
+        tickers = list(dict.fromkeys(tickers))
+        joined = {}
+        new = []
+        for ticker in tickers:
+            future = self._join(ticker)
+            if future is None:
+                new.append(ticker)
+            else:
+                joined[ticker] = future
+
+        prices: Dict[str, float] = {}
+        if new:
+            loop = asyncio.get_running_loop()
+            bulk = asyncio.ensure_future(self._call(self._provider.get_prices, new))
+            waiting = {ticker: loop.create_future() for ticker in new}
+            for ticker, future in waiting.items():
+                self._track(ticker, future)
+
+            def settle(task: asyncio.Future) -> None:
+                error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+                found = task.result() if error is None else {}
+                for ticker, future in waiting.items():
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    elif ticker in found:
+                        future.set_result(found[ticker])
+                    else:
+                        future.set_exception(ValueError(f"Could not get price for {ticker}"))
+
+            bulk.add_done_callback(settle)
+            prices.update(await asyncio.shield(bulk))
+
+        for ticker, future in joined.items():
+            try:
+                prices[ticker] = await asyncio.shield(future)
+            except Exception:
+                pass
+        return {ticker: prices[ticker] for ticker in tickers if ticker in prices}
+
+    def close(self) -> None:
+        """Shut down the provider thread pool and close the provider."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._provider.close()
+
+class QuoteClient(PriceProvider):
+    """
+    Synchronous PriceProvider over an AsyncQuoteClient.
+
+    The event loop runs on a daemon thread started by the first lookup.
+    Calls from any number of threads share its rate limit and coalescing.
+    """
+
+    def __init__(self, provider: PriceProvider, **options) -> None:
+        """
+        Initialize the facade.
+
+        Args:
+            provider: Source of prices
+            **options: Passed to AsyncQuoteClient
+        """
+        self.client = AsyncQuoteClient(provider, **options)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="quote-client",
+                    daemon=True
+                )
+                self._thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def get_price(self, ticker: str) -> float:
+        """Get one price through the client."""
+        return self._run(self.client.get_price(ticker))
+
+    def get_prices(self, tickers: List[str]) -> Dict[str, float]:
+        """Get prices for a chunk of tickers through the client."""
+        return self._run(self.client.get_prices(tickers))
+
+    def close(self) -> None:
+        """Stop the event loop thread and the provider thread pool."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+            thread, self._thread = self._thread, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+        self.client.close()
@@ -0,0 +1,236 @@
+"""
+Batched price refresh engine for the stock importer application.
+
+Prices are fetched with one bulk request per chunk of tickers. Anything the
+bulk request couldn't price is retried one ticker at a time on a small
+worker pool, so a refresh costs roughly one round-trip per chunk instead of
+one per holding.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+import logging
+import threading
+import time
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Bulk fetch takes a list of tickers and returns whatever prices it found
+BulkFetch = Callable[[List[str]], Dict[str, float]]
+# Single fetch takes one ticker and returns its price (or raises)
+SingleFetch = Callable[[str], float]
+
+# How often the fallback pool checks for cancellation, in seconds
+_POLL_INTERVAL = 0.1
+
+@dataclass
+class RefreshResult:
+    """
+    Outcome of refreshing a single ticker.
+
+    Attributes:
+        ticker: Stock symbol
+        price: New price, or None if the refresh failed
+        error: Reason for the failure, or None on success
+        quoted_at: When the price was fetched, if it's an older quote
+            served from a cache rather than fetched for this refresh
+    """
+    ticker: str
+    price: Optional[float] = None
+    error: Optional[str] = None
+    quoted_at: Optional[datetime] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if a price was fetched."""
+        return self.error is None and self.price is not None
+
+@dataclass
+class RefreshReport:
+    """
+    Per-ticker report for one refresh run.
+
+    Attributes:
+        results: RefreshResult for every requested ticker
+        elapsed: Wall time of the refresh in seconds
+        cancelled: True if the refresh was cancelled before finishing
+    """
+    results: Dict[str, RefreshResult] = field(default_factory=dict)
+    elapsed: float = 0.0
+    cancelled: bool = False
+
+    @property
+    def succeeded(self) -> List[str]:
+        """Tickers that got a new price."""
+        return [t for t, r in self.results.items() if r.ok]
+
+    @property
+    def failed(self) -> Dict[str, str]:
+        """Tickers that failed, mapped to the reason."""
+        return {t: r.error or "no price" for t, r in self.results.items() if not r.ok}
+
+class BatchRefresher:
+    """Fetches prices in bulk chunks with a bounded fallback pool."""
+
+    def __init__(
+        self,
+        bulk_fetch: BulkFetch,
+        single_fetch: SingleFetch,
+        chunk_size: int = 100,
+        max_workers: int = 8,
+        timeout: float = 10.0
+    ) -> None:
+        """
+        Initialize the refresher.
+
+        Args:
+            bulk_fetch: Function returning prices for a list of tickers
+            single_fetch: Function returning the price of one ticker
+            chunk_size: Number of tickers per bulk request
+            max_workers: Size of the fallback worker pool
+            timeout: Seconds each fallback ticker gets before it is reported as timed out
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+        self._bulk_fetch = bulk_fetch
+        self._single_fetch = single_fetch
+        self._chunk_size = chunk_size
+        self._max_workers = max_workers
+        self._timeout = timeout
+
+    def refresh(
+        self,
+        tickers: Iterable[str],
+        progress: Optional[Callable[[RefreshResult], None]] = None,
+        cancel: Optional[threading.Event] = None
+    ) -> RefreshReport:
+        """
+        Refresh prices for the given tickers.
+
+        Args:
+            tickers: Stock symbols to refresh
+            progress: Called with each RefreshResult as soon as it is known
+            cancel: Event that stops the refresh when set. Tickers not
+                fetched yet are reported as cancelled.
+
+        Returns:
+            RefreshReport with one result per unique ticker
+        """
+        start = time.perf_counter()
+        tickers = list(dict.fromkeys(tickers))
+        report = RefreshReport()
+        cancel = cancel or threading.Event()
+
+        def record(result: RefreshResult) -> None:
+            report.results[result.ticker] = result
+            if progress is not None:
+                progress(result)
+
+        leftovers: List[str] = []
+        for i in range(0, len(tickers), self._chunk_size):
+            if cancel.is_set():
+                break
+            chunk = tickers[i:i + self._chunk_size]
+            try:
+                with instrumentation.span("refresh.bulk_fetch"):
+                    prices = self._bulk_fetch(chunk)
+            except Exception as e:
+                logger.warning(f"Bulk fetch failed for {len(chunk)} tickers: {e}")
+                prices = {}
+
+            for ticker in chunk:
+                price = prices.get(ticker)
+                if price:
+                    record(RefreshResult(ticker, price=float(price)))
+                else:
+                    leftovers.append(ticker)
+
+        if leftovers and not cancel.is_set():
+            self._fetch_leftovers(leftovers, record, cancel)
+
+        if cancel.is_set():
+            report.cancelled = True
+            for ticker in tickers:
+                if ticker not in report.results:
+                    record(RefreshResult(ticker, error="cancelled"))
+
+        report.elapsed = time.perf_counter() - start
+        instrumentation.count("refresh.tickers", len(report.results))
+        instrumentation.count("refresh.failed", len(report.failed))
+        return report
+
+    def _fetch_one(self, ticker: str, started: Dict[str, float]) -> float:
+        """Fetch one ticker on a worker, timed when instrumentation is on."""
+        started[ticker] = time.perf_counter()
+        with instrumentation.span("refresh.fetch_ticker"):
+            return self._single_fetch(ticker)
+
+    def _fetch_leftovers(
+        self,
+        tickers: List[str],
+        record: Callable[[RefreshResult], None],
+        cancel: threading.Event
+    ) -> None:
+        """
+        Fetch tickers the bulk request missed, one per worker.
+
+        Each ticker gets `timeout` seconds from when a worker picks it up,
+        so a ticker waiting behind slow ones isn't charged for them. A call
+        that runs out of time is abandoned, but it keeps its worker until
+        it returns. If every worker stays held that way for another
+        `timeout` seconds, the tickers still queued are reported as timed
+        out too.
+        """
+        # Ticker -> perf_counter() when its fetch started, written by the workers
+        started: Dict[str, float] = {}
+        abandoned = []
+        # When every worker became held by an abandoned call
+        blocked_since: Optional[float] = None
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            futures = {executor.submit(self._fetch_one, t, started): t for t in tickers}
+            pending = set(futures)
+
+            while pending and not cancel.is_set():
+                done, pending = wait(pending, timeout=_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(self._result_of(futures[future], future))
+
+                now = time.perf_counter()
+                for future in list(pending):
+                    start = started.get(futures[future])
+                    if start is not None and now - start >= self._timeout and not future.done():
+                        pending.discard(future)
+                        abandoned.append(future)
+                        record(RefreshResult(futures[future], error="timed out"))
+
+                if sum(not f.done() for f in abandoned) < self._max_workers:
+                    blocked_since = None
+                elif blocked_since is None:
+                    blocked_since = now
+                elif now - blocked_since >= self._timeout:
+                    # Every worker has been stuck for a whole timeout; give up on the rest
+                    break
+
+            if not cancel.is_set():
+                for future in pending:
+                    future.cancel()
+                    record(RefreshResult(futures[future], error="timed out"))
+        finally:
+            # Don't block on workers stuck past their timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _result_of(ticker: str, future) -> RefreshResult:
+        """Turn a finished single-fetch future into a RefreshResult."""
+        try:
+            price = future.result()
+        except Exception as e:
+            return RefreshResult(ticker, error=str(e))
+        if not price:
+            return RefreshResult(ticker, error="no price")
+        return RefreshResult(ticker, price=float(price))
@@ -0,0 +1,536 @@
+"""
+Market-hours-aware auto refresh for the stock importer application.
+
+RefreshScheduler keeps a due time for every holding and refreshes only
+the tickers that are due. While a ticker's exchange is open it's polled
+on its own interval: the interval halves every time the price moves and
+grows while it doesn't, so active or volatile holdings are polled often
+and quiet ones rarely. Once the exchange closes a ticker gets one last
+refresh for the closing price and then waits for the next session, so
+nights, weekends and holidays cost no requests.
+
+Exchange calendars are built from rules, not downloaded. Regular holidays
+are modelled for the US, London, Xetra, Euronext, SIX, Toronto and the
+ASX; Tokyo and Hong Kong only know their weekends and lunch breaks, so on
+their holidays the unchanged price just stretches the interval to its
+maximum. Tickers on an exchange with no calendar here are polled at the
+plain AUTO_REFRESH_INTERVAL around the clock.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+import heapq
+import logging
+import threading
+import time
+from metadata import MetadataStore
+from models import ADDED, REMOVED, Portfolio, PortfolioChanges
+from refresh import RefreshReport
+from config import (
+    AUTO_REFRESH_INTERVAL, AUTO_REFRESH_MIN_INTERVAL, AUTO_REFRESH_MAX_INTERVAL,
+    AUTO_REFRESH_MOVE, AUTO_REFRESH_CLOSE_GRACE
+)
+
+logger = logging.getLogger(__name__)
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """The nth given weekday (0 = Monday) of a month; n = -1 for the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+def _easter(year: int) -> date:
+    """Easter Sunday (Gregorian calendar)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+def _roll_forward(days: Iterable[date]) -> FrozenSet[date]:
+    """
+    Move holidays that fall on a weekend to the next free weekday, in
+    order (so Christmas and Boxing Day on a weekend become Monday and
+    Tuesday).
+    """
+    taken = set()
+    for day in days:
+        while day.weekday() >= 5 or day in taken:
+            day += timedelta(days=1)
+        taken.add(day)
+    return frozenset(taken)
+
+@lru_cache(maxsize=None)
+def us_holidays(year: int) -> FrozenSet[date]:
+    """NYSE/Nasdaq full-day holidays."""
+    def observed(day: date) -> date:
+        # Saturday holidays close the Friday before, Sunday ones the Monday after
+        if day.weekday() == 5:
+            return day - timedelta(days=1)
+        if day.weekday() == 6:
+            return day + timedelta(days=1)
+        return day
+
+    days = {
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        observed(date(year, 12, 25)),
+    }
+    # New Year's Day on a Saturday isn't made up on the Friday before
+    if date(year, 1, 1).weekday() != 5:
+        days.add(observed(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19)))  # Juneteenth
+    return frozenset(days)
+
+@lru_cache(maxsize=None)
+def lse_holidays(year: int) -> FrozenSet[date]:
+    """London Stock Exchange holidays (England and Wales bank holidays)."""
+    easter = _easter(year)
+    return (
+        _roll_forward([date(year, 1, 1)])
+        | _roll_forward([date(year, 12, 25), date(year, 12, 26)])
+        | {
+            easter - timedelta(days=2),
+            easter + timedelta(days=1),
+            _nth_weekday(year, 5, 0, 1),  # Early May bank holiday
+            _nth_weekday(year, 5, 0, -1),  # Spring bank holiday
+            _nth_weekday(year, 8, 0, -1),  # Summer bank holiday
+        }
+    )
+
+@lru_cache(maxsize=None)
+def xetra_holidays(year: int) -> FrozenSet[date]:
+    """Xetra trading holidays (these aren't moved when they fall on a weekend)."""
+    easter = _easter(year)
+    return frozenset({
+        date(year, 1, 1),
+        easter - timedelta(days=2),
+        easter + timedelta(days=1),
+        date(year, 5, 1),
+        date(year, 12, 24),
+        date(year, 12, 25),
+        date(year, 12, 26),
+        date(year, 12, 31),
+    })
+
+@lru_cache(maxsize=None)
+def euronext_holidays(year: int) -> FrozenSet[date]:
+    """Euronext (Paris, Amsterdam, Brussels, Lisbon) holidays, not moved off weekends."""
+    easter = _easter(year)
+    return frozenset({
+        date(year, 1, 1),
+        easter - timedelta(days=2),
+        easter + timedelta(days=1),
+        date(year, 5, 1),
+        date(year, 12, 25),
+        date(year, 12, 26),
+    })
+
+@lru_cache(maxsize=None)
+def six_holidays(year: int) -> FrozenSet[date]:
+    """SIX Swiss Exchange holidays, not moved off weekends."""
+    easter = _easter(year)
+    return frozenset({
+        date(year, 1, 1),
+        date(year, 1, 2),  # Berchtoldstag
+        easter - timedelta(days=2),
+        easter + timedelta(days=1),
+        easter + timedelta(days=39),  # Ascension
+        easter + timedelta(days=50),  # Whit Monday
+        date(year, 5, 1),
+        date(year, 8, 1),  # Swiss National Day
+        date(year, 12, 24),
+        date(year, 12, 25),
+        date(year, 12, 26),
+        date(year, 12, 31),
+    })
+
+@lru_cache(maxsize=None)
+def asx_holidays(year: int) -> FrozenSet[date]:
+    """Australian Securities Exchange holidays."""
+    easter = _easter(year)
+    return (
+        _roll_forward([date(year, 1, 1)])
+        | _roll_forward([date(year, 1, 26)])  # Australia Day
+        | _roll_forward([date(year, 12, 25), date(year, 12, 26)])
+        | {
+            easter - timedelta(days=2),
+            easter + timedelta(days=1),
+            date(year, 4, 25),  # Anzac Day, no substitute when on a weekend
+            _nth_weekday(year, 6, 0, 2),  # King's Birthday
+        }
+    )
+
+@lru_cache(maxsize=None)
+def tsx_holidays(year: int) -> FrozenSet[date]:
+    """Toronto Stock Exchange holidays."""
+    return (
+        _roll_forward([date(year, 1, 1)])
+        | _roll_forward([date(year, 7, 1)])
+        | _roll_forward([date(year, 12, 25), date(year, 12, 26)])
+        | {
+            _nth_weekday(year, 2, 0, 3),  # Family Day
+            _easter(year) - timedelta(days=2),  # Good Friday
+            date(year, 5, 24) - timedelta(days=date(year, 5, 24).weekday()),  # Victoria Day
+            _nth_weekday(year, 8, 0, 1),  # Civic Holiday
+            _nth_weekday(year, 9, 0, 1),  # Labour Day
+            _nth_weekday(year, 10, 0, 2),  # Thanksgiving
+        }
+    )
+
+def _no_holidays(year: int) -> FrozenSet[date]:
+    return frozenset()
+
+@dataclass(frozen=True)
+class Exchange:
+    """
+    Trading calendar of one exchange.
+
+    Attributes:
+        name: Short name, e.g. "US"
+        timezone: IANA time zone the sessions are given in
+        sessions: (open, close) local times of each trading day's sessions,
+            in order; empty for markets that trade around the clock
+        holidays: Returns a year's full-day holidays
+    """
+    name: str
+    timezone: str
+    sessions: Tuple[Tuple[dtime, dtime], ...] = ()
+    holidays: Callable[[int], FrozenSet[date]] = _no_holidays
+
+    def is_trading_day(self, day: date) -> bool:
+        """True if the exchange opens at all on a local date."""
+        return day.weekday() < 5 and day not in self.holidays(day.year)
+
+    def session(self, when: datetime) -> Tuple[datetime, Optional[datetime]]:
+        """
+        The session in progress at `when`, or else the next one.
+
+        Args:
+            when: Timezone-aware time
+
+        Returns:
+            (open, close) as aware datetimes; for around-the-clock markets
+            (when, None)
+        """
+        if not self.sessions:
+            return when, None
+        tz = ZoneInfo(self.timezone)
+        local = when.astimezone(tz)
+        day = local.date()
+        # No exchange closes for anything like this long
+        for _ in range(30):
+            if self.is_trading_day(day):
+                for start, end in self.sessions:
+                    close = datetime.combine(day, end, tzinfo=tz)
+                    if close > local:
+                        return datetime.combine(day, start, tzinfo=tz), close
+            day += timedelta(days=1)
+        raise ValueError(f"No {self.name} session within 30 days of {when}")
+
+    def is_open(self, when: datetime) -> bool:
+        """True if the exchange is trading at `when` (timezone-aware)."""
+        return self.session(when)[0] <= when
+
+US = Exchange("US", "America/New_York", ((dtime(9, 30), dtime(16, 0)),), us_holidays)
+LSE = Exchange("LSE", "Europe/London", ((dtime(8, 0), dtime(16, 30)),), lse_holidays)
+XETRA = Exchange("XETRA", "Europe/Berlin", ((dtime(9, 0), dtime(17, 30)),), xetra_holidays)
+TSX = Exchange("TSX", "America/Toronto", ((dtime(9, 30), dtime(16, 0)),), tsx_holidays)
+EURONEXT = Exchange(
+    "EURONEXT", "Europe/Paris", ((dtime(9, 0), dtime(17, 30)),), euronext_holidays
+)
+SIX = Exchange("SIX", "Europe/Zurich", ((dtime(9, 0), dtime(17, 30)),), six_holidays)
+ASX = Exchange("ASX", "Australia/Sydney", ((dtime(10, 0), dtime(16, 0)),), asx_holidays)
+TSE = Exchange("TSE", "Asia/Tokyo", ((dtime(9, 0), dtime(11, 30)), (dtime(12, 30), dtime(15, 0))))
+HKEX = Exchange("HKEX", "Asia/Hong_Kong", ((dtime(9, 30), dtime(12, 0)), (dtime(13, 0), dtime(16, 0))))
+CRYPTO = Exchange("CRYPTO", "UTC")
+# An exchange with no calendar here; never treated as closed
+UNKNOWN = Exchange("UNKNOWN", "UTC")
+
+# Yahoo exchange codes (TickerMetadata.exchange) and ticker suffixes
+EXCHANGE_CODES = {
+    "NMS": US, "NGM": US, "NCM": US, "NYQ": US, "PCX": US, "ASE": US, "BTS": US,
+    "LSE": LSE, "GER": XETRA, "TOR": TSX, "JPX": TSE, "HKG": HKEX, "CCC": CRYPTO,
+    "PAR": EURONEXT, "AMS": EURONEXT, "BRU": EURONEXT, "LIS": EURONEXT,
+    "EBS": SIX, "ASX": ASX,
+}
+TICKER_SUFFIXES = {
+    ".L": LSE, ".DE": XETRA, ".TO": TSX, ".T": TSE, ".HK": HKEX, "-USD": CRYPTO,
+    ".PA": EURONEXT, ".AS": EURONEXT, ".BR": EURONEXT, ".LS": EURONEXT,
+    ".SW": SIX, ".AX": ASX,
+}
+
+def exchange_for(ticker: str, exchange_code: Optional[str] = None) -> Exchange:
+    """
+    Work out which exchange a ticker trades on.
+
+    Args:
+        ticker: Stock symbol
+        exchange_code: Exchange code from the ticker's metadata, if known
+
+    Returns:
+        The exchange. Tickers without a suffix count as US, as on Yahoo;
+        an unknown suffix (e.g. ".MI", "=X") gives UNKNOWN.
+    """
+    if exchange_code in EXCHANGE_CODES:
+        return EXCHANGE_CODES[exchange_code]
+    for suffix, exchange in TICKER_SUFFIXES.items():
+        if ticker.endswith(suffix):
+            return exchange
+    if "." in ticker or "=" in ticker:
+        return UNKNOWN
+    return US
+
+class _Entry:
+    """Scheduling state of one ticker."""
+
+    __slots__ = ("exchange", "interval", "price", "due")
+
+    def __init__(self, exchange: Exchange, interval: float, price: Optional[float], due: float) -> None:
+        self.exchange = exchange
+        self.interval = interval
+        self.price = price
+        self.due = due
+
+class RefreshScheduler:
+    """
+    Decides which holdings to refresh and when.
+
+    Holdings are due as soon as they're added, then follow their
+    exchange's hours. Like the Portfolio it follows, it isn't thread-safe:
+    call it from the thread that owns the portfolio.
+
+    Attributes:
+        clock: Wall-clock time source (seconds since the epoch)
+    """
+
+    def __init__(
+        self,
+        portfolio: Portfolio,
+        metadata: Optional[MetadataStore] = None,
+        interval: float = AUTO_REFRESH_INTERVAL,
+        min_interval: float = AUTO_REFRESH_MIN_INTERVAL,
+        max_interval: float = AUTO_REFRESH_MAX_INTERVAL,
+        move: float = AUTO_REFRESH_MOVE,
+        close_grace: float = AUTO_REFRESH_CLOSE_GRACE,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        """
+        Schedule every holding and follow the portfolio's changes.
+
+        Args:
+            portfolio: Holdings to refresh
+            metadata: MetadataStore to look up exchange codes in (tickers
+                fall back to their suffix without one)
+            interval: Starting seconds between refreshes while open
+            min_interval: Shortest interval while open
+            max_interval: Longest interval while open
+            move: Relative price change that shortens the interval
+            close_grace: Seconds after the close of the last refresh of the day
+            clock: Wall-clock time source
+        """
+        self._portfolio = portfolio
+        self._metadata = metadata
+        self._interval = interval
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._move = move
+        self._close_grace = close_grace
+        self.clock = clock
+        self._entries: Dict[str, _Entry] = {}
+        # (due, ticker); entries whose due time has since changed are skipped
+        self._heap: List[Tuple[float, str]] = []
+        self._track(portfolio.get_tickers(), clock())
+        portfolio.subscribe(self._on_changes)
+
+    def close(self) -> None:
+        """Stop following the portfolio."""
+        self._portfolio.unsubscribe(self._on_changes)
+
+    def _track(self, tickers: Iterable[str], now: float) -> None:
+        """Start scheduling tickers, due now."""
+        tickers = [t for t in tickers if t not in self._entries]
+        codes = {}
+        if self._metadata is not None and tickers:
+            codes = {t: m.exchange for t, m in self._metadata.get_many(tickers).items()}
+        for ticker in tickers:
+            stock = self._portfolio.get_stock(ticker)
+            entry = _Entry(
+                exchange_for(ticker, codes.get(ticker)),
+                self._interval,
+                stock.price if stock is not None else None,
+                now
+            )
+            self._entries[ticker] = entry
+            heapq.heappush(self._heap, (now, ticker))
+
+    def _on_changes(self, event: PortfolioChanges) -> None:
+        """Schedule new holdings right away and forget removed ones."""
+        for ticker in event.tickers(REMOVED):
+            self._entries.pop(ticker, None)
+        added = event.tickers(ADDED)
+        if added:
+            self._track(added, self.clock())
+
+    def _schedule(self, ticker: str, entry: _Entry, due: float) -> None:
+        entry.due = due
+        heapq.heappush(self._heap, (due, ticker))
+
+    def _next_due(self, entry: _Entry, now: float) -> float:
+        """When to refresh a ticker next, given its current interval."""
+        start, end = entry.exchange.session(datetime.fromtimestamp(now, timezone.utc))
+        if end is None:
+            return now + entry.interval
+        if start.timestamp() > now:
+            # Closed: wait for the next session
+            return start.timestamp()
+        due = now + entry.interval
+        close = end.timestamp()
+        if due >= close:
+            # Last refresh of the session, once the closing price is in
+            return close + self._close_grace
+        return due
+
+    def due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        """
+        Take the tickers that are due for a refresh.
+
+        Taken tickers stay scheduled `max_interval` out in case their
+        refresh never reports back; pass the refresh's report to record()
+        to schedule them properly.
+
+        Args:
+            now: Current time (defaults to the clock)
+            limit: Most tickers to take
+
+        Returns:
+            Due tickers, most overdue first
+        """
+        now = self.clock() if now is None else now
+        heap = self._heap
+        taken = []
+        while heap and heap[0][0] <= now and (limit is None or len(taken) < limit):
+            due, ticker = heapq.heappop(heap)
+            entry = self._entries.get(ticker)
+            if entry is None or entry.due != due:
+                continue
+            taken.append(ticker)
+            self._schedule(ticker, entry, now + self._max_interval)
+        return taken
+
+    def record(self, report: RefreshReport, now: Optional[float] = None) -> None:
+        """
+        Reschedule the tickers in a refresh report.
+
+        Works for any refresh, not just those the scheduler started, so a
+        manual refresh also pushes back the next automatic one.
+
+        Args:
+            report: Report from fetch_prices or update_prices
+            now: Time the refresh finished (defaults to the clock)
+        """
+        now = self.clock() if now is None else now
+        for ticker, result in report.results.items():
+            entry = self._entries.get(ticker)
+            if entry is None:
+                continue
+            if entry.exchange is UNKNOWN:
+                # Without a calendar there's nothing to adapt to; keep the plain interval
+                pass
+            elif result.ok:
+                moved = entry.price is None or (
+                    abs(result.price - entry.price) > self._move * abs(entry.price)
+                )
+                if moved:
+                    entry.interval = max(self._min_interval, entry.interval / 2)
+                else:
+                    entry.interval = min(self._max_interval, entry.interval * 1.5)
+            elif result.error != "cancelled":
+                # Back off from tickers that keep failing
+                entry.interval = min(self._max_interval, entry.interval * 2)
+            if result.ok:
+                entry.price = result.price
+            self._schedule(ticker, entry, self._next_due(entry, now))
+
+    def tick(self, now: Optional[float] = None, **options) -> Optional[RefreshReport]:
+        """
+        Refresh the due tickers, if any, and reschedule them.
+
+        Args:
+            now: Current time (defaults to the clock)
+            **options: Passed on to Portfolio.update_prices
+
+        Returns:
+            The refresh's report, or None if nothing was due
+        """
+        tickers = self.due(now)
+        if not tickers:
+            return None
+        report = self._portfolio.update_prices(tickers=tickers, **options)
+        self.record(report, now)
+        return report
+
+    def next_due(self) -> Optional[float]:
+        """Time the next ticker is due, or None if nothing is scheduled."""
+        heap = self._heap
+        while heap:
+            due, ticker = heap[0]
+            entry = self._entries.get(ticker)
+            if entry is not None and entry.due == due:
+                return due
+            heapq.heappop(heap)
+        return None
+
+    def due_at(self, ticker: str) -> Optional[float]:
+        """Time a ticker is next due, or None if it isn't scheduled."""
+        entry = self._entries.get(ticker)
+        return entry.due if entry is not None else None
+
+    def run(
+        self,
+        stop: threading.Event,
+        max_wait: float = 60.0,
+        on_report: Optional[Callable[[RefreshReport], None]] = None,
+        **options
+    ) -> None:
+        """
+        Refresh due tickers until `stop` is set.
+
+        Sleeps until the next ticker is due, but never longer than
+        `max_wait`, so holdings added meanwhile aren't left waiting.
+
+        Args:
+            stop: Event that ends the loop
+            max_wait: Longest sleep between checks, in seconds
+            on_report: Called with each refresh's report
+            **options: Passed on to Portfolio.update_prices
+        """
+        while not stop.is_set():
+            try:
+                report = self.tick(**options)
+                if report is not None and on_report is not None:
+                    on_report(report)
+            except Exception as e:
+                logger.error(f"Scheduled refresh failed: {e}")
+            due = self.next_due()
+            wait = max_wait if due is None else min(max(due - self.clock(), 0.0), max_wait)
+            stop.wait(wait)
+
+    def __len__(self) -> int:
+        return len(self._entries)
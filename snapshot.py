@@ -0,0 +1,310 @@
+"""
+Binary portfolio snapshots for the stock importer application.
+
+A snapshot sits next to the portfolio CSV and holds the same holdings as
+fixed-width records plus a table of ticker strings. It is opened with
+mmap, so opening costs the same no matter how many holdings there are
+and a record is only decoded when it's read. The header remembers the
+size and modification time of the CSV it was written from; if the CSV
+has changed since, the snapshot is stale and callers read the CSV.
+
+Layout (little-endian):
+    header   HEADER_SIZE bytes, see _HEADER
+    records  count * RECORD.itemsize bytes
+    strings  UTF-8 tickers, back to back
+"""
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Union
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+import numpy as np
+from columnar import ColumnarPortfolio, TIME_DTYPE
+from models import Portfolio, Stock
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STKSNAP\0"
+VERSION = 1
+HEADER_SIZE = 64
+
+# magic, version, record size, count, strings size, source mtime (ns),
+# source size, data checksum, header checksum
+_HEADER = struct.Struct("<8sIIQQqQII")
+
+RECORD = np.dtype([
+    ("offset", "<u4"),     # Start of the ticker in the string table
+    ("length", "<u2"),     # Ticker length in bytes
+    ("pad", "<u2"),
+    ("quantity", "<i8"),
+    ("price", "<f8"),
+    ("updated", "<i8"),    # Microseconds since 1970-01-01, naive local time
+])
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, corrupt or from another version."""
+    pass
+
+def snapshot_path(csv_path: Union[str, Path]) -> Path:
+    """Get the snapshot file that belongs to a CSV file."""
+    return Path(csv_path).with_suffix(".snap")
+
+def write_snapshot(
+    path: Union[str, Path],
+    stocks: Sequence[Stock],
+    source: Optional[Union[str, Path]] = None
+) -> int:
+    """
+    Write holdings as a snapshot, atomically.
+
+    Args:
+        path: Snapshot file to write
+        stocks: Holdings to write
+        source: CSV file the snapshot mirrors. Its size and modification
+            time are recorded so a later change to it makes the snapshot stale.
+
+    Returns:
+        Number of bytes written
+    """
+    path = Path(path)
+    encoded = [stock.ticker.encode("utf-8") for stock in stocks]
+    records = np.zeros(len(stocks), dtype=RECORD)
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    records["offset"] = np.cumsum(lengths) - lengths
+    records["length"] = lengths
+    records["quantity"] = [stock.quantity for stock in stocks]
+    records["price"] = [stock.price for stock in stocks]
+    records["updated"] = np.array(
+        [stock.last_updated for stock in stocks], dtype=TIME_DTYPE
+    ).view(np.int64)
+
+    data = records.tobytes()
+    strings = b"".join(encoded)
+    data_crc = zlib.crc32(strings, zlib.crc32(data))
+
+    source_mtime, source_size = 0, 0
+    if source is not None:
+        stat = os.stat(source)
+        source_mtime, source_size = stat.st_mtime_ns, stat.st_size
+
+    fields = (MAGIC, VERSION, RECORD.itemsize, len(stocks), len(strings),
+              source_mtime, source_size, data_crc)
+    header_crc = zlib.crc32(_HEADER.pack(*fields, 0))
+    header = _HEADER.pack(*fields, header_crc).ljust(HEADER_SIZE, b"\0")
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(header)
+            file.write(data)
+            file.write(strings)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        return len(header) + len(data) + len(strings)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+class SnapshotReader:
+    """
+    Memory-mapped view of a snapshot.
+
+    Nothing is parsed up front. Column properties are NumPy views straight
+    onto the mapped file; drop them before calling close().
+    """
+
+    def __init__(self, path: Union[str, Path], copy_on_write: bool = False) -> None:
+        """
+        Open and map a snapshot.
+
+        Args:
+            path: Snapshot file
+            copy_on_write: Map the file privately so the columns can be
+                written to. Writes stay in memory and never reach the file.
+
+        Raises:
+            SnapshotError: If the file is missing, truncated or invalid
+        """
+        self._path = Path(path)
+        try:
+            with open(self._path, "rb") as file:
+                access = mmap.ACCESS_COPY if copy_on_write else mmap.ACCESS_READ
+                self._mmap = mmap.mmap(file.fileno(), 0, access=access)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"Can't open snapshot {self._path}: {e}")
+
+        try:
+            self._read_header()
+        except SnapshotError:
+            self._mmap.close()
+            raise
+
+    def _read_header(self) -> None:
+        if len(self._mmap) < HEADER_SIZE:
+            raise SnapshotError("Snapshot is truncated")
+        fields = _HEADER.unpack_from(self._mmap, 0)
+        (magic, version, record_size, count, strings_size,
+         self.source_mtime, self.source_size, self._data_crc, header_crc) = fields
+
+        if magic != MAGIC:
+            raise SnapshotError("Not a snapshot file")
+        if version != VERSION or record_size != RECORD.itemsize:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        if zlib.crc32(_HEADER.pack(*fields[:-1], 0)) != header_crc:
+            raise SnapshotError("Snapshot header checksum mismatch")
+
+        self._strings_start = HEADER_SIZE + count * RECORD.itemsize
+        if len(self._mmap) != self._strings_start + strings_size:
+            raise SnapshotError("Snapshot size doesn't match its header")
+        self._count = count
+        self._records = np.frombuffer(self._mmap, dtype=RECORD, count=count, offset=HEADER_SIZE)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Unmap the file."""
+        self._records = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A caller still holds a column view; the map closes with it
+            logger.debug("Snapshot still in use, leaving it mapped")
+
+    def is_fresh(self, csv_path: Union[str, Path]) -> bool:
+        """
+        Check the CSV hasn't changed since the snapshot was written.
+
+        Args:
+            csv_path: CSV file the snapshot mirrors
+        """
+        try:
+            stat = os.stat(csv_path)
+        except FileNotFoundError:
+            return False
+        return stat.st_mtime_ns == self.source_mtime and stat.st_size == self.source_size
+
+    def verify(self) -> bool:
+        """Check the data checksum. This reads the whole file."""
+        data = zlib.crc32(self._mmap[HEADER_SIZE:self._strings_start])
+        return zlib.crc32(self._mmap[self._strings_start:], data) == self._data_crc
+
+    @property
+    def quantities(self) -> np.ndarray:
+        """Quantity column (a view onto the file)."""
+        return self._records["quantity"]
+
+    @property
+    def prices(self) -> np.ndarray:
+        """Price column (a view onto the file)."""
+        return self._records["price"]
+
+    @property
+    def last_updated(self) -> np.ndarray:
+        """Last-updated column as datetime64[us] (a view onto the file)."""
+        return self._records["updated"].view(TIME_DTYPE)
+
+    def ticker(self, index: int) -> str:
+        """Decode one ticker."""
+        record = self._records[index]
+        start = self._strings_start + int(record["offset"])
+        return self._mmap[start:start + int(record["length"])].decode("utf-8")
+
+    def tickers(self) -> List[str]:
+        """Decode every ticker."""
+        offsets = self._records["offset"].tolist()
+        lengths = self._records["length"].tolist()
+        strings = self._mmap[self._strings_start:].decode("utf-8")
+        if len(strings) == len(self._mmap) - self._strings_start:
+            # All ASCII, so byte offsets are character offsets
+            return [strings[o:o + n] for o, n in zip(offsets, lengths)]
+        return [self.ticker(i) for i in range(self._count)]
+
+    def stock(self, index: int) -> Stock:
+        """Build the Stock for one record."""
+        record = self._records[index]
+        return Stock(
+            ticker=self.ticker(index),
+            quantity=int(record["quantity"]),
+            price=float(record["price"]),
+            last_updated=self.last_updated[index].item()
+        )
+
+    def stocks(self) -> Iterator[Stock]:
+        """Build a Stock for every record."""
+        yield from map(
+            Stock,
+            self.tickers(),
+            self.quantities.tolist(),
+            self.prices.tolist(),
+            self.last_updated.tolist()
+        )
+
+    def to_portfolio(self, columnar: bool = False, mapped: bool = False) -> Portfolio:
+        """
+        Copy the snapshot into a portfolio.
+
+        Args:
+            columnar: Build a ColumnarPortfolio (array copies, no Stock objects)
+            mapped: Build a ColumnarPortfolio straight over the mapped columns,
+                copying nothing. Needs a copy_on_write reader, which then
+                stays mapped for as long as the portfolio uses the columns.
+        """
+        if mapped:
+            return ColumnarPortfolio.from_arrays(
+                self.tickers, self.quantities, self.prices, self.last_updated
+            )
+        if columnar:
+            portfolio = ColumnarPortfolio(capacity=self._count)
+            portfolio.add_many(self.tickers(), self.quantities, self.prices, self.last_updated)
+            return portfolio
+
+        portfolio = Portfolio()
+        for stock in self.stocks():
+            portfolio.add_stock(stock)
+        return portfolio
+
+def open_fresh(
+    csv_path: Union[str, Path],
+    verify: bool = True,
+    copy_on_write: bool = False
+) -> Optional[SnapshotReader]:
+    """
+    Open the snapshot for a CSV file if it is valid and up to date.
+
+    Args:
+        csv_path: CSV file the snapshot mirrors
+        verify: Check the data checksum too (reads the whole file once)
+        copy_on_write: Passed to SnapshotReader
+
+    Returns:
+        SnapshotReader, or None if the snapshot is missing, stale or invalid
+    """
+    path = snapshot_path(csv_path)
+    if not path.exists():
+        return None
+    try:
+        reader = SnapshotReader(path, copy_on_write=copy_on_write)
+    except SnapshotError as e:
+        logger.warning(f"Ignoring snapshot: {e}")
+        return None
+    if not reader.is_fresh(csv_path):
+        logger.info("Snapshot is older than the CSV, ignoring it")
+        reader.close()
+        return None
+    if verify and not reader.verify():
+        logger.warning("Ignoring snapshot: data checksum mismatch")
+        reader.close()
+        return None
+    return reader
@@ -5,75 +5,823 @@ Only have this handle reading and writing portfolio data to CSV files.
 Add exceptions too just in case
 This module is basically just for logging.
 """
+import atexit
 import csv
-from typing import Dict, List
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 import logging
 from datetime import datetime
+import config
+import db
+import instrumentation
 from models import Stock, Portfolio
-from config import STOCKS_FILE
+from config import (
+    STOCKS_FILE, JOURNAL_FILE, SQLITE_FILE, JOURNAL_COMPACT_THRESHOLD, STORAGE_MODE, SAVE_DELAY,
+    SAVE_MAX_RETRY_DELAY
+)
 
 logger = logging.getLogger(__name__)
 
-class StorageManager:
-    """Manages data persistence for the application."""
-    
-    @staticmethod
-    def save_portfolio(portfolio: Portfolio) -> None:
+HEADER = ["Ticker", "Quantity", "Price", "Last Updated"]
+
+def _write_csv_atomic(path: Path, stocks: Iterable[Stock]) -> int:
+    """
+    Write holdings to a CSV file through a temp file and rename.
+
+    A crash mid-write leaves the old file in place instead of a truncated one.
+
+    Returns:
+        Number of bytes written
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode="w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(HEADER)
+            for stock in stocks:
+                writer.writerow([
+                    stock.ticker,
+                    stock.quantity,
+                    stock.price,
+                    stock.last_updated.isoformat()
+                ])
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        os.replace(tmp_path, path)
+        return size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def _read_csv(path: Path) -> Iterator[Stock]:
+    """
+    Read holdings from a CSV file, skipping rows that don't parse.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+    """
+    # The bulk loader pulls in NumPy, so only import it once a file is read
+    from loader import LoadReport, iter_chunks
+
+    report = LoadReport()
+    for chunk in iter_chunks(path, report=report):
+        yield from chunk.to_stocks()
+    if report.error_count:
+        logger.error(f"Skipped {report.error_count} bad rows in {path}: {report.errors[:5]}")
+
+def _write_holdings(path: Path, stocks: Iterable[Stock]) -> int:
+    """
+    Write the CSV, then the binary snapshot that mirrors it.
+
+    Returns:
+        Number of bytes written to both files
+    """
+    from snapshot import snapshot_path, write_snapshot
+
+    stocks = list(stocks)
+    size = _write_csv_atomic(path, stocks)
+    try:
+        size += write_snapshot(snapshot_path(path), stocks, source=path)
+    except Exception as e:
+        # The CSV is the source of truth; a missing snapshot only slows startup
+        logger.warning(f"Could not write snapshot: {e}")
+    return size
+
+def _read_holdings(path: Path) -> Iterator[Stock]:
+    """
+    Read holdings from the snapshot if it's up to date, else from the CSV.
+
+    Raises:
+        FileNotFoundError: If the CSV doesn't exist
+    """
+    from snapshot import open_fresh
+
+    reader = open_fresh(path)
+    if reader is None:
+        yield from _read_csv(path)
+        return
+    with reader:
+        yield from reader.stocks()
+
+class StorageBackend(ABC):
+    """
+    Interface for anything that can persist a portfolio.
+
+    Attributes:
+        bytes_written: Bytes this backend has written so far
+    """
+
+    bytes_written = 0
+
+    @abstractmethod
+    def load_portfolio(self) -> Portfolio:
         """
-        Save portfolio data to CSV file.
-        
+        Load the saved portfolio.
+
+        Returns:
+            Portfolio instance with loaded data (empty if nothing is saved)
+        """
+
+    @abstractmethod
+    def save_portfolio(self, portfolio: Portfolio) -> None:
+        """
+        Replace everything saved with the given portfolio.
+
         Args:
             portfolio: Portfolio instance to save
         """
+
+    def save_changes(self, portfolio: Portfolio, tickers: Iterable[str]) -> None:
+        """
+        Save after some holdings changed.
+
+        Backends that can update single holdings override this. The
+        default rewrites everything.
+
+        Args:
+            portfolio: Portfolio the changes were made to
+            tickers: Tickers that were added, changed or removed
+        """
+        self.save_portfolio(portfolio)
+
+    def get_stock(self, ticker: str) -> Optional[Stock]:
+        """
+        Look up one saved holding.
+
+        Args:
+            ticker: Stock symbol
+
+        Returns:
+            The saved Stock, or None if it isn't saved
+        """
+        return self.load_portfolio().get_holdings().get(ticker)
+
+    def close(self) -> None:
+        """Release anything the backend holds open."""
+
+class CsvStorage(StorageBackend):
+    """Whole portfolio in one CSV file, rewritten on every save."""
+
+    def __init__(self, path: Union[str, Path] = STOCKS_FILE, mapped: bool = False) -> None:
+        """
+        Initialize CSV storage.
+
+        Args:
+            path: CSV file to read and write
+            mapped: Load a fresh snapshot as a ColumnarPortfolio over its
+                mapped columns instead of copying it into a Portfolio
+        """
+        self._path = Path(path)
+        self._mapped = mapped
+
+    @instrumentation.timed("storage.save_portfolio")
+    def save_portfolio(self, portfolio: Portfolio) -> None:
+        """Save portfolio data to the CSV file."""
         try:
-            with open(STOCKS_FILE, mode="w", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(["Ticker", "Quantity", "Price", "Last Updated"])
-                
-                for stock in portfolio.get_holdings().values():
-                    writer.writerow([
-                        stock.ticker,
-                        stock.quantity,
-                        stock.price,
-                        stock.last_updated.isoformat()
-                    ])
+            self.bytes_written += _write_holdings(self._path, portfolio.get_holdings().values())
             logger.info("Portfolio saved successfully")
         except Exception as e:
             logger.error(f"Error saving portfolio: {e}")
             raise
-    
-    @staticmethod
-    def load_portfolio() -> Portfolio:
+
+    @instrumentation.timed("storage.load_portfolio")
+    def load_portfolio(self) -> Portfolio:
         """
-        Load portfolio data from CSV file.
-        
-        Returns:
-            Portfolio instance with loaded data
+        Load portfolio data from the CSV file.
+
+        If the snapshot is up to date and intact, the holdings are read
+        from it rather than parsed from the CSV; with mapped set they are
+        served straight from its mapped columns as a ColumnarPortfolio.
         """
+        from snapshot import open_fresh
+
+        reader = open_fresh(self._path, copy_on_write=self._mapped)
+        if reader is not None:
+            if self._mapped:
+                # The portfolio keeps the map alive through its column views
+                portfolio = reader.to_portfolio(mapped=True)
+            else:
+                with reader:
+                    portfolio = reader.to_portfolio()
+            logger.info("Portfolio loaded from snapshot")
+            return portfolio
+
         portfolio = Portfolio()
-        
         try:
-            with open(STOCKS_FILE, mode="r", newline="") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    try:
-                        stock = Stock(
-                            ticker=row["Ticker"],
-                            quantity=int(row["Quantity"]),
-                            price=float(row["Price"]),
-                            last_updated=datetime.fromisoformat(row["Last Updated"])
-                        )
-                        portfolio.add_stock(stock)
-                    except (ValueError, KeyError) as e:
-                        logger.error(f"Error parsing row {row}: {e}")
-                        continue
-                        
+            for stock in _read_csv(self._path):
+                portfolio.add_stock(stock)
+
             logger.info("Portfolio loaded successfully")
             return portfolio
-            
+
         except FileNotFoundError:
             logger.info("No existing portfolio file found")
             return portfolio
         except Exception as e:
             logger.error(f"Error loading portfolio: {e}")
             raise
+
+class StorageManager:
+    """
+    Manages data persistence for the application (CSV at config.STOCKS_FILE).
+
+    The path is looked up on every call so tests can point it elsewhere.
+    """
+
+    @staticmethod
+    def save_portfolio(portfolio: Portfolio) -> None:
+        """
+        Save portfolio data to CSV file.
+
+        Args:
+            portfolio: Portfolio instance to save
+        """
+        CsvStorage(config.STOCKS_FILE).save_portfolio(portfolio)
+
+    @staticmethod
+    def save_changes(portfolio: Portfolio, tickers: Iterable[str]) -> None:
+        """
+        Save after some holdings changed.
+
+        The CSV format can't be updated in place, so this rewrites the file.
+
+        Args:
+            portfolio: Portfolio instance to save
+            tickers: Tickers that were added, changed or removed
+        """
+        CsvStorage(config.STOCKS_FILE).save_changes(portfolio, tickers)
+
+    @staticmethod
+    def load_portfolio() -> Portfolio:
+        """
+        Load portfolio data from CSV file.
+
+        Returns:
+            Portfolio instance with loaded data
+        """
+        return CsvStorage(config.STOCKS_FILE).load_portfolio()
+
+    @staticmethod
+    def close() -> None:
+        """Nothing to release for plain CSV storage."""
+
+class JournalStorage(StorageBackend):
+    """
+    Snapshot plus append-only journal.
+
+    Each change appends one small record to the journal instead of
+    rewriting the snapshot. Records hold the full state of a holding, so
+    replaying one twice is harmless. Once the journal gets long it is
+    rotated aside and folded into the snapshot on a background thread.
+    """
+
+    def __init__(
+        self,
+        snapshot_file: Union[str, Path] = STOCKS_FILE,
+        journal_file: Union[str, Path] = JOURNAL_FILE,
+        compact_threshold: int = JOURNAL_COMPACT_THRESHOLD
+    ) -> None:
+        """
+        Initialize journaled storage.
+
+        Args:
+            snapshot_file: CSV snapshot of the portfolio
+            journal_file: Journal of changes since the snapshot
+            compact_threshold: Journal records before compaction starts
+        """
+        self._snapshot_file = Path(snapshot_file)
+        self._journal_file = Path(journal_file)
+        # Journal being folded into the snapshot
+        self._rotated_file = self._journal_file.with_name(self._journal_file.name + ".1")
+        self._compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._records = 0
+        self._compactor: Optional[threading.Thread] = None
+
+    @instrumentation.timed("storage.load_portfolio")
+    def load_portfolio(self) -> Portfolio:
+        """
+        Load the snapshot and replay the journal on top of it.
+
+        Returns:
+            Portfolio instance with loaded data
+        """
+        self._wait_for_compaction()
+        with self._lock:
+            holdings = self._read_snapshot()
+            self._replay(self._rotated_file, holdings)
+            self._records = self._replay(self._journal_file, holdings)
+
+        portfolio = Portfolio()
+        for stock in holdings.values():
+            portfolio.add_stock(stock)
+        logger.info(f"Portfolio loaded ({self._records} journal records replayed)")
+        return portfolio
+
+    @instrumentation.timed("storage.save_portfolio")
+    def save_portfolio(self, portfolio: Portfolio) -> None:
+        """
+        Write a full snapshot and start a fresh journal.
+
+        Args:
+            portfolio: Portfolio instance to save
+        """
+        self._wait_for_compaction()
+        with self._lock:
+            self.bytes_written += _write_holdings(
+                self._snapshot_file, portfolio.get_holdings().values()
+            )
+            for path in (self._rotated_file, self._journal_file):
+                if path.exists():
+                    path.unlink()
+            self._records = 0
+        logger.info("Portfolio snapshot saved")
+
+    @instrumentation.timed("storage.save_changes")
+    def save_changes(self, portfolio: Portfolio, tickers: Iterable[str]) -> None:
+        """
+        Append one journal record per changed holding.
+
+        Args:
+            portfolio: Portfolio the changes were made to
+            tickers: Tickers that were added, changed or removed
+        """
+        records: List[List] = []
+        for ticker in tickers:
+            stock = portfolio.get_stock(ticker)
+            if stock is None:
+                records.append(["del", ticker])
+            else:
+                records.append([
+                    "put",
+                    stock.ticker,
+                    stock.quantity,
+                    stock.price,
+                    stock.last_updated.isoformat()
+                ])
+        if not records:
+            return
+
+        with self._lock:
+            self._journal_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._journal_file, mode="a", newline="") as file:
+                start = file.tell()
+                csv.writer(file).writerows(records)
+                file.flush()
+                os.fsync(file.fileno())
+                self.bytes_written += file.tell() - start
+            self._records += len(records)
+            needs_compaction = self._records >= self._compact_threshold
+
+        if needs_compaction:
+            self.compact(wait=False)
+
+    def compact(self, wait: bool = True) -> None:
+        """
+        Fold the journal into the snapshot.
+
+        Args:
+            wait: Block until compaction finishes
+        """
+        with self._lock:
+            if self._compactor is None or not self._compactor.is_alive():
+                # A rotated journal left by a crash gets folded first
+                if not self._rotated_file.exists() and self._journal_file.exists():
+                    os.replace(self._journal_file, self._rotated_file)
+                    self._records = 0
+                if self._rotated_file.exists():
+                    self._compactor = threading.Thread(
+                        target=self._fold,
+                        name="journal-compactor",
+                        daemon=True
+                    )
+                    self._compactor.start()
+
+        if wait:
+            self._wait_for_compaction()
+
+    def close(self) -> None:
+        """Wait for any running compaction to finish."""
+        self._wait_for_compaction()
+
+    def _fold(self) -> None:
+        """Write snapshot + rotated journal as the new snapshot."""
+        try:
+            holdings = self._read_snapshot()
+            self._replay(self._rotated_file, holdings)
+            self.bytes_written += _write_holdings(self._snapshot_file, holdings.values())
+            # Only drop the rotated journal once the snapshot is safely in place
+            self._rotated_file.unlink()
+            logger.info("Journal compacted into snapshot")
+        except Exception as e:
+            logger.error(f"Error compacting journal: {e}")
+
+    def _wait_for_compaction(self) -> None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def _read_snapshot(self) -> Dict[str, Stock]:
+        try:
+            return {stock.ticker: stock for stock in _read_holdings(self._snapshot_file)}
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _replay(path: Path, holdings: Dict[str, Stock]) -> int:
+        """
+        Apply journal records to holdings.
+
+        Returns:
+            Number of records read
+        """
+        count = 0
+        try:
+            with open(path, mode="r", newline="") as file:
+                for record in csv.reader(file):
+                    count += 1
+                    try:
+                        if record[0] == "put":
+                            holdings[record[1]] = Stock(
+                                ticker=record[1],
+                                quantity=int(record[2]),
+                                price=float(record[3]),
+                                last_updated=datetime.fromisoformat(record[4])
+                            )
+                        elif record[0] == "del":
+                            holdings.pop(record[1], None)
+                        else:
+                            raise ValueError(f"unknown operation {record[0]!r}")
+                    except (ValueError, IndexError) as e:
+                        # Most likely a record cut short by a crash
+                        logger.error(f"Skipping journal record {record}: {e}")
+        except FileNotFoundError:
+            pass
+        return count
+
+class SqliteStorage(StorageBackend):
+    """
+    Holdings in an SQLite table keyed on ticker.
+
+    Single holdings are upserted or deleted instead of rewriting
+    everything. WAL mode lets other processes read while this one writes.
+    """
+
+    _UPSERT = (
+        "INSERT INTO holdings (ticker, quantity, price, last_updated) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(ticker) DO UPDATE SET quantity = excluded.quantity, "
+        "price = excluded.price, last_updated = excluded.last_updated"
+    )
+    _DELETE = "DELETE FROM holdings WHERE ticker = ?"
+    _SELECT_ONE = "SELECT ticker, quantity, price, last_updated FROM holdings WHERE ticker = ?"
+    _SELECT_ALL = "SELECT ticker, quantity, price, last_updated FROM holdings"
+
+    def __init__(self, path: Union[str, Path] = SQLITE_FILE) -> None:
+        """
+        Open (and create if needed) the database.
+
+        Args:
+            path: SQLite database file
+        """
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        # Parameterized statements are compiled once and reused from the
+        # connection's statement cache
+        self._conn = db.connect(self._path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS holdings ("
+                "ticker TEXT PRIMARY KEY, "
+                "quantity INTEGER NOT NULL, "
+                "price REAL NOT NULL, "
+                "last_updated TEXT NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    @staticmethod
+    def _row(stock: Stock) -> tuple:
+        return (stock.ticker, stock.quantity, stock.price, stock.last_updated.isoformat())
+
+    @staticmethod
+    def _payload_size(rows: List[tuple]) -> int:
+        """Approximate bytes written for rows (page overhead isn't counted)."""
+        return sum(len(value) if isinstance(value, str) else 8 for row in rows for value in row)
+
+    @staticmethod
+    def _stock(row: tuple) -> Stock:
+        return Stock(
+            ticker=row[0],
+            quantity=row[1],
+            price=row[2],
+            last_updated=datetime.fromisoformat(row[3])
+        )
+
+    @instrumentation.timed("storage.load_portfolio")
+    def load_portfolio(self) -> Portfolio:
+        """Load every holding from the database."""
+        portfolio = Portfolio()
+        with self._lock:
+            rows = self._conn.execute(self._SELECT_ALL).fetchall()
+        for row in rows:
+            try:
+                portfolio.add_stock(self._stock(row))
+            except ValueError as e:
+                logger.error(f"Error parsing row {row}: {e}")
+        logger.info("Portfolio loaded successfully")
+        return portfolio
+
+    @instrumentation.timed("storage.save_portfolio")
+    def save_portfolio(self, portfolio: Portfolio) -> None:
+        """Replace every saved holding in one transaction."""
+        rows = [self._row(stock) for stock in portfolio.get_holdings().values()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM holdings")
+            self._conn.executemany(self._UPSERT, rows)
+            self.bytes_written += self._payload_size(rows)
+        logger.info("Portfolio saved successfully")
+
+    @instrumentation.timed("storage.save_changes")
+    def save_changes(self, portfolio: Portfolio, tickers: Iterable[str]) -> None:
+        """Upsert or delete only the changed holdings."""
+        upserts = []
+        deletes = []
+        for ticker in tickers:
+            stock = portfolio.get_stock(ticker)
+            if stock is None:
+                deletes.append((ticker,))
+            else:
+                upserts.append(self._row(stock))
+
+        with self._lock, self._conn:
+            if upserts:
+                self._conn.executemany(self._UPSERT, upserts)
+            if deletes:
+                self._conn.executemany(self._DELETE, deletes)
+            self.bytes_written += self._payload_size(upserts) + self._payload_size(deletes)
+
+    def get_stock(self, ticker: str) -> Optional[Stock]:
+        """Look up one holding by its primary key."""
+        with self._lock:
+            row = self._conn.execute(self._SELECT_ONE, (ticker,)).fetchone()
+        return self._stock(row) if row else None
+
+    def migrate_from_csv(self, csv_path: Union[str, Path] = STOCKS_FILE) -> int:
+        """
+        Import holdings from the CSV file, once.
+
+        Later calls do nothing, so it's safe to call on every start.
+
+        Args:
+            csv_path: CSV file to import
+
+        Returns:
+            Number of holdings imported
+        """
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_from_csv'"
+            ).fetchone()
+        if done:
+            return 0
+
+        portfolio = CsvStorage(csv_path).load_portfolio()
+        holdings = portfolio.get_holdings()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                self._UPSERT,
+                (self._row(stock) for stock in holdings.values())
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_csv', ?)",
+                (str(csv_path),)
+            )
+        logger.info(f"Migrated {len(holdings)} holdings from {csv_path}")
+        return len(holdings)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+class WriteBehindStorage(StorageBackend):
+    """
+    Collects saves and writes them to another backend in the background.
+
+    save_changes and save_portfolio only copy the changed holdings and
+    return. The first unsaved change opens a `delay` second window, and
+    everything saved before it ends goes to the backend in one write, so
+    a burst of edits costs one write instead of one each. flush() writes
+    straight away for changes that must be on disk; close() and
+    interpreter exit flush too.
+
+    The backend is handed the writer's own copy of the holdings, never
+    the live portfolio, so the portfolio can keep changing on its thread
+    while a write runs.
+
+    A failed background write keeps its changes and is retried, waiting
+    twice as long after each consecutive failure, up to max_retry_delay.
+
+    Attributes:
+        writes: Writes made to the backend so far
+        failures: Consecutive failed writes
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        delay: float = SAVE_DELAY,
+        max_retry_delay: float = SAVE_MAX_RETRY_DELAY
+    ) -> None:
+        """
+        Initialize the wrapper.
+
+        Args:
+            backend: Storage that does the writing
+            delay: Seconds to collect changes before writing them
+            max_retry_delay: Longest wait before retrying a failed write
+        """
+        self._backend = backend
+        self._delay = delay
+        self._max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        # Ticker -> copy of the holding to write, or None to delete it
+        self._pending: Dict[str, Optional[Stock]] = {}
+        self._replace_all = False
+        self._timer: Optional[threading.Timer] = None
+        # Held for the whole of a write, so writes go out in order
+        self._write_lock = threading.Lock()
+        # What the backend holds, loaded on the first incremental write
+        self._saved: Optional[Portfolio] = None
+        self.writes = 0
+        self.failures = 0
+        atexit.register(self._flush_at_exit)
+
+    @property
+    def bytes_written(self) -> int:
+        return self._backend.bytes_written
+
+    def load_portfolio(self) -> Portfolio:
+        """Load from the backend, including changes not written yet."""
+        self.flush()
+        with self._write_lock:
+            self._saved = None
+        return self._backend.load_portfolio()
+
+    def save_portfolio(self, portfolio: Portfolio) -> None:
+        """Replace everything saved with the portfolio, in the next write."""
+        # A full replace needs every holding; copy them before returning
+        holdings = portfolio.get_holdings()
+        with self._lock:
+            self._pending = {ticker: replace(stock) for ticker, stock in holdings.items()}
+            self._replace_all = True
+            self._schedule()
+
+    def save_changes(self, portfolio: Portfolio, tickers: Iterable[str]) -> None:
+        """Note changed holdings for the next write."""
+        changed = {}
+        for ticker in tickers:
+            stock = portfolio.get_stock(ticker)
+            changed[ticker] = replace(stock) if stock is not None else None
+        with self._lock:
+            self._pending.update(changed)
+            self._schedule()
+
+    def get_stock(self, ticker: str) -> Optional[Stock]:
+        """Look up one holding, as it will be once pending changes are written."""
+        with self._lock:
+            if ticker in self._pending:
+                stock = self._pending[ticker]
+                return replace(stock) if stock is not None else None
+            if self._replace_all:
+                return None
+        return self._backend.get_stock(ticker)
+
+    @property
+    def dirty(self) -> bool:
+        """True if there are changes not written yet."""
+        with self._lock:
+            return bool(self._pending) or self._replace_all
+
+    def flush(self) -> None:
+        """
+        Write pending changes now and wait for the write.
+
+        Raises:
+            Exception: Whatever the backend raised; the changes stay
+                pending and are tried again on the next write
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._write()
+
+    def close(self) -> None:
+        """Write pending changes, then close the backend."""
+        atexit.unregister(self._flush_at_exit)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Unsaved changes lost on close: {e}")
+        finally:
+            self._backend.close()
+
+    def _schedule(self) -> None:
+        """Start the write timer if it isn't running (the caller holds the lock)."""
+        if self._timer is None:
+            delay = min(self._delay * 2 ** self.failures, self._max_retry_delay)
+            self._timer = threading.Timer(delay, self._write_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _write_in_background(self) -> None:
+        try:
+            self._write()
+        except Exception as e:
+            logger.error(f"Error saving portfolio: {e}")
+
+    @staticmethod
+    def _copy(stocks: Iterable[Stock]) -> Portfolio:
+        """Portfolio of copies of some holdings."""
+        portfolio = Portfolio()
+        for stock in stocks:
+            portfolio.add_stock(replace(stock))
+        return portfolio
+
+    def _write(self) -> None:
+        """Write everything pending to the backend as one save."""
+        with self._write_lock:
+            with self._lock:
+                self._timer = None
+                pending, self._pending = self._pending, {}
+                replace_all, self._replace_all = self._replace_all, False
+            if not pending and not replace_all:
+                return
+
+            try:
+                if replace_all:
+                    saved = self._copy(stock for stock in pending.values() if stock is not None)
+                    self._backend.save_portfolio(saved)
+                else:
+                    if self._saved is None:
+                        # Nothing was loaded through us; start from what's on disk
+                        self._saved = self._backend.load_portfolio()
+                    saved = self._saved
+                    for ticker, stock in pending.items():
+                        if saved.get_stock(ticker) is not None:
+                            saved.remove_stock(ticker)
+                        if stock is not None:
+                            saved.add_stock(replace(stock))
+                    self._backend.save_changes(saved, list(pending))
+            except Exception:
+                # Keep the changes for the next write; newer ones win
+                with self._lock:
+                    self._pending = {**pending, **self._pending}
+                    self._replace_all = self._replace_all or replace_all
+                    self.failures += 1
+                    self._schedule()
+                raise
+            self._saved = saved
+            self.writes += 1
+            self.failures = 0
+
+    def _flush_at_exit(self) -> None:
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Unsaved changes lost at exit: {e}")
+
+def create_storage(mode: str = STORAGE_MODE) -> StorageBackend:
+    """
+    Create the storage backend for a mode.
+
+    Args:
+        mode: "csv", "journal" or "sqlite"
+
+    Returns:
+        StorageBackend instance
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    if mode == "csv":
+        return CsvStorage()
+    if mode == "journal":
+        return JournalStorage()
+    if mode == "sqlite":
+        storage = SqliteStorage()
+        storage.migrate_from_csv()
+        return storage
+    raise ValueError(f"Unknown storage mode: {mode}")
@@ -0,0 +1,265 @@
+"""
+Live quote streaming for the stock importer application.
+
+Instead of polling every holding, QuoteStream keeps one TCP connection
+to a quote server that pushes ticks for the subscribed tickers. The
+protocol is newline-delimited JSON:
+
+    client: {"subscribe": ["AAPL", "MSFT"]}  {"unsubscribe": ["MSFT"]}
+    server: {"ticks": [["AAPL", 187.25], ["MSFT", 402.1]]}
+
+Ticks land in a TickBuffer that keeps only the latest price per ticker.
+The thread that owns the portfolio drains it on its own schedule (the
+GUI at most STREAM_MAX_FPS times a second) and applies everything since
+the last drain with one set_prices call, so a burst of thousands of
+ticks costs one batch of table updates rather than thousands.
+
+fake_server.FakeTickServer speaks the same protocol for testing.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import json
+import logging
+import math
+import socket
+import threading
+from models import Portfolio
+from config import QUOTE_STREAM_ADDRESS, STREAM_RECONNECT_DELAY
+
+logger = logging.getLogger(__name__)
+
+def _valid_ticks(ticks) -> List[Tuple[str, float]]:
+    """Keep the (ticker, price) pairs with a finite, positive price; drop the rest."""
+    valid = []
+    for tick in ticks:
+        if not isinstance(tick, (list, tuple)) or len(tick) != 2:
+            continue
+        ticker, price = tick
+        if (
+            isinstance(ticker, str)
+            and isinstance(price, (int, float))
+            and not isinstance(price, bool)
+            and math.isfinite(price)
+            and price > 0
+        ):
+            valid.append((ticker, float(price)))
+    return valid
+
+class TickBuffer:
+    """
+    Latest streamed price per ticker, shared between the reader thread
+    and whoever applies the prices.
+
+    Attributes:
+        received: Ticks put in so far
+        merged: Ticks replaced by a newer one before they were drained
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latest: Dict[str, float] = {}
+        self.received = 0
+        self.merged = 0
+
+    def put_many(self, ticks: Iterable[Tuple[str, float]]) -> None:
+        """Store ticks, each replacing any undrained one for its ticker."""
+        with self._lock:
+            latest = self._latest
+            before = len(latest)
+            count = 0
+            for ticker, price in ticks:
+                latest[ticker] = price
+                count += 1
+            self.received += count
+            self.merged += count - (len(latest) - before)
+
+    def drain(self) -> Dict[str, float]:
+        """Take the latest price of every ticker that ticked since the last drain."""
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        return latest
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._latest)
+
+class QuoteStream:
+    """
+    Client for a streaming quote server.
+
+    Reads on a background thread and reconnects (re-sending its
+    subscriptions) if the connection drops. subscribe, unsubscribe and
+    apply can be called from any thread.
+
+    Attributes:
+        buffer: Where incoming ticks are merged
+    """
+
+    def __init__(
+        self,
+        address: str = QUOTE_STREAM_ADDRESS,
+        buffer: Optional[TickBuffer] = None,
+        reconnect_delay: float = STREAM_RECONNECT_DELAY
+    ) -> None:
+        """
+        Initialize the client (call start() to connect).
+
+        Args:
+            address: Server as "host:port"
+            buffer: Buffer to merge ticks into (defaults to a new one)
+            reconnect_delay: Seconds to wait before reconnecting
+        """
+        host, _, port = address.rpartition(":")
+        self._address = (host or "127.0.0.1", int(port))
+        self.buffer = buffer if buffer is not None else TickBuffer()
+        self._reconnect_delay = reconnect_delay
+        # Guards the socket and the subscriptions, and keeps sends whole
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._tickers: Set[str] = set()
+        self._connected = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def connected(self) -> bool:
+        """True while connected to the server."""
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """Wait until connected; False if the timeout ran out first."""
+        return self._connected.wait(timeout)
+
+    def start(self) -> "QuoteStream":
+        """Connect and start reading on a background thread."""
+        self._thread = threading.Thread(target=self._run, name="quote-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def subscribe(self, tickers: Iterable[str]) -> None:
+        """Start receiving ticks for tickers (kept across reconnects)."""
+        with self._lock:
+            new = [t for t in dict.fromkeys(tickers) if t not in self._tickers]
+            if new:
+                self._tickers.update(new)
+                self._send({"subscribe": new})
+
+    def unsubscribe(self, tickers: Iterable[str]) -> None:
+        """Stop receiving ticks for tickers."""
+        with self._lock:
+            gone = [t for t in dict.fromkeys(tickers) if t in self._tickers]
+            if gone:
+                self._tickers.difference_update(gone)
+                self._send({"unsubscribe": gone})
+
+    def _send(self, message: Dict) -> None:
+        """Send one message if connected (the caller holds the lock)."""
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendall(json.dumps(message).encode() + b"\n")
+        except OSError as e:
+            # The reader sees the broken connection and reconnects
+            logger.warning(f"Could not send to quote stream: {e}")
+
+    def _run(self) -> None:
+        """Connect, read until the connection drops, and repeat until closed."""
+        while not self._closed.is_set():
+            try:
+                sock = socket.create_connection(self._address, timeout=self._reconnect_delay)
+            except OSError as e:
+                logger.warning(f"Could not connect to quote stream at {self._address}: {e}")
+                self._closed.wait(self._reconnect_delay)
+                continue
+
+            sock.settimeout(None)
+            with self._lock:
+                self._sock = sock
+                if self._tickers:
+                    self._send({"subscribe": sorted(self._tickers)})
+            self._connected.set()
+            try:
+                self._read(sock)
+            except (OSError, ValueError) as e:
+                if not self._closed.is_set():
+                    logger.warning(f"Quote stream dropped: {e}")
+            finally:
+                self._connected.clear()
+                with self._lock:
+                    self._sock = None
+                sock.close()
+            self._closed.wait(self._reconnect_delay)
+
+    def _read(self, sock: socket.socket) -> None:
+        """Merge ticks into the buffer until the server hangs up."""
+        put_many = self.buffer.put_many
+        with sock.makefile("rb") as lines:
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipped a malformed quote stream message")
+                    continue
+                ticks = message.get("ticks") if isinstance(message, dict) else None
+                if not isinstance(ticks, list):
+                    continue
+                valid = _valid_ticks(ticks)
+                if len(valid) < len(ticks):
+                    logger.warning(f"Dropped {len(ticks) - len(valid)} malformed ticks")
+                if valid:
+                    put_many(valid)
+
+    def apply(self, portfolio: Portfolio, when: Optional[datetime] = None) -> List[str]:
+        """
+        Apply every price that arrived since the last call, as one batch.
+
+        Call this from the thread that owns the portfolio. Ticks for
+        tickers that aren't held are dropped; the rest also go into the
+        portfolio's price history if it has one.
+
+        Args:
+            portfolio: Holdings to update
+            when: Time of the update (defaults to now)
+
+        Returns:
+            Held tickers that had a new tick
+        """
+        latest = self.buffer.drain()
+        tickers = [t for t in latest if portfolio._has(t)]
+        if not tickers:
+            return []
+        prices = [latest[t] for t in tickers]
+        when = when or datetime.now()
+        portfolio.set_prices(tickers, prices, when)
+        if portfolio.history is not None:
+            portfolio.history.record_many(tickers, prices, when)
+        return tickers
+
+    def close(self) -> None:
+        """Disconnect and wait for the reader thread to stop."""
+        self.stop()
+        self.join()
+
+    def stop(self) -> None:
+        """Tell the reader thread to disconnect and stop, without waiting for it."""
+        self._closed.set()
+        with self._lock:
+            sock = self._sock
+        if sock is not None:
+            try:
+                # Wakes the reader, which closes the socket
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def join(self) -> bool:
+        """
+        Wait for the reader thread to stop after stop().
+
+        Returns:
+            False if it was still running after reconnect_delay + 1 seconds
+        """
+        if self._thread is None:
+            return True
+        self._thread.join(timeout=self._reconnect_delay + 1.0)
+        return not self._thread.is_alive()
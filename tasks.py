@@ -0,0 +1,111 @@
+"""
+Background jobs for the stock importer application.
+
+Tkinter widgets may only be touched from the thread running the mainloop,
+so slow work (price fetches) runs on a worker thread and reports back
+through a queue. The GUI drains that queue from an `after()` callback.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Job:
+    """A unit of background work with progress reporting and cancellation."""
+
+    def __init__(self) -> None:
+        """Initialize a job that hasn't been submitted yet."""
+        self.cancel_event = threading.Event()
+        self._progress: "queue.Queue[Any]" = queue.Queue()
+        self._future: Optional[Future] = None
+
+    def report_progress(self, item: Any) -> None:
+        """Queue a progress item for the UI thread (called from the worker)."""
+        self._progress.put(item)
+
+    def drain(self, limit: Optional[int] = None) -> List[Any]:
+        """
+        Take queued progress items without blocking.
+
+        Args:
+            limit: Maximum number of items to take, so one UI tick stays short
+
+        Returns:
+            Progress items in the order they were reported
+        """
+        items = []
+        while limit is None or len(items) < limit:
+            try:
+                items.append(self._progress.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def cancel(self) -> None:
+        """Ask the job to stop. The worker decides when to honour it."""
+        self.cancel_event.set()
+        if self._future is not None:
+            self._future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        """True if cancel() was called."""
+        return self.cancel_event.is_set()
+
+    @property
+    def done(self) -> bool:
+        """True once the worker has finished and every progress item is drained."""
+        return self._future is not None and self._future.done() and self._progress.empty()
+
+    def result(self) -> Any:
+        """
+        Get the job's return value.
+
+        Raises:
+            Whatever the job raised, or CancelledError if it never started
+        """
+        if self._future is None:
+            raise RuntimeError("Job was never submitted")
+        return self._future.result()
+
+class BackgroundRunner:
+    """Runs jobs on a small pool of worker threads."""
+
+    def __init__(self, max_workers: int = 2) -> None:
+        """
+        Initialize the runner.
+
+        Args:
+            max_workers: Number of worker threads
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="stock-worker"
+        )
+        self._jobs: List[Job] = []
+
+    def submit(self, fn: Callable[[Job], Any]) -> Job:
+        """
+        Run `fn(job)` on a worker thread.
+
+        Args:
+            fn: Function taking the Job, so it can report progress and check
+                job.cancel_event
+
+        Returns:
+            The Job to poll from the UI thread
+        """
+        job = Job()
+        job._future = self._executor.submit(fn, job)
+        self._jobs = [j for j in self._jobs if not j.done]
+        self._jobs.append(job)
+        return job
+
+    def shutdown(self) -> None:
+        """Cancel every running job and stop the workers without waiting."""
+        for job in self._jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
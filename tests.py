@@ -11,14 +11,43 @@ import os
 import tempfile
 import shutil
 import logging
+import threading
+import warnings
+import numpy as np
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
 
 # Import your application modules
-from models import Stock, Portfolio
-from storage import StorageManager
+from models import Stock, Portfolio, ADDED, REMOVED, PRICE_CHANGED, QUANTITY_CHANGED
+from columnar import ColumnarPortfolio
+from loader import iter_chunks, load_portfolio, LoadReport
+from snapshot import SnapshotReader, SnapshotError, open_fresh, snapshot_path, write_snapshot
+from storage import StorageManager, JournalStorage, SqliteStorage, CsvStorage, WriteBehindStorage
 from auth import CredentialManager
-from config import DEFAULT_USERNAME, DEFAULT_PASSWORD, CREDENTIALS_FILE
+from config import (
+    DEFAULT_USERNAME, DEFAULT_PASSWORD, CREDENTIALS_FILE, AUTO_REFRESH_INTERVAL,
+    AUTO_REFRESH_MAX_INTERVAL, AUTO_REFRESH_CLOSE_GRACE
+)
+from refresh import BatchRefresher
+from providers import FakePriceProvider, HttpPriceProvider, RateLimitedError, YFinanceProvider, create_provider
+from cache import QuoteCache, QuoteStore, CachingPriceProvider
+from tasks import BackgroundRunner
+from viewport import SlotCache, format_row, visible_range
+import cli
+import bench
+import instrumentation
+from history import HistoryStore
+import analytics
+from quote_client import AsyncQuoteClient, QuoteClient, TokenBucket
+from fake_server import FakeQuoteServer, FakeTickServer
+from ledger import Ledger, Transaction, iter_transactions
+from indexes import HoldingsIndex, SortedList
+from metadata import MetadataStore, INFO
+from streaming import QuoteStream, TickBuffer
+from scheduler import (
+    ASX, CRYPTO, EURONEXT, LSE, SIX, TSE, UNKNOWN, US, XETRA, RefreshScheduler, exchange_for
+)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -173,6 +202,762 @@ class TestPortfolio(unittest.TestCase):
         self.portfolio.add_stock(Stock("GOOGL", 5, 200.0))
         self.assertEqual(self.portfolio.get_total_value(), 2500.0)
 
+    def test_update_prices(self):
+        """Test refreshing prices through a fake quote source."""
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.portfolio.add_stock(Stock("BAD", 1, 5.0))
+
+        report = self.portfolio.update_prices(FakePriceProvider({"AAPL": 155.0}))
+
+        holdings = self.portfolio.get_holdings()
+        self.assertEqual(holdings["AAPL"].price, 155.0)
+        # Failed tickers keep their old price
+        self.assertEqual(holdings["BAD"].price, 5.0)
+        self.assertEqual(report.succeeded, ["AAPL"])
+        self.assertIn("BAD", report.failed)
+
+class TestColumnarPortfolio(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.portfolio = ColumnarPortfolio(capacity=1)
+
+    def test_add_and_total(self):
+        """Test adding stocks grows the arrays and totals match."""
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.portfolio.add_stock(Stock("GOOGL", 5, 200.0))
+        self.portfolio.add_stock(Stock("AAPL", 5, 160.0))
+
+        holdings = self.portfolio.get_holdings()
+        self.assertEqual(holdings["AAPL"].quantity, 15)
+        self.assertEqual(holdings["AAPL"].price, 160.0)
+        self.assertEqual(self.portfolio.get_total_value(), 15 * 160.0 + 1000.0)
+
+    def test_add_many(self):
+        """Test bulk adds sum repeated tickers."""
+        self.portfolio.add_many(["A", "B", "A"], [1, 2, 3], [10.0, 20.0, 10.0])
+        self.assertEqual(self.portfolio.get_stock("A").quantity, 4)
+        self.assertEqual(len(self.portfolio), 2)
+        self.assertEqual(list(self.portfolio.holding_values()), [40.0, 40.0])
+
+    def test_remove_stock(self):
+        """Test removing moves the last row into the gap."""
+        for ticker in ["A", "B", "C"]:
+            self.portfolio.add_stock(Stock(ticker, 1, 1.0))
+        self.portfolio.remove_stock("A")
+
+        self.assertEqual(sorted(self.portfolio.get_tickers()), ["B", "C"])
+        self.assertEqual(self.portfolio.get_stock("C").quantity, 1)
+        with self.assertRaises(KeyError):
+            self.portfolio.remove_stock("A")
+
+    def test_update_prices(self):
+        """Test refreshed prices are applied to the arrays."""
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.portfolio.add_stock(Stock("BAD", 1, 5.0))
+        self.portfolio.update_prices(FakePriceProvider({"AAPL": 155.0}))
+
+        self.assertEqual(self.portfolio.get_stock("AAPL").price, 155.0)
+        self.assertEqual(self.portfolio.get_stock("BAD").price, 5.0)
+
+    def test_from_portfolio(self):
+        """Test copying a dict-backed portfolio."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        portfolio.add_stock(Stock("GOOGL", 5, 200.0))
+        columnar = ColumnarPortfolio.from_portfolio(portfolio)
+        self.assertEqual(columnar.get_total_value(), portfolio.get_total_value())
+
+class TestPortfolioEvents(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.events = []
+
+    def subscribed(self, portfolio):
+        """Subscribe the test's event list to a portfolio."""
+        portfolio.subscribe(self.events.append)
+        return portfolio
+
+    def test_running_total(self):
+        """Test the running total follows every kind of change, for both portfolios."""
+        for portfolio in (Portfolio(), ColumnarPortfolio(capacity=1)):
+            portfolio.add_stock(Stock("AAPL", 10, 150.0))
+            portfolio.add_stock(Stock("GOOGL", 5, 200.0))
+            portfolio.add_stock(Stock("AAPL", 5, 160.0))
+            portfolio.set_prices(["GOOGL", "MISSING"], [210.0, 1.0])
+            self.assertEqual(portfolio.get_total_value(), 15 * 160.0 + 5 * 210.0)
+            self.assertEqual(portfolio.get_holding_value("GOOGL"), 1050.0)
+
+            portfolio.remove_stock("AAPL")
+            self.assertEqual(portfolio.get_total_value(), 1050.0)
+            portfolio.remove_stock("GOOGL")
+            self.assertEqual(portfolio.get_total_value(), 0.0)
+
+    def test_single_changes(self):
+        """Test changes outside a batch notify right away with old and new values."""
+        portfolio = self.subscribed(Portfolio())
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        portfolio.add_stock(Stock("AAPL", 5, 160.0))
+        portfolio.remove_stock("AAPL")
+
+        kinds = [list(e.changes.values())[0].kind for e in self.events]
+        self.assertEqual(kinds, [ADDED, QUANTITY_CHANGED, REMOVED])
+        merged = self.events[1].changes["AAPL"]
+        self.assertEqual((merged.old_quantity, merged.new_quantity), (10, 15))
+        self.assertEqual((merged.old_price, merged.new_price), (150.0, 160.0))
+        self.assertTrue(self.events[2].structural)
+        self.assertEqual(self.events[2].total_value, 0.0)
+
+    def test_refresh_is_one_notification(self):
+        """Test apply_prices sends one event holding only the prices that moved."""
+        for portfolio in (Portfolio(), ColumnarPortfolio()):
+            self.events.clear()
+            for ticker in ["A", "B", "C"]:
+                portfolio.add_stock(Stock(ticker, 2, 10.0))
+            self.subscribed(portfolio)
+
+            portfolio.update_prices(FakePriceProvider({"A": 11.0, "B": 10.0}))
+
+            self.assertEqual(len(self.events), 1)
+            event = self.events[0]
+            self.assertFalse(event.structural)
+            self.assertEqual(event.tickers(PRICE_CHANGED), ["A"])
+            self.assertEqual(event.changes["A"].old_value, 20.0)
+            self.assertEqual(event.changes["A"].new_value, 22.0)
+            self.assertEqual(event.total_value, 62.0)
+
+    def test_batch_coalesces(self):
+        """Test a batch reports the net change per ticker."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("A", 1, 10.0))
+        self.subscribed(portfolio)
+
+        with portfolio.batch():
+            portfolio.set_prices(["A"], [11.0])
+            portfolio.set_prices(["A"], [12.0])
+            portfolio.add_stock(Stock("B", 1, 5.0))
+            portfolio.remove_stock("B")
+            self.assertEqual(self.events, [])
+
+        self.assertEqual(len(self.events), 1)
+        change = self.events[0].changes["A"]
+        self.assertEqual((change.kind, change.old_price, change.new_price), (PRICE_CHANGED, 10.0, 12.0))
+        # Added and removed again inside the batch: no net change
+        self.assertNotIn("B", self.events[0].changes)
+
+    def test_columnar_add_many_events(self):
+        """Test bulk adds report new and existing rows correctly."""
+        portfolio = ColumnarPortfolio()
+        portfolio.add_stock(Stock("A", 1, 10.0))
+        self.subscribed(portfolio)
+        portfolio.add_many(["A", "B", "B"], [1, 2, 3], [10.0, 5.0, 5.0])
+
+        self.assertEqual(len(self.events), 1)
+        changes = self.events[0].changes
+        self.assertEqual(changes["A"].kind, QUANTITY_CHANGED)
+        self.assertEqual((changes["B"].kind, changes["B"].new_quantity), (ADDED, 5))
+        self.assertEqual(portfolio.get_total_value(), 45.0)
+
+    def test_unsubscribe_and_failing_subscriber(self):
+        """Test one broken subscriber doesn't stop the others."""
+        portfolio = Portfolio()
+        broken = MagicMock(side_effect=RuntimeError("boom"))
+        portfolio.subscribe(broken)
+        self.subscribed(portfolio)
+        portfolio.add_stock(Stock("A", 1, 10.0))
+        self.assertEqual(len(self.events), 1)
+
+        portfolio.unsubscribe(self.events.append)
+        portfolio.remove_stock("A")
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(broken.call_count, 2)
+
+class TestHoldingsIndex(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.portfolio = Portfolio()
+        for ticker, quantity, price in [("MSFT", 1, 300.0), ("AAPL", 10, 150.0), ("AMZN", 2, 100.0)]:
+            self.portfolio.add_stock(Stock(ticker, quantity, price, datetime(2024, 1, 1)))
+        self.index = HoldingsIndex(self.portfolio)
+
+    def test_sorted_list(self):
+        """Test the bucketed list stays sorted across bucket splits."""
+        with patch("indexes.BUCKET_SIZE", 4):
+            items = SortedList()
+            for n in [5, 1, 9, 3, 7, 2, 8, 6, 4, 0]:
+                items.add(n)
+            items.remove(5)
+            self.assertEqual(list(items), [0, 1, 2, 3, 4, 6, 7, 8, 9])
+            self.assertEqual(list(items.islice(3, 7)), [3, 4, 6, 7])
+            self.assertEqual(items.bisect_left(6), 5)
+            with self.assertRaises(ValueError):
+                items.remove(5)
+
+    def test_sort_orders(self):
+        """Test views in each order, both directions."""
+        self.assertEqual(self.index.view("ticker")[:3], ["AAPL", "AMZN", "MSFT"])
+        self.assertEqual(self.index.view("value", descending=True)[:3], ["AAPL", "MSFT", "AMZN"])
+        self.assertEqual(self.index.view("price")[1:], ["AAPL", "MSFT"])
+        with self.assertRaises(ValueError):
+            self.index.view("colour")
+
+    def test_follows_changes(self):
+        """Test live views see adds, removes and price changes."""
+        by_value = self.index.view("value")
+        by_time = self.index.view("last_updated")
+        self.portfolio.set_prices(["AMZN"], [1000.0], datetime(2024, 1, 2))
+        self.portfolio.add_stock(Stock("ABNB", 1, 1.0, datetime(2024, 1, 3)))
+        self.portfolio.remove_stock("MSFT")
+
+        self.assertEqual(by_value[:len(by_value)], ["ABNB", "AAPL", "AMZN"])
+        self.assertEqual(by_time[:len(by_time)], ["AAPL", "AMZN", "ABNB"])
+        self.assertEqual(len(self.index), 3)
+
+    def test_bulk_refresh_rebuilds(self):
+        """Test a refresh touching most holdings gives the same order as a fresh index."""
+        self.portfolio.update_prices(FakePriceProvider(seed=3))
+        fresh = HoldingsIndex(self.portfolio)
+        self.assertEqual(self.index.view("price")[:3], fresh.view("price")[:3])
+
+    def test_prefix_search(self):
+        """Test prefix search and filtered views."""
+        self.assertEqual(self.index.search("A"), ["AAPL", "AMZN"])
+        self.assertEqual(self.index.search("AM"), ["AMZN"])
+        self.assertEqual(self.index.search("Z"), [])
+        filtered = self.index.view("value", descending=True, prefix="A")
+        self.assertEqual(filtered[:len(filtered)], ["AAPL", "AMZN"])
+
+        self.portfolio.add_stock(Stock("ADBE", 100, 500.0))
+        self.assertEqual(filtered[:1], ["ADBE"])
+
+def new_york(*args) -> float:
+    """Epoch seconds of a New York wall-clock time."""
+    return datetime(*args, tzinfo=ZoneInfo("America/New_York")).timestamp()
+
+class TestRefreshScheduler(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.now = new_york(2025, 7, 7, 10, 0)  # A Monday
+        self.portfolio = Portfolio()
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.portfolio.add_stock(Stock("MSFT", 1, 300.0))
+        self.provider = FakePriceProvider({"AAPL": 150.0, "MSFT": 300.0})
+        self.scheduler = RefreshScheduler(self.portfolio, clock=lambda: self.now)
+
+    def test_calendars(self):
+        """Test sessions, weekends, holidays and lunch breaks."""
+        self.assertTrue(US.is_open(datetime.fromtimestamp(new_york(2025, 7, 7, 15, 59), timezone.utc)))
+        self.assertFalse(US.is_open(datetime.fromtimestamp(new_york(2025, 7, 7, 16, 0), timezone.utc)))
+        self.assertFalse(US.is_trading_day(date(2025, 7, 5)))  # Saturday
+        self.assertFalse(US.is_trading_day(date(2025, 4, 18)))  # Good Friday
+        self.assertFalse(US.is_trading_day(date(2026, 7, 3)))  # July 4th observed
+        self.assertFalse(LSE.is_trading_day(date(2021, 12, 28)))  # Boxing Day, rolled forward
+        lunch = datetime(2025, 7, 7, 12, 0, tzinfo=ZoneInfo("Asia/Tokyo"))
+        start, _ = TSE.session(lunch)
+        self.assertFalse(TSE.is_open(lunch))
+        self.assertEqual((start.hour, start.minute), (12, 30))
+        self.assertIs(exchange_for("VOD.L"), LSE)
+        self.assertIs(exchange_for("SAP", "GER"), XETRA)
+        self.assertIs(exchange_for("BTC-USD"), CRYPTO)
+        self.assertIs(exchange_for("BRK-B"), US)
+        self.assertIs(exchange_for("MC.PA"), EURONEXT)
+        self.assertIs(exchange_for("NESN.SW"), SIX)
+        self.assertIs(exchange_for("BHP.AX"), ASX)
+        self.assertFalse(EURONEXT.is_trading_day(date(2025, 5, 1)))
+        self.assertFalse(SIX.is_trading_day(date(2025, 8, 1)))
+        self.assertFalse(ASX.is_trading_day(date(2025, 1, 27)))  # Australia Day, rolled forward
+        self.assertIs(exchange_for("ENI.MI"), UNKNOWN)
+
+    def test_unknown_exchange_fixed_interval(self):
+        """Test a ticker on an unknown exchange is polled at the plain interval, even at night."""
+        self.now = new_york(2025, 7, 5, 23, 0)  # Saturday night
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("ENI.MI", 1, 15.0))
+        scheduler = RefreshScheduler(portfolio, clock=lambda: self.now)
+        provider = FakePriceProvider({"ENI.MI": 15.0})
+        for _ in range(3):
+            self.assertEqual(list(scheduler.tick(provider=provider).results), ["ENI.MI"])
+            self.assertEqual(scheduler.due_at("ENI.MI"), self.now + AUTO_REFRESH_INTERVAL)
+            self.now += AUTO_REFRESH_INTERVAL
+
+    def test_open_market_polling(self):
+        """Test holdings are due at once, then on their interval while open."""
+        report = self.scheduler.tick(provider=self.provider)
+        self.assertEqual(sorted(report.results), ["AAPL", "MSFT"])
+        self.assertIsNone(self.scheduler.tick(provider=self.provider))
+
+        # Unchanged prices stretch the interval
+        self.assertEqual(self.scheduler.due_at("AAPL"), self.now + 1.5 * AUTO_REFRESH_INTERVAL)
+        self.now += 1.5 * AUTO_REFRESH_INTERVAL
+        self.assertEqual(sorted(self.scheduler.tick(provider=self.provider).results), ["AAPL", "MSFT"])
+
+    def test_moving_prices_polled_more(self):
+        """Test only the due subset is refreshed, and movers come due sooner."""
+        self.scheduler.tick(provider=self.provider)
+        self.now += 1.5 * AUTO_REFRESH_INTERVAL
+        self.provider = FakePriceProvider({"AAPL": 151.0, "MSFT": 300.0})
+        self.scheduler.tick(provider=self.provider)
+        self.assertLess(self.scheduler.due_at("AAPL"), self.scheduler.due_at("MSFT"))
+
+        self.now = self.scheduler.due_at("AAPL")
+        report = self.scheduler.tick(provider=self.provider)
+        self.assertEqual(list(report.results), ["AAPL"])
+        self.assertEqual(self.portfolio.get_stock("AAPL").price, 151.0)
+
+    def test_closed_market(self):
+        """Test the last refresh comes after the close, then none until the open."""
+        self.now = new_york(2025, 7, 3, 15, 59, 30)  # July 4th is Friday
+        self.scheduler.close()
+        self.scheduler = RefreshScheduler(self.portfolio, clock=lambda: self.now)
+        self.scheduler.tick(provider=self.provider)
+        close = new_york(2025, 7, 3, 16, 0)
+        self.assertEqual(self.scheduler.due_at("AAPL"), close + AUTO_REFRESH_CLOSE_GRACE)
+
+        self.now = close + AUTO_REFRESH_CLOSE_GRACE
+        self.scheduler.tick(provider=self.provider)
+        self.assertEqual(self.scheduler.next_due(), new_york(2025, 7, 7, 9, 30))
+        self.now = new_york(2025, 7, 5, 12, 0)
+        self.assertIsNone(self.scheduler.tick(provider=self.provider))
+
+    def test_follows_portfolio(self):
+        """Test added holdings are due at once and removed ones are dropped."""
+        self.scheduler.tick(provider=self.provider)
+        self.portfolio.remove_stock("MSFT")
+        self.portfolio.add_stock(Stock("VOD.L", 100, 0.7))
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertIsNone(self.scheduler.due_at("MSFT"))
+        self.assertEqual(self.scheduler.due(), ["VOD.L"])
+
+        # A failed or never-reported refresh is retried later, not lost
+        self.assertEqual(self.scheduler.due_at("VOD.L"), self.now + AUTO_REFRESH_MAX_INTERVAL)
+        self.scheduler.close()
+        self.portfolio.add_stock(Stock("IBM", 1, 1.0))
+        self.assertIsNone(self.scheduler.due_at("IBM"))
+
+class TestBatchRefresher(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.bulk_calls = []
+
+    def bulk_fetch(self, tickers):
+        """Fake bulk source that knows every ticker except ones starting with X."""
+        self.bulk_calls.append(list(tickers))
+        return {t: 10.0 for t in tickers if not t.startswith("X")}
+
+    def test_one_request_per_chunk(self):
+        """Test tickers are fetched in chunks."""
+        tickers = [f"T{i}" for i in range(25)]
+        refresher = BatchRefresher(self.bulk_fetch, lambda t: 1.0, chunk_size=10)
+        report = refresher.refresh(tickers)
+
+        self.assertEqual(len(self.bulk_calls), 3)
+        self.assertEqual(len(report.succeeded), 25)
+
+    def test_leftovers_use_single_fetch(self):
+        """Test tickers missed by the bulk request fall back to single fetch."""
+        def single_fetch(ticker):
+            if ticker == "XBAD":
+                raise ValueError("unknown ticker")
+            return 20.0
+
+        refresher = BatchRefresher(self.bulk_fetch, single_fetch, chunk_size=10)
+        report = refresher.refresh(["AAPL", "XGOOD", "XBAD"])
+
+        self.assertEqual(report.results["AAPL"].price, 10.0)
+        self.assertEqual(report.results["XGOOD"].price, 20.0)
+        self.assertEqual(report.failed, {"XBAD": "unknown ticker"})
+
+    def test_single_fetch_timeout(self):
+        """Test a hung single fetch is reported as timed out."""
+        import threading
+        release = threading.Event()
+
+        refresher = BatchRefresher(
+            self.bulk_fetch,
+            lambda t: release.wait(5) or 1.0,
+            timeout=0.05
+        )
+        report = refresher.refresh(["XSLOW"])
+        release.set()
+
+        self.assertEqual(report.failed, {"XSLOW": "timed out"})
+
+    def test_timeout_is_per_ticker(self):
+        """Test each ticker gets the timeout from its own start, not a share of the pool's."""
+        import time
+
+        def single_fetch(ticker):
+            time.sleep(0.5 if ticker == "XSLOW" else 0.15)
+            return 1.0
+
+        refresher = BatchRefresher(self.bulk_fetch, single_fetch, max_workers=1, timeout=0.3)
+        report = refresher.refresh(["XSLOW", "XA", "XB", "XC"])
+
+        # The slow one fails alone; the ones queued behind it still get their full time
+        self.assertEqual(report.failed, {"XSLOW": "timed out"})
+        self.assertEqual(sorted(report.succeeded), ["XA", "XB", "XC"])
+
+    def test_progress_and_cancel(self):
+        """Test progress is reported per ticker and cancel stops the refresh."""
+        import threading
+        cancel = threading.Event()
+        seen = []
+
+        def progress(result):
+            seen.append(result.ticker)
+            cancel.set()
+
+        refresher = BatchRefresher(self.bulk_fetch, lambda t: 1.0, chunk_size=1)
+        report = refresher.refresh(["AAPL", "GOOGL", "MSFT"], progress=progress, cancel=cancel)
+
+        self.assertTrue(report.cancelled)
+        self.assertEqual(report.succeeded, ["AAPL"])
+        self.assertEqual(report.failed, {"GOOGL": "cancelled", "MSFT": "cancelled"})
+        self.assertEqual(seen, ["AAPL", "GOOGL", "MSFT"])
+
+class TestBackgroundRunner(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.runner = BackgroundRunner()
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        self.runner.shutdown()
+
+    def wait_for(self, job):
+        """Poll a job the way the GUI does until it finishes."""
+        import time
+        items = []
+        deadline = time.monotonic() + 5
+        while not job.done and time.monotonic() < deadline:
+            items.extend(job.drain())
+            time.sleep(0.01)
+        return items
+
+    def test_progress_and_result(self):
+        """Test progress items and the result reach the polling thread."""
+        def work(job):
+            for i in range(3):
+                job.report_progress(i)
+            return "finished"
+
+        job = self.runner.submit(work)
+        self.assertEqual(self.wait_for(job), [0, 1, 2])
+        self.assertEqual(job.result(), "finished")
+
+    def test_cancel(self):
+        """Test a job sees the cancel request."""
+        import threading
+        started = threading.Event()
+
+        def work(job):
+            started.set()
+            return job.cancel_event.wait(5)
+
+        job = self.runner.submit(work)
+        started.wait(5)
+        job.cancel()
+        self.wait_for(job)
+        self.assertTrue(job.cancelled)
+        self.assertTrue(job.result())
+
+class TestViewport(unittest.TestCase):
+    def test_visible_range(self):
+        """Test the scroll position is clamped to existing rows."""
+        self.assertEqual(visible_range(100, 0, 10), (0, 10))
+        self.assertEqual(visible_range(100, 95, 10), (90, 100))
+        self.assertEqual(visible_range(100, -5, 10), (0, 10))
+        self.assertEqual(visible_range(3, 2, 10), (0, 3))
+
+    def test_slot_diff(self):
+        """Test only changed cells are reported after a refresh."""
+        cache = SlotCache()
+        stock = Stock("AAPL", 10, 150.0)
+        self.assertEqual(len(cache.diff(0, format_row(stock))), 4)
+
+        stock.price = 151.0
+        self.assertEqual(
+            cache.diff(0, format_row(stock)),
+            [(2, "$151.00"), (3, "$1510.00")]
+        )
+        self.assertEqual(cache.diff(0, format_row(stock)), [])
+
+    def test_slot_clear(self):
+        """Test clearing a slot forgets its ticker."""
+        cache = SlotCache()
+        cache.diff(0, format_row(Stock("AAPL", 10, 150.0)))
+        self.assertEqual(cache.ticker(0), "AAPL")
+        self.assertTrue(cache.clear(0))
+        self.assertFalse(cache.clear(0))
+        self.assertIsNone(cache.ticker(0))
+
+class TestFakePriceProvider(unittest.TestCase):
+    def test_deterministic_prices(self):
+        """Test the same seed always gives the same prices."""
+        tickers = [f"T{i}" for i in range(50)]
+        first = FakePriceProvider(seed=1).get_prices(tickers)
+        second = FakePriceProvider(seed=1).get_prices(list(reversed(tickers)))
+        self.assertEqual(first, second)
+        self.assertEqual(first["T3"], FakePriceProvider(seed=1).get_price("T3"))
+
+    def test_failure_rate(self):
+        """Test failing tickers are left out of bulk results and raise singly."""
+        provider = FakePriceProvider(failure_rate=0.5)
+        tickers = [f"T{i}" for i in range(200)]
+        prices = provider.get_prices(tickers)
+        self.assertTrue(50 < len(prices) < 150)
+
+        missing = next(t for t in tickers if t not in prices)
+        with self.assertRaises(ValueError):
+            provider.get_price(missing)
+
+    def test_call_counters(self):
+        """Test the provider counts its requests."""
+        provider = FakePriceProvider()
+        provider.get_prices(["AAPL", "GOOGL"])
+        provider.get_price("AAPL")
+        self.assertEqual(provider.bulk_calls, 1)
+        self.assertEqual(provider.single_calls, 1)
+
+class TestQuoteCache(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.now = 0.0
+        self.cache = QuoteCache(ttl=10.0, max_entries=2, clock=lambda: self.now)
+
+    def test_hit_and_expiry(self):
+        """Test quotes are served until the TTL runs out."""
+        self.cache.put("AAPL", 150.0)
+        self.assertEqual(self.cache.get("AAPL"), 150.0)
+
+        self.now = 10.0
+        self.assertIsNone(self.cache.get("AAPL"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        """Test the least recently used quote is evicted when full."""
+        self.cache.put("AAPL", 1.0)
+        self.cache.put("GOOGL", 2.0)
+        self.cache.get("AAPL")
+        self.cache.put("MSFT", 3.0)
+
+        self.assertIsNone(self.cache.get("GOOGL"))
+        self.assertEqual(self.cache.get("AAPL"), 1.0)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_caching_provider(self):
+        """Test repeated lookups within the TTL don't hit the provider."""
+        fake = FakePriceProvider()
+        provider = CachingPriceProvider(fake, QuoteCache(clock=lambda: self.now))
+
+        price = provider.get_price("AAPL")
+        prices = provider.get_prices(["AAPL", "GOOGL"])
+        provider.get_prices(["AAPL", "GOOGL"])
+
+        self.assertEqual(prices["AAPL"], price)
+        self.assertEqual(fake.single_calls, 1)
+        # Only GOOGL needed a bulk request
+        self.assertEqual(fake.bulk_calls, 1)
+
+class TestQuoteStore(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.path = self.test_dir / "quotes.db"
+        self.now = 1000.0
+        self.stores = []
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.test_dir)
+
+    def open_store(self, source="fake"):
+        store = QuoteStore(self.path, source=source, clock=lambda: self.now)
+        self.stores.append(store)
+        return store
+
+    def caching(self, fake):
+        return CachingPriceProvider(fake, QuoteCache(), self.open_store(), ttl=60.0, stale_ttl=300.0)
+
+    def test_shared_between_connections(self):
+        """Test quotes written by one connection are seen by another, newest winning."""
+        writer, reader = self.open_store(), self.open_store()
+        writer.put_many({"AAPL": 150.0, "MSFT": 300.0}, fetched_at=10.0)
+        reader.put_many({"AAPL": 140.0}, fetched_at=5.0)
+
+        self.assertEqual(reader.get("AAPL"), (150.0, 10.0))
+        self.assertEqual(len(reader), 2)
+        # Other sources are kept apart
+        self.assertIsNone(self.open_store("yfinance").get("AAPL"))
+
+    def test_other_process(self):
+        """Test quotes written by another process are read back."""
+        import subprocess
+        import sys
+        code = (
+            "from cache import QuoteStore; "
+            f"QuoteStore({str(self.path)!r}, source='fake').put_many({{'AAPL': 123.0}}, 1.0)"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).parent)
+        self.assertEqual(self.open_store().get("AAPL"), (123.0, 1.0))
+
+    def test_restart_serves_fresh_quotes(self):
+        """Test a new provider on the same store makes no requests for fresh quotes."""
+        first = self.caching(FakePriceProvider())
+        prices = first.get_prices(["AAPL", "MSFT"])
+
+        fake = FakePriceProvider()
+        second = self.caching(fake)
+        self.assertEqual(second.get_prices(["AAPL", "MSFT"]), prices)
+        self.assertEqual(second.get_price("AAPL"), prices["AAPL"])
+        self.assertEqual((fake.bulk_calls, fake.single_calls), (0, 0))
+        self.assertEqual(second.store_hits, 2)
+
+    def test_stale_while_revalidate(self):
+        """Test stale quotes are served at once and refreshed in the background."""
+        self.open_store().put_many({"AAPL": 1.0}, fetched_at=self.now - 100)
+        fake = FakePriceProvider({"AAPL": 2.0})
+        provider = self.caching(fake)
+
+        self.assertEqual(provider.get_prices(["AAPL"]), {"AAPL": 1.0})
+        provider.wait_for_revalidation()
+        self.assertEqual(provider.stale_served, 1)
+        self.assertEqual(fake.bulk_calls, 1)
+        self.assertEqual(provider.store.get("AAPL"), (2.0, self.now))
+        self.assertEqual(provider.get_price("AAPL"), 2.0)
+        provider.close()
+
+    def test_too_old_is_fetched(self):
+        """Test quotes past the stale window are fetched before answering."""
+        self.open_store().put_many({"AAPL": 1.0}, fetched_at=self.now - 1000)
+        provider = self.caching(FakePriceProvider({"AAPL": 2.0}))
+        self.assertEqual(provider.get_price("AAPL"), 2.0)
+        self.assertEqual(provider.revalidations, 0)
+
+    def test_store_hit_keeps_its_age(self):
+        """Test a quote from the store leaves memory when its TTL from the fetch runs out."""
+        self.open_store().put_many({"AAPL": 1.0}, fetched_at=self.now - 50)
+        cache = QuoteCache(ttl=60.0, clock=lambda: self.now)
+        provider = CachingPriceProvider(FakePriceProvider(), cache, self.open_store(), ttl=60.0)
+        self.assertEqual(provider.get_prices(["AAPL"]), {"AAPL": 1.0})
+        self.assertEqual(cache.get("AAPL"), 1.0)
+        self.now += 15
+        self.assertIsNone(cache.get("AAPL"))
+
+    def test_stale_quote_keeps_its_time(self):
+        """Test a holding priced from a stale quote is stamped with the quote's fetch time."""
+        self.open_store().put_many({"AAPL": 1.0}, fetched_at=self.now - 100)
+        provider = self.caching(FakePriceProvider({"AAPL": 2.0}))
+        portfolio = Portfolio(provider=provider)
+        portfolio.add_stock(Stock("AAPL", 1, 0.5))
+
+        report = portfolio.fetch_prices()
+        quoted_at = datetime.fromtimestamp(self.now - 100)
+        self.assertEqual(report.results["AAPL"].quoted_at, quoted_at)
+        portfolio.apply_prices(report)
+        self.assertEqual(portfolio.get_stock("AAPL").price, 1.0)
+        self.assertEqual(portfolio.get_stock("AAPL").last_updated, quoted_at)
+
+        provider.wait_for_revalidation()
+        report = portfolio.fetch_prices()
+        self.assertIsNone(report.results["AAPL"].quoted_at)
+        provider.close()
+
+class ScriptedYFinance(YFinanceProvider):
+    """YFinanceProvider with its three Yahoo lookups answered from dicts."""
+
+    def __init__(self, metadata, fast, full):
+        super().__init__(metadata)
+        self.fast = fast
+        self.full = full
+        self.calls = []
+
+    def _fast_info(self, ticker, details):
+        self.calls.append(("fast", ticker))
+        price = self.fast.get(ticker)
+        return price, ({"currency": "USD"} if price and details else {})
+
+    def _full_info(self, ticker):
+        self.calls.append(("info", ticker))
+        price = self.full.get(ticker)
+        return price, ({"exchange": "NMS", "currency": "USD", "quote_type": "EQUITY"} if price else {})
+
+    def _download(self, tickers):
+        self.calls.append(("download", tuple(tickers)))
+        return {t: self.fast[t] for t in tickers if t in self.fast}
+
+class TestTickerMetadata(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.now = 1000.0
+        self.store = MetadataStore(
+            self.test_dir / "tickers.db", invalid_ttl=3600.0, clock=lambda: self.now
+        )
+        self.provider = ScriptedYFinance(self.store, fast={"AAPL": 150.0}, full={"AAPL": 150.0, "FUND": 10.0})
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_unknown_ticker_is_skipped_until_expiry(self):
+        """Test a ticker with no price isn't looked up again until its entry expires."""
+        with self.assertRaises(ValueError):
+            self.provider.get_price("DELISTED")
+        self.assertEqual(self.provider.calls, [("fast", "DELISTED"), ("info", "DELISTED")])
+
+        self.provider.calls.clear()
+        with self.assertRaises(ValueError):
+            self.provider.get_price("DELISTED")
+        self.assertEqual(self.provider.get_prices(["AAPL", "DELISTED"]), {"AAPL": 150.0})
+        self.assertEqual(self.provider.calls, [("download", ("AAPL",))])
+
+        self.now += 3600.0
+        self.provider.full["DELISTED"] = 1.0
+        self.assertEqual(self.provider.get_price("DELISTED"), 1.0)
+        self.assertTrue(self.store.get("DELISTED").valid)
+
+    def test_info_only_ticker_goes_straight_to_info(self):
+        """Test a ticker only info can price skips fast_info next time."""
+        self.assertEqual(self.provider.get_price("FUND"), 10.0)
+        self.provider.calls.clear()
+        self.assertEqual(self.provider.get_price("FUND"), 10.0)
+        self.assertEqual(self.provider.calls, [("info", "FUND")])
+
+        metadata = self.store.get("FUND")
+        self.assertEqual((metadata.price_source, metadata.exchange, metadata.quote_type), (INFO, "NMS", "EQUITY"))
+
+    def test_repeated_refresh_of_dirty_list(self):
+        """Test the second refresh of a list with a bad ticker makes no wasted requests."""
+        portfolio = Portfolio()
+        for ticker in ["AAPL", "BAD"]:
+            portfolio.add_stock(Stock(ticker, 1, 1.0))
+        portfolio.update_prices(self.provider)
+        self.provider.calls.clear()
+
+        report = portfolio.update_prices(self.provider)
+        self.assertEqual(report.succeeded, ["AAPL"])
+        self.assertIn("BAD", report.failed)
+        self.assertEqual(self.provider.calls, [("download", ("AAPL",))])
+        # Still known after a restart
+        reopened = MetadataStore(self.test_dir / "tickers.db", clock=lambda: self.now)
+        self.assertTrue(reopened.is_known_invalid(reopened.get("BAD")))
+        reopened.close()
+
+    def test_many_tickers_and_close(self):
+        """Test lookups past one IN-list chunk, and that closing the provider closes the store."""
+        import sqlite3
+        tickers = [f"T{i}" for i in range(1200)]
+        self.store.mark_valid(tickers)
+        self.assertEqual(len(self.store.get_many(tickers)), 1200)
+
+        CachingPriceProvider(self.provider).close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.store.get("T0")
+
 class TestStorageManager(unittest.TestCase):
     def setUp(self):
         """Setup test fixture."""
@@ -204,5 +989,1129 @@ class TestStorageManager(unittest.TestCase):
         self.assertEqual(holdings["AAPL"].quantity, 10)
         self.assertEqual(holdings["GOOGL"].quantity, 5)
 
+class TestJournalStorage(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.snapshot = self.test_dir / "stocks.csv"
+        self.journal = self.test_dir / "stocks.journal"
+        self.storage = JournalStorage(self.snapshot, self.journal, compact_threshold=100)
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        self.storage.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_replay_journal(self):
+        """Test changes are appended and replayed over the snapshot."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        portfolio.add_stock(Stock("GOOGL", 5, 200.0))
+        self.storage.save_portfolio(portfolio)
+
+        portfolio.add_stock(Stock("MSFT", 3, 300.0))
+        portfolio.remove_stock("GOOGL")
+        # Only the changed holdings are looked up, not the whole portfolio
+        with patch.object(portfolio, "get_holdings", side_effect=AssertionError):
+            self.storage.save_changes(portfolio, ["MSFT", "GOOGL"])
+
+        # The snapshot is untouched, the journal has one line per change
+        self.assertEqual(len(self.journal.read_text().splitlines()), 2)
+
+        loaded = JournalStorage(self.snapshot, self.journal).load_portfolio()
+        holdings = loaded.get_holdings()
+        self.assertEqual(sorted(holdings), ["AAPL", "MSFT"])
+        self.assertEqual(holdings["MSFT"].quantity, 3)
+
+    def test_compaction(self):
+        """Test the journal is folded into the snapshot."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.storage.save_changes(portfolio, ["AAPL"])
+        self.storage.compact()
+
+        self.assertFalse(self.journal.exists())
+        self.assertIn("AAPL", self.snapshot.read_text())
+        self.assertIn("AAPL", self.storage.load_portfolio().get_holdings())
+
+    def test_truncated_record(self):
+        """Test a record cut short by a crash is skipped."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.storage.save_changes(portfolio, ["AAPL"])
+        with open(self.journal, "a") as file:
+            file.write("put,GOOGL,5")
+
+        holdings = self.storage.load_portfolio().get_holdings()
+        self.assertEqual(list(holdings), ["AAPL"])
+
+class TestSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.storage = SqliteStorage(self.test_dir / "stocks.db")
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        self.storage.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_save_load_portfolio(self):
+        """Test saving and loading a whole portfolio."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        portfolio.add_stock(Stock("GOOGL", 5, 200.0))
+        self.storage.save_portfolio(portfolio)
+
+        holdings = self.storage.load_portfolio().get_holdings()
+        self.assertEqual(len(holdings), 2)
+        self.assertEqual(holdings["GOOGL"].price, 200.0)
+
+    def test_save_changes(self):
+        """Test single holdings are upserted and deleted."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        portfolio.add_stock(Stock("GOOGL", 5, 200.0))
+        self.storage.save_portfolio(portfolio)
+
+        portfolio.add_stock(Stock("AAPL", 5, 160.0))
+        portfolio.remove_stock("GOOGL")
+        with patch.object(portfolio, "get_holdings", side_effect=AssertionError):
+            self.storage.save_changes(portfolio, ["AAPL", "GOOGL"])
+
+        self.assertEqual(self.storage.get_stock("AAPL").quantity, 15)
+        self.assertIsNone(self.storage.get_stock("GOOGL"))
+
+    def test_migrate_from_csv_once(self):
+        """Test the CSV import only runs the first time."""
+        csv_path = self.test_dir / "stocks.csv"
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        CsvStorage(csv_path).save_portfolio(portfolio)
+
+        self.assertEqual(self.storage.migrate_from_csv(csv_path), 1)
+        self.assertEqual(self.storage.migrate_from_csv(csv_path), 0)
+        self.assertEqual(self.storage.get_stock("AAPL").price, 150.0)
+
+class CountingCsvStorage(CsvStorage):
+    """CSV storage that counts its writes and can be made to fail."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.saves = 0
+        self.attempts = 0
+        self.fail = False
+
+    def save_portfolio(self, portfolio):
+        self.attempts += 1
+        if self.fail:
+            raise OSError("disk full")
+        self.saves += 1
+        super().save_portfolio(portfolio)
+
+class TestWriteBehindStorage(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.backend = CountingCsvStorage(self.test_dir / "stocks.csv")
+        self.storage = WriteBehindStorage(self.backend, delay=60.0)
+        self.portfolio = self.storage.load_portfolio()
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        self.storage.close()
+        shutil.rmtree(self.test_dir)
+
+    def saved(self):
+        return CsvStorage(self.test_dir / "stocks.csv").load_portfolio().get_holdings()
+
+    def test_burst_is_one_write(self):
+        """Test many rapid edits cost one write, with the final state."""
+        for i in range(50):
+            self.portfolio.add_stock(Stock(f"T{i}", 1, 10.0))
+            self.storage.save_changes(self.portfolio, [f"T{i}"])
+        self.portfolio.remove_stock("T0")
+        self.storage.save_changes(self.portfolio, ["T0"])
+        self.assertEqual(self.backend.saves, 0)
+        self.assertTrue(self.storage.dirty)
+        self.assertIsNone(self.storage.get_stock("T0"))
+        self.assertEqual(self.storage.get_stock("T1").quantity, 1)
+
+        self.storage.flush()
+        self.assertEqual(self.backend.saves, 1)
+        self.assertFalse(self.storage.dirty)
+        self.assertEqual(len(self.saved()), 49)
+        self.storage.flush()
+        self.assertEqual(self.backend.saves, 1)
+
+    def test_saves_copies(self):
+        """Test a write uses the holdings as they were when saved."""
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.storage.save_changes(self.portfolio, ["AAPL"])
+        self.portfolio.get_stock("AAPL").price = 999.0
+        self.storage.flush()
+        self.assertEqual(self.saved()["AAPL"].price, 150.0)
+
+    def test_background_write(self):
+        """Test changes are written on their own once the window ends."""
+        import time
+        storage = WriteBehindStorage(self.backend, delay=0.05)
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        storage.save_changes(self.portfolio, ["AAPL"])
+        deadline = time.monotonic() + 5.0
+        while storage.dirty or storage.writes == 0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(storage.writes, 1)
+        self.assertIn("AAPL", self.saved())
+
+    def test_failed_write_is_retried(self):
+        """Test a failed flush raises and keeps the changes for the next write."""
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        self.storage.save_changes(self.portfolio, ["AAPL"])
+        self.backend.fail = True
+        with self.assertRaises(OSError):
+            self.storage.flush()
+        self.assertTrue(self.storage.dirty)
+
+        self.backend.fail = False
+        self.storage.close()
+        self.assertIn("AAPL", self.saved())
+
+    def test_failing_writes_back_off(self):
+        """Test background retries of a failing write get further apart."""
+        import time
+        storage = WriteBehindStorage(self.backend, delay=0.02, max_retry_delay=0.1)
+        self.backend.fail = True
+        self.portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        with self.assertLogs("storage", level="ERROR"):
+            storage.save_changes(self.portfolio, ["AAPL"])
+            time.sleep(0.6)
+        # Without backoff this would be about 30 attempts
+        self.assertLessEqual(self.backend.attempts, 10)
+        self.assertGreaterEqual(storage.failures, 3)
+
+        self.backend.fail = False
+        storage.flush()
+        self.assertEqual(storage.failures, 0)
+        self.assertIn("AAPL", self.saved())
+        storage.close()
+
+class TestBulkLoader(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.path = self.test_dir / "stocks.csv"
+        self.path.write_text(
+            "Ticker,Quantity,Price,Last Updated\n"
+            "AAPL,10,150.0,2024-12-13T15:11:29.900512\n"
+            "BAD,ten,1.0,2024-12-13T15:11:29\n"
+            "GOOGL,5,200.0,2024-12-13T15:11:29\n"
+            "SHORT,1\n"
+            "MSFT,3,300.0,not a date\n"
+        )
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        shutil.rmtree(self.test_dir)
+
+    def test_error_report(self):
+        """Test bad rows are collected instead of stopping the load."""
+        portfolio, report = load_portfolio(self.path)
+        holdings = portfolio.get_holdings()
+
+        self.assertEqual(sorted(holdings), ["AAPL", "GOOGL"])
+        self.assertEqual(holdings["AAPL"].last_updated, datetime(2024, 12, 13, 15, 11, 29, 900512))
+        self.assertEqual(report.rows_read, 5)
+        self.assertEqual(report.rows_loaded, 2)
+        self.assertEqual([e.line for e in report.errors], [3, 5, 6])
+
+    def test_streaming_chunks(self):
+        """Test the file can be streamed in small chunks."""
+        report = LoadReport()
+        chunks = list(iter_chunks(self.path, chunk_size=2, report=report))
+        self.assertEqual([len(c) for c in chunks], [1, 1])
+        self.assertEqual(report.error_count, 3)
+
+    def test_columnar_load(self):
+        """Test loading straight into a ColumnarPortfolio."""
+        portfolio, _ = load_portfolio(self.path, columnar=True)
+        self.assertIsInstance(portfolio, ColumnarPortfolio)
+        self.assertEqual(portfolio.get_total_value(), 2500.0)
+
+    def test_short_and_long_rows(self):
+        """Test a short row next to a long one doesn't shift fields between them."""
+        self.path.write_text(
+            "Ticker,Quantity,Price,Last Updated\n"
+            "A,1,2\n"
+            "2024-01-01T00:00:00,B,1,2,2024-01-01T00:00:00\n"
+        )
+        portfolio, report = load_portfolio(self.path)
+        self.assertEqual(portfolio.get_holdings(), {})
+        self.assertEqual([e.line for e in report.errors], [2, 3])
+
+    def test_utc_offset_rejected(self):
+        """Test timestamps with a UTC offset are reported, not shifted."""
+        self.path.write_text(
+            "Ticker,Quantity,Price,Last Updated\n"
+            "AAPL,10,150.0,2024-12-13T15:11:29\n"
+            "PLUS,1,1.0,2024-12-13T15:11:29+02:00\n"
+            "MINUS,1,1.0,2024-12-13T15:11:29-05:00\n"
+            "ZULU,1,1.0,2024-12-13T15:11:29Z\n"
+        )
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            portfolio, report = load_portfolio(self.path)
+        self.assertEqual(sorted(portfolio.get_holdings()), ["AAPL"])
+        self.assertEqual([e.line for e in report.errors], [3, 4, 5])
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.csv_path = self.test_dir / "stocks.csv"
+        self.stocks = [
+            Stock("AAPL", 10, 150.0, datetime(2024, 12, 13, 15, 11, 29, 900512)),
+            Stock("GOOGL", 5, 200.0, datetime(2024, 12, 13, 15, 11, 29))
+        ]
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        shutil.rmtree(self.test_dir)
+
+    def test_round_trip(self):
+        """Test holdings read back from the mapped file unchanged."""
+        path = self.test_dir / "stocks.snap"
+        write_snapshot(path, self.stocks)
+
+        with SnapshotReader(path) as reader:
+            self.assertEqual(len(reader), 2)
+            self.assertTrue(reader.verify())
+            self.assertEqual(reader.stock(0), self.stocks[0])
+            self.assertEqual(list(reader.stocks()), self.stocks)
+            self.assertEqual(reader.to_portfolio(columnar=True).get_total_value(), 2500.0)
+
+    def test_empty(self):
+        """Test an empty portfolio round trips."""
+        path = self.test_dir / "stocks.snap"
+        write_snapshot(path, [])
+        with SnapshotReader(path) as reader:
+            self.assertEqual(list(reader.stocks()), [])
+
+    def test_stale_snapshot(self):
+        """Test a snapshot is ignored once the CSV changes."""
+        CsvStorage(self.csv_path).save_portfolio(Portfolio())
+        self.assertTrue(snapshot_path(self.csv_path).exists())
+        reader = open_fresh(self.csv_path)
+        self.assertIsNotNone(reader)
+        reader.close()
+
+        with open(self.csv_path, "a") as file:
+            file.write("MSFT,1,1.0,2024-12-13T15:11:29\n")
+        self.assertIsNone(open_fresh(self.csv_path))
+        holdings = CsvStorage(self.csv_path).load_portfolio().get_holdings()
+        self.assertIn("MSFT", holdings)
+
+    def test_corrupt_header(self):
+        """Test a damaged header is rejected."""
+        path = self.test_dir / "stocks.snap"
+        write_snapshot(path, self.stocks)
+        data = bytearray(path.read_bytes())
+        data[20] ^= 0xFF
+        path.write_bytes(bytes(data))
+        with self.assertRaises(SnapshotError):
+            SnapshotReader(path)
+
+    def test_load_matches_csv(self):
+        """Test a snapshot load gives the same plain Portfolio as the CSV."""
+        portfolio = Portfolio()
+        for stock in reversed(self.stocks):
+            portfolio.add_stock(stock)
+        storage = CsvStorage(self.csv_path)
+        storage.save_portfolio(portfolio)
+
+        loaded = storage.load_portfolio()
+        snapshot_path(self.csv_path).unlink()
+        from_csv = storage.load_portfolio()
+        self.assertIs(type(loaded), Portfolio)
+        self.assertEqual(list(loaded.get_holdings().items()), list(from_csv.get_holdings().items()))
+        loaded.remove_stock("GOOGL")
+        loaded.add_stock(Stock("GOOGL", 1, 1.0))
+        self.assertEqual(loaded.get_tickers(), ["AAPL", "GOOGL"])
+
+    def test_load_serves_mapped_columns(self):
+        """Test a mapped load serves a columnar portfolio without touching the file."""
+        portfolio = Portfolio()
+        for stock in self.stocks:
+            portfolio.add_stock(stock)
+        storage = CsvStorage(self.csv_path, mapped=True)
+        storage.save_portfolio(portfolio)
+        before = snapshot_path(self.csv_path).read_bytes()
+
+        loaded = storage.load_portfolio()
+        self.assertIsInstance(loaded, ColumnarPortfolio)
+        self.assertEqual(loaded.get_total_value(), 2500.0)
+        self.assertEqual(loaded.get_holdings(), portfolio.get_holdings())
+        loaded.set_prices(["AAPL"], [160.0])
+        loaded.add_stock(Stock("MSFT", 1, 100.0))
+        self.assertEqual(loaded.get_total_value(), 2700.0)
+        self.assertEqual(snapshot_path(self.csv_path).read_bytes(), before)
+
+    def test_load_rejects_corrupt_data(self):
+        """Test a snapshot whose data fails the checksum falls back to the CSV."""
+        portfolio = Portfolio()
+        for stock in self.stocks:
+            portfolio.add_stock(stock)
+        storage = CsvStorage(self.csv_path)
+        storage.save_portfolio(portfolio)
+        path = snapshot_path(self.csv_path)
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 0x01
+        path.write_bytes(bytes(data))
+
+        self.assertIsNone(open_fresh(self.csv_path))
+        loaded = storage.load_portfolio()
+        self.assertNotIsInstance(loaded, ColumnarPortfolio)
+        self.assertEqual(loaded.get_holdings(), portfolio.get_holdings())
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.stocks_file = self.test_dir / "stocks.csv"
+        import auth
+        self.original_cred_file = auth.CREDENTIALS_FILE
+        auth.CREDENTIALS_FILE = self.test_dir / "credentials.txt"
+        history_patcher = patch("config.HISTORY_DIR", self.test_dir / "history")
+        history_patcher.start()
+        self.addCleanup(history_patcher.stop)
+        store_patcher = patch("config.QUOTE_STORE_FILE", self.test_dir / "quotes.db")
+        store_patcher.start()
+        self.addCleanup(store_patcher.stop)
+        patcher = patch("cli.create_storage", lambda mode: CsvStorage(self.stocks_file))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        import auth
+        auth.CREDENTIALS_FILE = self.original_cred_file
+        shutil.rmtree(self.test_dir)
+
+    def run_cli(self, *args):
+        import io
+        import json
+        from contextlib import redirect_stdout
+        argv = ["--username", DEFAULT_USERNAME, "--password", DEFAULT_PASSWORD,
+                "--provider", "fake", *args]
+        out = io.StringIO()
+        with redirect_stdout(out):
+            code = cli.main(argv)
+        return code, json.loads(out.getvalue())
+
+    def test_parse_pairs(self):
+        """Test the accepted input formats."""
+        pairs, invalid = cli.parse_pairs([
+            "Ticker,Quantity", "aapl,10", "MSFT 5", "# comment", "", "GOOG\t2", "BAD", "X,abc", "Y,-1"
+        ])
+        self.assertEqual(pairs, [("AAPL", 10), ("MSFT", 5), ("GOOG", 2)])
+        self.assertEqual([item["line"] for item in invalid], [7, 8, 9])
+
+    def test_import_refresh_totals(self):
+        """Test a bulk import, refresh and totals run end to end."""
+        input_file = self.test_dir / "input.txt"
+        input_file.write_text("\n".join(f"T{i},{i + 1}" for i in range(500)) + "\nBAD LINE HERE\n")
+
+        code, result = self.run_cli("import", str(input_file))
+        self.assertEqual(code, cli.EXIT_PARTIAL)
+        self.assertEqual(result["succeeded"], 500)
+        self.assertEqual(len(result["invalid_lines"]), 1)
+        self.assertGreater(result["stats"]["bytes_written"], 0)
+        self.assertIn("tickers_per_sec", result["stats"])
+
+        code, result = self.run_cli("refresh")
+        self.assertEqual(code, cli.EXIT_OK)
+        self.assertEqual(result["processed"], 500)
+
+        code, result = self.run_cli("totals", "--holdings")
+        self.assertEqual(code, cli.EXIT_OK)
+        self.assertEqual(result["holdings"], 500)
+        self.assertEqual(len(result["holdings_detail"]), 500)
+        self.assertAlmostEqual(
+            result["total_value"],
+            round(sum(h["total_value"] for h in result["holdings_detail"]), 2),
+            places=2
+        )
+
+    def test_watch(self):
+        """Test watch refreshes every holding once up front, then stops on time."""
+        input_file = self.test_dir / "input.txt"
+        input_file.write_text("AAPL,1\nMSFT,2\n")
+        self.run_cli("import", str(input_file))
+
+        code, result = self.run_cli("watch", "--duration", "0.2")
+        self.assertEqual(code, cli.EXIT_OK)
+        self.assertGreaterEqual(result["ticks"], 1)
+        self.assertGreaterEqual(result["processed"], 2)
+        self.assertEqual(result["holdings"], 2)
+
+    def test_bad_credentials(self):
+        """Test a wrong password exits with the auth code."""
+        import io
+        from contextlib import redirect_stdout
+        with redirect_stdout(io.StringIO()):
+            code = cli.main(["--username", "nobody", "--password", "wrong", "totals"])
+        self.assertEqual(code, cli.EXIT_AUTH)
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run_small(self):
+        """Test every benchmark runs and reports timings."""
+        report = bench.run(sizes=[50], repeat=2)
+        names = {result["name"] for result in report["results"]}
+        self.assertEqual(names, set(bench.BENCHMARKS))
+        for result in report["results"]:
+            self.assertEqual(len(result["times"]), 2)
+            self.assertLessEqual(result["min"], result["median"])
+
+    def test_generated_data_is_reproducible(self):
+        """Test the same seed generates the same holdings."""
+        first = [(s.ticker, s.quantity, s.price) for s in bench.make_stocks(100, seed=3)]
+        second = [(s.ticker, s.quantity, s.price) for s in bench.make_stocks(100, seed=3)]
+        self.assertEqual(first, second)
+
+    def test_compare(self):
+        """Test a slowdown past the threshold is flagged."""
+        def report(median):
+            return {"results": [{"name": "save_portfolio", "size": 10, "median": median}]}
+
+        rows = bench.compare(report(1.0), report(1.05), threshold=0.1)
+        self.assertFalse(rows[0]["regressed"])
+        rows = bench.compare(report(1.0), report(1.5), threshold=0.1)
+        self.assertTrue(rows[0]["regressed"])
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled_records_nothing(self):
+        """Test spans and counters are no-ops while disabled."""
+        instrumentation.disable()
+        with instrumentation.span("test.block"):
+            pass
+        instrumentation.count("test.counter")
+        self.assertEqual(instrumentation.snapshot(), {"counters": {}, "histograms": {}})
+
+    def test_spans_and_counters(self):
+        """Test enabled spans land in histograms."""
+        instrumentation.enable()
+        for _ in range(3):
+            with instrumentation.span("test.block"):
+                pass
+        instrumentation.count("test.counter", 2)
+        data = instrumentation.snapshot()
+        self.assertEqual(data["histograms"]["test.block"]["count"], 3)
+        self.assertEqual(data["counters"]["test.counter"], 2)
+
+    def test_histogram_quantiles(self):
+        """Test quantiles come from the right buckets."""
+        histogram = instrumentation.Histogram()
+        for _ in range(90):
+            histogram.add(0.001)
+        for _ in range(10):
+            histogram.add(2.0)
+        self.assertEqual(histogram.quantile(0.5), 0.001)
+        self.assertEqual(histogram.quantile(0.99), 2.0)
+
+    def test_hot_paths_instrumented(self):
+        """Test refresh and storage record spans."""
+        instrumentation.enable()
+        portfolio = Portfolio(provider=FakePriceProvider())
+        portfolio.add_stock(Stock("AAPL", 1, 1.0))
+        portfolio.update_prices()
+        # The GUI and scheduler path: fetch on a worker, apply on the owner
+        columnar = ColumnarPortfolio.from_portfolio(portfolio)
+        columnar.apply_prices(columnar.fetch_prices())
+        test_dir = tempfile.mkdtemp()
+        try:
+            CsvStorage(Path(test_dir) / "stocks.csv").save_portfolio(portfolio)
+        finally:
+            shutil.rmtree(test_dir)
+        histograms = instrumentation.snapshot()["histograms"]
+        for name in (
+            "portfolio.update_prices", "portfolio.fetch_prices", "portfolio.apply_prices",
+            "refresh.bulk_fetch", "storage.save_portfolio"
+        ):
+            self.assertIn(name, histograms)
+        self.assertEqual(histograms["portfolio.apply_prices"]["count"], 2)
+
+    def test_memory_diff(self):
+        """Test tracemalloc diffs are only taken on demand."""
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            self.assertIsNone(instrumentation.memory_snapshot())
+        instrumentation.start_memory_tracing()
+        try:
+            before = instrumentation.memory_snapshot()
+            data = [bytes(1000) for _ in range(100)]
+            self.assertTrue(instrumentation.memory_diff(before))
+            del data
+        finally:
+            instrumentation.stop_memory_tracing()
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.store = HistoryStore(self.test_dir, block_size=16)
+        self.start = datetime(2024, 3, 4, 9, 30)
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        shutil.rmtree(self.test_dir)
+
+    def record_days(self, days, per_day=4):
+        from datetime import timedelta
+        for day in range(days):
+            for hour in range(per_day):
+                price = 100.0 + day + hour / 10
+                self.store.record("AAPL", price, self.start + timedelta(days=day, hours=hour))
+            self.store.flush()
+
+    def test_range_round_trip(self):
+        """Test quotes come back exactly, across many blocks."""
+        from datetime import timedelta
+        self.record_days(20)
+        times, prices = HistoryStore(self.test_dir, block_size=16).range("AAPL")
+        self.assertEqual(len(times), 80)
+        self.assertEqual(prices[0], 100.0)
+        self.assertEqual(times[-1].item(), self.start + timedelta(days=19, hours=3))
+
+        times, prices = self.store.range(
+            "AAPL", self.start + timedelta(days=5), self.start + timedelta(days=5, hours=2)
+        )
+        self.assertEqual(prices.tolist(), [105.0, 105.1, 105.2])
+
+    def test_daily_closes(self):
+        """Test daily downsampling returns each day's last quote."""
+        self.record_days(30)
+        closes = self.store.daily_closes(["AAPL", "MSFT"])
+        days, values = closes["AAPL"]
+        self.assertEqual(len(days), 30)
+        self.assertEqual(values[0], 100.3)
+        self.assertEqual(values[-1], 129.3)
+        self.assertEqual(len(closes["MSFT"][0]), 0)
+        # Same answer from the raw quotes
+        days, values = self.store.downsample("AAPL", "24h", "last")
+        self.assertEqual(values[-1], 129.3)
+
+    def test_downsample_reducers(self):
+        """Test other reducers and intervals."""
+        self.record_days(14)
+        _, highs = self.store.downsample("AAPL", "1D", "max")
+        self.assertEqual(highs.tolist()[:2], [100.3, 101.3])
+        _, lows = self.store.downsample("AAPL", "12h", "min")
+        self.assertEqual(len(lows), 28)
+        _, means = self.store.downsample("AAPL", "1D", "mean")
+        self.assertAlmostEqual(means[0], 100.15)
+        with self.assertRaises(ValueError):
+            self.store.downsample("AAPL", "1D", "median")
+
+    def test_unflushed_quotes_are_visible(self):
+        """Test buffered quotes show up in queries before flush."""
+        self.store.record("AAPL", 1.5, self.start)
+        self.assertEqual(self.store.range("AAPL")[1].tolist(), [1.5])
+        self.assertEqual(self.store.tickers(), ["AAPL"])
+
+    def test_compression(self):
+        """Test stored quotes take less space than raw int64/float64 pairs."""
+        store = HistoryStore(self.test_dir, block_size=1024)
+        from datetime import timedelta
+        for minute in range(2000):
+            store.record("MSFT", 400.0 + (minute % 50) / 100, self.start + timedelta(minutes=minute))
+        store.flush()
+        self.assertLess(store.disk_size("MSFT"), 2000 * 16 / 2)
+
+    def test_portfolio_records_refresh(self):
+        """Test apply_prices appends every refreshed quote."""
+        portfolio = Portfolio(provider=FakePriceProvider())
+        portfolio.add_stock(Stock("AAPL", 1, 1.0))
+        portfolio.history = self.store
+        portfolio.update_prices()
+        portfolio.update_prices()
+        self.assertEqual(len(self.store.range("AAPL")[0]), 2)
+
+    def test_removed_ticker_not_recorded(self):
+        """Test a quote for a holding removed mid-refresh isn't kept."""
+        portfolio = Portfolio(provider=FakePriceProvider())
+        portfolio.add_stock(Stock("AAPL", 1, 1.0))
+        portfolio.add_stock(Stock("MSFT", 1, 1.0))
+        portfolio.history = self.store
+        report = portfolio.fetch_prices()
+        portfolio.remove_stock("MSFT")
+        portfolio.apply_prices(report)
+        self.assertEqual(self.store.tickers(), ["AAPL"])
+
+    def test_record_during_flush(self):
+        """Test recording doesn't wait for a flush's disk writes."""
+        self.store.record("AAPL", 1.0, self.start)
+        with self.store._io_lock:
+            recorder = threading.Thread(target=self.store.record, args=("AAPL", 2.0, self.start))
+            recorder.start()
+            recorder.join(timeout=5.0)
+            self.assertFalse(recorder.is_alive())
+        self.assertEqual(self.store.flush(), 2)
+        self.assertEqual(self.store.range("AAPL")[1].tolist(), [1.0, 2.0])
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        from datetime import timedelta
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.history = HistoryStore(self.test_dir)
+        start = datetime(2024, 1, 1, 16, 0)
+        # AAPL rises 1% a day, MSFT falls 1% a day, GOOG only has the last two days
+        for day in range(30):
+            when = start + timedelta(days=day)
+            self.history.record_many(["AAPL", "MSFT"], [100 * 1.01 ** day, 100 * 0.99 ** day], when)
+            if day >= 28:
+                self.history.record("GOOG", 50.0 + day, when)
+        self.portfolio = Portfolio(provider=FakePriceProvider())
+        self.portfolio.add_stock(Stock("AAPL", 10, 100 * 1.01 ** 29))
+        self.portfolio.add_stock(Stock("MSFT", 10, 100 * 0.99 ** 29))
+        self.portfolio.add_stock(Stock("GOOG", 5, 79.0))
+        self.engine = analytics.PortfolioAnalytics(self.history, window=5)
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        shutil.rmtree(self.test_dir)
+
+    def test_align_closes(self):
+        """Test missing days are carried forward and leading days are NaN."""
+        days, matrix = analytics.align_closes(self.history.daily_closes(["GOOG", "AAPL"]), ["GOOG", "AAPL"])
+        self.assertEqual(matrix.shape, (30, 2))
+        self.assertTrue(np.isnan(matrix[:28, 0]).all())
+        self.assertEqual(matrix[29, 0], 79.0)
+
+    def test_compute(self):
+        """Test P&L, weights, volatility, correlation and VaR."""
+        result = self.engine.compute(self.portfolio, cost_basis={"GOOG": 70.0})
+        self.assertAlmostEqual(result.weights.sum(), 1.0)
+        self.assertAlmostEqual(result.total_value, self.portfolio.get_total_value())
+        pnl = dict(zip(result.tickers, result.pnl))
+        self.assertAlmostEqual(pnl["AAPL"], 10 * (100 * 1.01 ** 29 - 100))
+        self.assertAlmostEqual(pnl["GOOG"], 5 * 9.0)
+        # Constant daily returns have no volatility
+        self.assertAlmostEqual(result.volatility[0], 0.0)
+        self.assertEqual(result.rolling_returns.shape, (25, 3))
+        self.assertAlmostEqual(result.rolling_returns[0, 0], 1.01 ** 5 - 1)
+        self.assertEqual(result.correlation.shape, (3, 3))
+        self.assertGreaterEqual(result.var, 0.0)
+
+    def test_var_and_correlation(self):
+        """Test the standalone functions on known data."""
+        returns = np.array([[0.01, -0.01], [-0.02, 0.02], [0.03, -0.03], [-0.01, 0.01]])
+        corr = analytics.correlation(returns)
+        self.assertAlmostEqual(corr[0, 1], -1.0)
+        var = analytics.historical_var(returns, np.array([1.0, 0.0]), 1000.0, confidence=0.75)
+        self.assertAlmostEqual(var, 1000 * 0.0125)
+
+    def test_cached_until_inputs_change(self):
+        """Test unchanged inputs reuse the cached result."""
+        first = self.engine.compute(self.portfolio)
+        self.assertIs(self.engine.compute(self.portfolio), first)
+        self.portfolio.add_stock(Stock("AAPL", 1, 200.0))
+        self.assertIsNot(self.engine.compute(self.portfolio), first)
+        self.history.record("AAPL", 201.0, datetime(2024, 2, 1))
+        self.engine.compute(self.portfolio)
+        self.assertEqual((self.engine.hits, self.engine.misses), (1, 3))
+
+    def test_columnar_portfolio(self):
+        """Test a ColumnarPortfolio gives the same figures."""
+        result = self.engine.compute(ColumnarPortfolio.from_portfolio(self.portfolio))
+        expected = analytics.PortfolioAnalytics(self.history).compute(self.portfolio)
+        np.testing.assert_allclose(result.pnl, expected.pnl)
+
+class FlakyProvider(FakePriceProvider):
+    """Fails the first `failures` single lookups with a transient error."""
+
+    def __init__(self, failures, error=OSError, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.error = error
+
+    def get_price(self, ticker):
+        with self._lock:
+            self.failures -= 1
+            failing = self.failures >= 0
+        if failing:
+            raise self.error("temporary failure")
+        return super().get_price(ticker)
+
+class TestQuoteClient(unittest.TestCase):
+    def run_async(self, coro):
+        import asyncio
+        return asyncio.run(coro)
+
+    def client(self, provider, **options):
+        options.setdefault("rate", 0)
+        options.setdefault("backoff_base", 0.001)
+        options.setdefault("seed", 0)
+        client = AsyncQuoteClient(provider, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_create_provider_layers(self):
+        """Test named providers come as cache -> QuoteClient -> provider."""
+        provider = create_provider("http", store=False)
+        self.addCleanup(provider.close)
+        self.assertIsInstance(provider, CachingPriceProvider)
+        self.assertIsInstance(provider._provider, QuoteClient)
+        self.assertIsInstance(provider._provider.client._provider, HttpPriceProvider)
+
+    def test_token_bucket(self):
+        """Test the bucket allows a burst, then refills at the rate."""
+        now = [0.0]
+        bucket = TokenBucket(rate=2.0, burst=2, clock=lambda: now[0])
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+        now[0] = 0.5
+        self.assertEqual(bucket.try_acquire(), 0.0)
+
+    def test_coalescing(self):
+        """Test concurrent lookups of one ticker make one request."""
+        import asyncio
+        provider = FakePriceProvider(latency=0.05)
+        client = self.client(provider)
+
+        async def lookup():
+            return await asyncio.gather(*(client.get_price("AAPL") for _ in range(10)))
+
+        prices = self.run_async(lookup())
+        self.assertEqual(len(set(prices)), 1)
+        self.assertEqual(provider.single_calls, 1)
+        self.assertEqual(client.coalesced, 9)
+
+    def test_retries_with_backoff(self):
+        """Test transient errors are retried and missing prices aren't."""
+        provider = FlakyProvider(failures=2)
+        client = self.client(provider, max_retries=3)
+        self.assertGreater(self.run_async(client.get_price("AAPL")), 0)
+        self.assertEqual(client.retries, 2)
+
+        client = self.client(FlakyProvider(failures=5), max_retries=1)
+        with self.assertRaises(OSError):
+            self.run_async(client.get_price("AAPL"))
+
+        client = self.client(FakePriceProvider(prices={}))
+        with self.assertRaises(ValueError):
+            self.run_async(client.get_price("AAPL"))
+        self.assertEqual(client.requests, 1)
+
+        client = self.client(FlakyProvider(failures=1, error=KeyError), max_retries=3)
+        with self.assertRaises(KeyError):
+            self.run_async(client.get_price("AAPL"))
+        self.assertEqual((client.requests, client.retries), (1, 0))
+
+    def test_truncated_response_retried(self):
+        """Test a response that isn't valid JSON is retried, not taken as no price."""
+        import json
+        truncated = FlakyProvider(failures=1, error=lambda message: json.JSONDecodeError(message, "{", 1))
+        client = self.client(truncated, max_retries=2)
+        self.assertGreater(self.run_async(client.get_price("AAPL")), 0)
+        self.assertEqual(client.retries, 1)
+
+    def test_retry_after_forms(self):
+        """Test Retry-After is read as seconds or an HTTP date, else left to the backoff."""
+        from email.utils import format_datetime
+        from datetime import timedelta
+        from providers import _retry_after
+        self.assertEqual(_retry_after("7"), 7.0)
+        later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+        self.assertTrue(25 <= _retry_after(later) <= 30)
+        self.assertEqual(_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertEqual(_retry_after("soon"), 0.0)
+        self.assertEqual(_retry_after(None), 0.0)
+
+    def test_backoff_bounds(self):
+        """Test backoff grows exponentially up to the cap."""
+        client = self.client(FakePriceProvider(), backoff_base=1.0, backoff_max=4.0)
+        for attempt in range(6):
+            self.assertLessEqual(client.backoff(attempt), min(4.0, 2 ** attempt))
+
+    def test_rate_limit(self):
+        """Test the client spaces out requests."""
+        import asyncio
+        import time
+        client = self.client(FakePriceProvider(), rate=50, burst=1)
+
+        async def lookups():
+            await asyncio.gather(*(client.get_price(f"T{i}") for i in range(6)))
+
+        start = time.perf_counter()
+        self.run_async(lookups())
+        self.assertGreaterEqual(time.perf_counter() - start, 5 / 50 * 0.9)
+
+    def test_against_fake_server(self):
+        """Test throttled and failing server responses are retried."""
+        with FakeQuoteServer(rate=20, burst=2, error_rate=0.2, retry_after=0.01) as server:
+            provider = QuoteClient(HttpPriceProvider(server.url), rate=0, backoff_base=0.01, max_retries=10)
+            try:
+                portfolio = Portfolio(provider=provider)
+                for i in range(20):
+                    portfolio.add_stock(Stock(f"T{i}", 1, 0.0))
+                report = portfolio.update_prices(chunk_size=5)
+                self.assertEqual(report.failed, {})
+                self.assertGreater(server.rejected, 0)
+                self.assertGreater(provider.client.retries, 0)
+            finally:
+                provider.close()
+
+    def test_http_provider_rate_limited(self):
+        """Test a 429 surfaces as RateLimitedError with Retry-After."""
+        with FakeQuoteServer(rate=0.001, burst=1, retry_after=7) as server:
+            provider = HttpPriceProvider(server.url)
+            provider.get_price("AAPL")
+            with self.assertRaises(RateLimitedError) as caught:
+                provider.get_price("AAPL")
+            self.assertEqual(caught.exception.retry_after, 7.0)
+
+class TestQuoteStream(unittest.TestCase):
+    def wait_for(self, condition, timeout=5.0):
+        import time
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.01)
+
+    def test_tick_buffer_merges(self):
+        """Test only the latest tick per ticker survives until drained."""
+        buffer = TickBuffer()
+        buffer.put_many([("A", 1.0), ("B", 2.0), ("A", 3.0)])
+        buffer.put_many([("A", 4.0)])
+        self.assertEqual(buffer.drain(), {"A": 4.0, "B": 2.0})
+        self.assertEqual((buffer.received, buffer.merged), (4, 2))
+        self.assertEqual(buffer.drain(), {})
+
+    def test_malformed_ticks_dropped(self):
+        """Test bad ticks and lines never reach the portfolio."""
+        import socket
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 100.0))
+        portfolio.add_stock(Stock("MSFT", 1, 50.0))
+        server_end, client_end = socket.socketpair()
+        server_end.sendall(
+            b'{"ticks": [["MSFT", "abc"], ["MSFT", null], ["MSFT", NaN], ["MSFT", -1], '
+            b'["MSFT"], [1, 2.0], ["AAPL", 101.0]]}\n'
+            b'not json\n[1, 2]\n{"ticks": [["MSFT", 60.0]]}\n'
+        )
+        server_end.close()
+        stream = QuoteStream("127.0.0.1:1")
+        stream._read(client_end)
+        client_end.close()
+
+        self.assertEqual(sorted(stream.apply(portfolio)), ["AAPL", "MSFT"])
+        self.assertEqual(portfolio.get_stock("MSFT").price, 60.0)
+        self.assertEqual(portfolio.get_total_value(), 1010.0 + 60.0)
+
+    def test_apply_returns_held_and_records_history(self):
+        """Test apply reports only held tickers and records their ticks."""
+        test_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, test_dir)
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 100.0))
+        portfolio.history = HistoryStore(test_dir)
+        stream = QuoteStream("127.0.0.1:1")
+        stream.buffer.put_many([("AAPL", 101.0), ("XYZ", 5.0)])
+        when = datetime(2024, 3, 4, 9, 30)
+
+        self.assertEqual(stream.apply(portfolio, when), ["AAPL"])
+        portfolio.history.flush()
+        times, prices = portfolio.history.range("AAPL")
+        self.assertEqual((times.tolist(), prices.tolist()), ([when], [101.0]))
+        self.assertEqual(portfolio.history.tickers(), ["AAPL"])
+        self.assertEqual(stream.apply(portfolio), [])
+
+    def test_stream_to_portfolio(self):
+        """Test subscribed ticks are applied as one batch and unsubscribing stops them."""
+        portfolio = Portfolio()
+        portfolio.add_stock(Stock("AAPL", 10, 150.0))
+        portfolio.add_stock(Stock("MSFT", 1, 300.0))
+        events = []
+        portfolio.subscribe(events.append)
+
+        with FakeTickServer({"AAPL": 150.0, "MSFT": 300.0}, rate=2000) as server:
+            stream = QuoteStream(server.address, reconnect_delay=0.1)
+            stream.subscribe(["AAPL"])  # Sent once connected
+            stream.start()
+            try:
+                self.wait_for(lambda: stream.buffer.received > 0)
+                self.assertEqual(stream.apply(portfolio), ["AAPL"])
+                self.assertEqual(len(events), 1)
+                self.assertNotEqual(portfolio.get_stock("AAPL").price, 150.0)
+                self.assertEqual(portfolio.get_stock("MSFT").price, 300.0)
+
+                stream.unsubscribe(["AAPL"])
+                stream.subscribe(["MSFT"])
+                self.wait_for(lambda: "MSFT" in stream.buffer.drain())
+                self.assertNotIn("AAPL", stream.buffer.drain())
+            finally:
+                stream.close()
+        self.assertFalse(stream.connected)
+
+    def test_fast_ticks_merged(self):
+        """Test a fast stream costs at most one update per ticker per apply."""
+        tickers = [f"T{i}" for i in range(200)]
+        portfolio = Portfolio()
+        for ticker in tickers:
+            portfolio.add_stock(Stock(ticker, 1, 1.0))
+        with FakeTickServer(rate=20000) as server:
+            stream = QuoteStream(server.address).start()
+            stream.subscribe(tickers)
+            try:
+                self.wait_for(lambda: stream.buffer.received >= 2000)
+                applied = stream.apply(portfolio)
+            finally:
+                stream.close()
+        self.assertLessEqual(len(applied), len(tickers))
+        self.assertGreater(stream.buffer.merged, 0)
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        """Setup test fixture."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.path = self.test_dir / "transactions.csv"
+
+    def tearDown(self):
+        """Cleanup test fixture."""
+        shutil.rmtree(self.test_dir)
+
+    def trade(self, ledger):
+        ledger.buy("AAPL", 10, 100.0, datetime(2024, 1, 1))
+        ledger.buy("AAPL", 10, 120.0, datetime(2024, 2, 1))
+        return ledger.sell("AAPL", 15, 130.0, datetime(2024, 3, 1))
+
+    def test_fifo(self):
+        """Test sells use up the oldest lots first."""
+        ledger = Ledger("fifo")
+        pnl = self.trade(ledger)
+        self.assertAlmostEqual(pnl, 15 * 130 - (10 * 100 + 5 * 120))
+        position = ledger.position("AAPL")
+        self.assertEqual(position.quantity, 5)
+        self.assertAlmostEqual(position.cost_basis, 5 * 120.0)
+        self.assertEqual([(lot.quantity, lot.price) for lot in position.lots], [(5, 120.0)])
+        self.assertAlmostEqual(ledger.realized_pnl, pnl)
+
+    def test_average_cost(self):
+        """Test sells are costed at the average price."""
+        ledger = Ledger("average")
+        pnl = self.trade(ledger)
+        self.assertAlmostEqual(pnl, 15 * (130 - 110))
+        self.assertAlmostEqual(ledger.position("AAPL").average_cost, 110.0)
+        self.assertAlmostEqual(ledger.unrealized_pnl({"AAPL": 100.0}), 5 * (100 - 110))
+
+    def test_oversell_rejected(self):
+        """Test selling more than held fails and leaves the position alone."""
+        ledger = Ledger(path=self.path)
+        ledger.buy("AAPL", 5, 10.0)
+        with self.assertRaises(ValueError):
+            ledger.sell("AAPL", 6, 10.0)
+        self.assertEqual(ledger.position("AAPL").quantity, 5)
+        self.assertEqual(len(list(iter_transactions(self.path))), 1)
+
+    def test_rejected_trade_leaves_no_position(self):
+        """Test a rejected first trade doesn't leave an empty position behind."""
+        ledger = Ledger()
+        for side, quantity in (("hold", 1), ("sell", 1), ("buy", 0)):
+            with self.assertRaises(ValueError):
+                ledger.apply(Transaction("AAPL", side, quantity, 10.0, datetime(2024, 1, 1)))
+        self.assertIsNone(ledger.position("AAPL"))
+
+        self.path.write_text(
+            "Date,Ticker,Side,Quantity,Price\n"
+            "2024-01-01T00:00:00,AAPL,sell,1,1.0\n"
+            "not a date,MSFT,buy,1,1.0\n"
+        )
+        rebuilt = Ledger.from_file(self.path)
+        self.assertEqual(rebuilt.skipped_rows, 2)
+        self.assertEqual(rebuilt.positions(include_closed=True), {})
+
+    def test_file_round_trip(self):
+        """Test a ledger rebuilt from its file has the same totals."""
+        ledger = Ledger(path=self.path)
+        self.trade(ledger)
+        ledger.buy("MSFT", 3, 300.0)
+        ledger.sell("MSFT", 3, 290.0)
+
+        rebuilt = Ledger.from_file(self.path)
+        self.assertEqual(rebuilt.transaction_count, 5)
+        self.assertAlmostEqual(rebuilt.realized_pnl, ledger.realized_pnl)
+        self.assertAlmostEqual(rebuilt.cost_basis(), ledger.cost_basis())
+        self.assertEqual(list(rebuilt.positions()), ["AAPL"])
+
+        # The streaming build matches applying parsed transactions
+        slow = Ledger()
+        slow.apply_all(iter_transactions(self.path))
+        self.assertAlmostEqual(slow.realized_pnl, rebuilt.realized_pnl)
+
+        portfolio = rebuilt.to_portfolio({"AAPL": 150.0})
+        self.assertEqual(portfolio.get_total_value(), 5 * 150.0)
+
+    def test_bad_row_reports_line(self):
+        """Test a malformed row names its line in strict mode."""
+        self.path.write_text("Date,Ticker,Side,Quantity,Price\n2024-01-01T00:00:00,AAPL,hold,1,1.0\n")
+        with self.assertRaisesRegex(ValueError, ":2:"):
+            Ledger.from_file(self.path, strict=True)
+
+    def test_bad_rows_skipped(self):
+        """Test oversold rows and a torn last line are skipped, not fatal."""
+        ledger = Ledger(path=self.path)
+        ledger.buy("AAPL", 10, 100.0, datetime(2024, 1, 1))
+        with open(self.path, "a") as file:
+            file.write("2024-01-02T00:00:00,AAPL,sell,50,110.0\n2024-01-03T00:00:00,AAPL,se")
+
+        rebuilt = Ledger.from_file(self.path)
+        self.assertEqual(rebuilt.transaction_count, 1)
+        self.assertEqual(rebuilt.skipped_rows, 2)
+        self.assertEqual(rebuilt.position("AAPL").quantity, 10)
+
+        # New rows don't get glued onto the torn one
+        rebuilt.buy("AAPL", 1, 100.0, datetime(2024, 1, 4))
+        self.assertEqual(Ledger.from_file(self.path).position("AAPL").quantity, 11)
+
+class TestStartupImports(unittest.TestCase):
+    def test_heavy_modules_not_imported(self):
+        """Test the startup path doesn't pull in NumPy or yfinance."""
+        import subprocess
+        import sys
+        code = (
+            "import sys, auth, models, storage, cache, tasks; "
+            "print(','.join(m for m in ('numpy', 'yfinance', 'pandas') if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_import_profile_failure(self):
+        """Test a failed import is reported with its exit code, even with no stderr."""
+        import io
+        import subprocess
+        import main
+        failed = subprocess.CompletedProcess([], returncode=-9, stdout="", stderr="")
+        errors = io.StringIO()
+        with patch("subprocess.run", return_value=failed), patch("sys.stderr", errors), \
+                patch("sys.stdout", io.StringIO()):
+            self.assertEqual(main.profile_imports("gui"), [])
+        self.assertIn("exit code -9", errors.getvalue())
+
 if __name__ == '__main__':
-    unittest.main(verbosity=2)
\ No newline at end of file
+    unittest.main(verbosity=2)
@@ -0,0 +1,89 @@
+"""
+Row virtualization helpers for the holdings table.
+
+The table only owns enough row widgets to fill the window and rebinds
+them to different holdings as it scrolls. These helpers work out which
+holdings are visible and which cells actually need new text, so a redraw
+costs the size of the viewport instead of the size of the portfolio.
+Nothing here touches Tk, so it can be tested headless.
+"""
+from typing import Dict, List, Optional, Tuple
+from models import Stock
+
+# Text for each cell of a row: ticker, quantity, price, total value
+RowText = Tuple[str, str, str, str]
+
+def format_row(stock: Stock) -> RowText:
+    """
+    Format a holding for display.
+
+    Args:
+        stock: Holding to format
+
+    Returns:
+        Cell text for the row
+    """
+    return (
+        stock.ticker,
+        str(stock.quantity),
+        f"${stock.price:.2f}",
+        f"${stock.total_value:.2f}"
+    )
+
+def visible_range(total: int, first: int, capacity: int) -> Tuple[int, int]:
+    """
+    Clamp a scroll position to the rows that exist.
+
+    Args:
+        total: Number of rows in the table
+        first: Index of the requested first visible row
+        capacity: Number of rows the viewport can show
+
+    Returns:
+        (start, stop) indexes of the rows to show
+    """
+    first = max(0, min(first, total - capacity))
+    return first, min(total, first + capacity)
+
+class SlotCache:
+    """
+    Remembers what each recycled row slot is showing.
+
+    diff() returns only the cells whose text changed since the slot was
+    last drawn, so a refresh reconfigures changed prices and totals only.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty cache."""
+        self._shown: Dict[int, RowText] = {}
+
+    def diff(self, slot: int, row: RowText) -> List[Tuple[int, str]]:
+        """
+        Record the text a slot should show and return what changed.
+
+        Args:
+            slot: Index of the row slot
+            row: Text the slot should show
+
+        Returns:
+            (column, text) pairs for the cells that need reconfiguring
+        """
+        old: Optional[RowText] = self._shown.get(slot)
+        self._shown[slot] = row
+        if old is None:
+            return list(enumerate(row))
+        return [(col, text) for col, (was, text) in enumerate(zip(old, row)) if was != text]
+
+    def ticker(self, slot: int) -> Optional[str]:
+        """Ticker currently shown in a slot, or None if the slot is empty."""
+        row = self._shown.get(slot)
+        return row[0] if row else None
+
+    def clear(self, slot: int) -> bool:
+        """
+        Mark a slot as empty.
+
+        Returns:
+            True if the slot was showing a row
+        """
+        return self._shown.pop(slot, None) is not None